@@ -0,0 +1,172 @@
+#!/usr/bin/python 
+# -*- coding: utf-8 -*-
+
+'''
+Benchmarks the modules against the in-process SoftLayer simulator.
+
+For every account size (number of virtual guests and SSH keys) and scenario
+a fresh simulated account is populated and the scenario is run once. The
+number of API calls, the simulated wall time (API latency plus waits for
+transactions on the virtual clock) and the CPU time spent in the process
+are recorded.
+
+Usage:
+    python benchmarks/bench_softlayer.py [--sizes 10,100,1000,10000] [--json results.json]
+'''
+
+import os
+import sys
+import json
+import argparse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "tests"))
+
+import SoftLayer
+from softlayer_simulator import SimulatedSoftLayer, VirtualClock
+from simulated import instance_config, no_cache, DOMAIN
+from module_utils.softlayer.basic import *
+from softlayer_vs import SoftlayerVirtualServer, SoftlayerVirtualServerFleet, VSInstanceConfig, ChangeLog, \
+    SparePool, OrderVerifier, InstanceFacts
+from softlayer_ssh_keys import SshKeys, SshKeysConfig
+from softlayer_vs_credentials import CredentialsReader
+
+
+def sync_vs(simulator, config, check_mode=False, spare_pool_size=0, facts=None):
+    sl_client = simulator.client()
+    vs = SoftlayerVirtualServer(
+        sl_client, config, config_wait(),
+        VSInstanceIdIndex(SoftLayer.VSManager(sl_client), no_cache()),
+        Waiter(clock=simulator.clock.time, sleep=simulator.clock.sleep),
+        check_mode=check_mode,
+        spare_pool=SparePool(sl_client, spare_pool_size, "spares.local") if spare_pool_size else None,
+        facts=facts)
+    return vs.sync_config(ChangeLog())
+
+def config_wait():
+    return 3600
+
+def vs_create(simulator, size):
+    return sync_vs(simulator, instance_config(fqdn="new." + DOMAIN))
+
+def vs_create_from_pool(simulator, size):
+    config = instance_config(fqdn="new." + DOMAIN)
+    for i in range(2):
+        spare_id = simulator.add_guest("spare-{}-{}".format(SparePool.profile(config), i), "spares.local",
+                                       ssh_key_ids=[ssh_key["id"] for ssh_key in simulator.ssh_keys.values()][:2])
+        simulator.guests[spare_id]["powerState"] = {"keyName": "HALTED", "name": "Halted"}
+    return sync_vs(simulator, config, spare_pool_size=2)
+
+def vs_fleet_create(simulator, size):
+#   100 new instances of 2 profiles, each profile is verified once
+    sl_client = simulator.client()
+    configs = [instance_config(fqdn="new{}.{}".format(i, DOMAIN), datacenter=["ams01", "dal05"][i % 2])
+               for i in range(100)]
+    fleet = SoftlayerVirtualServerFleet(
+        sl_client, configs, config_wait(), 100,
+        VSInstanceIdIndex(SoftLayer.VSManager(sl_client), no_cache()),
+        Waiter(clock=simulator.clock.time, sleep=simulator.clock.sleep),
+        SshKeyIndex(sl_client), ImageIndex(sl_client),
+        order_verifier=OrderVerifier(sl_client, no_cache()))
+    return fleet.sync_config()
+
+def vs_noop(simulator, size):
+    return sync_vs(simulator, instance_config(fqdn="host0." + DOMAIN))
+
+def vs_noop_facts(simulator, size):
+#   the facts replace a softlayer_vs_ip and a softlayer_vs_credentials run
+    return sync_vs(simulator, instance_config(fqdn="host0." + DOMAIN), facts=InstanceFacts(with_credentials=True))
+
+def vs_recreate(simulator, size):
+    return sync_vs(simulator, instance_config(fqdn="host0." + DOMAIN, datacenter="dal05"))
+
+def vs_reload(simulator, size):
+    return sync_vs(simulator, instance_config(fqdn="host0." + DOMAIN, root_ssh_keys=["key0"]))
+
+def vs_upgrade(simulator, size):
+    return sync_vs(simulator, instance_config(fqdn="host0." + DOMAIN, CPUs="4", RAM="8GB", nic_speed="1Gb"))
+
+def vs_plan(simulator, size):
+    return sync_vs(simulator, instance_config(fqdn="host0." + DOMAIN, datacenter="dal05", CPUs="2",
+                                              root_ssh_keys=["key0"]), check_mode=True)
+
+def ssh_keys_sync(simulator, size):
+#   5% of the keys are relabeled, 5% removed and 5% new
+    changed = max(1, size // 20)
+    ssh_keys = []
+    for i in range(size):
+        if i < changed:
+            ssh_keys.append({"label": "renamed{}".format(i), "key": SimulatedSoftLayer.ssh_key_text(i)})
+        elif i >= size - changed:
+            ssh_keys.append({"label": "new{}".format(i), "key": SimulatedSoftLayer.ssh_key_text(size + i)})
+        else:
+            ssh_keys.append({"label": "key{}".format(i), "key": SimulatedSoftLayer.ssh_key_text(i)})
+    return SshKeys(simulator.client(), SshKeysConfig({"ssh_keys": ssh_keys, "parallelism": 10})).sync_config()
+
+def credentials_read(simulator, size):
+    sl_client = simulator.client()
+    reader = CredentialsReader(
+        sl_client, VSInstanceConfigBasic({"fqdn": "host0." + DOMAIN}),
+        VSInstanceIdIndex(SoftLayer.VSManager(sl_client), no_cache()))
+    return reader.read_credentials()
+
+SCENARIOS = [
+    ("vs_create", vs_create),
+    ("vs_create_from_pool", vs_create_from_pool),
+    ("vs_fleet_create", vs_fleet_create),
+    ("vs_noop", vs_noop),
+    ("vs_noop_facts", vs_noop_facts),
+    ("vs_recreate", vs_recreate),
+    ("vs_reload", vs_reload),
+    ("vs_upgrade", vs_upgrade),
+    ("vs_plan", vs_plan),
+    ("ssh_keys_sync", ssh_keys_sync),
+    ("credentials_read", credentials_read),
+]
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+def run(name, scenario, size):
+    simulator = SimulatedSoftLayer(VirtualClock())
+    simulator.populate(guests=size, ssh_keys=size)
+    simulator.reset_calls()
+    started_at = simulator.clock.time()
+    cpu_started_at = cpu_time()
+    scenario(simulator, size)
+    return {
+        "scenario": name,
+        "size": size,
+        "api_calls": len(simulator.calls),
+        "simulated_time": round(simulator.clock.time() - started_at, 3),
+        "cpu_time": round(cpu_time() - cpu_started_at, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the modules against the SoftLayer simulator")
+    parser.add_argument("--sizes", default="10,100,1000,10000",
+                        help="Comma separated account sizes i.e. number of guests and SSH keys")
+    parser.add_argument("--scenarios", default=",".join(name for name, _ in SCENARIOS),
+                        help="Comma separated scenarios to run")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    selected = args.scenarios.split(",")
+    results = []
+    print("{:<18} {:>7} {:>10} {:>15} {:>10}".format("scenario", "size", "api_calls", "simulated_time", "cpu_time"))
+    for name, scenario in SCENARIOS:
+        if name not in selected:
+            continue
+        for size in sizes:
+            result = run(name, scenario, size)
+            results.append(result)
+            print("{scenario:<18} {size:>7} {api_calls:>10} {simulated_time:>15.3f} {cpu_time:>10.3f}".format(**result))
+    if args.json is not None:
+        with open(args.json, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+if __name__ == '__main__':
+    main()
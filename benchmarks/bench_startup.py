@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmarks the cold start of the modules.
+
+Every module is started in a fresh interpreter, the way Ansible runs it for
+each host, a number of times. Two timings are recorded, as the median wall
+time of the runs: importing the module and running it up to the point where
+it rejects its arguments, which is everything a run costs before the first
+API call. The time of a bare interpreter is given for reference, along with
+whether the SoftLayer client library got imported on the way.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 20] [--modules softlayer_vs,...] [--json results.json]
+'''
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "softlayer_vs",
+    "softlayer_ssh_keys",
+    "softlayer_vs_ip",
+    "softlayer_vs_credentials",
+    "softlayer_vs_wait",
+]
+
+IMPORT_CODE = "import sys; sys.path.insert(0, {!r}); import {}; print('SoftLayer' in sys.modules)"
+
+def timed(command):
+    """Wall time of running command and its standard output"""
+    started_at = time.time()
+    process = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, _ = process.communicate()
+    return time.time() - started_at, out.decode("utf-8")
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+def run(module, runs, args_path):
+    import_times = []
+    startup_times = []
+    softlayer_loaded = False
+    for _ in range(runs):
+        import_time, out = timed([sys.executable, "-c", IMPORT_CODE.format(REPO_DIR, module)])
+        import_times.append(import_time)
+        softlayer_loaded = softlayer_loaded or out.strip().endswith("True")
+#       an unknown option makes the module fail on its arguments, before
+#       any client is created
+        startup_time, out = timed([sys.executable, os.path.join(REPO_DIR, module + ".py"), args_path])
+        if "no_such_option" not in out:
+            raise RuntimeError("{} did not fail on its arguments: {}".format(module, out))
+        startup_times.append(startup_time)
+    return {
+        "module": module,
+        "runs": runs,
+        "import_time": round(median(import_times), 4),
+        "startup_time": round(median(startup_times), 4),
+        "softlayer_loaded": softlayer_loaded
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the cold start of the modules")
+    parser.add_argument("--runs", type=int, default=20, help="Number of fresh interpreters per module")
+    parser.add_argument("--modules", default=",".join(MODULES), help="Comma separated modules to start")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    fd, args_path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w") as args_file:
+        json.dump({"ANSIBLE_MODULE_ARGS": {"no_such_option": True}}, args_file)
+    try:
+        interpreter_time = median([timed([sys.executable, "-c", "pass"])[0] for _ in range(args.runs)])
+        print("python interpreter: {:.4f}".format(interpreter_time))
+        print("{:<26} {:>5} {:>12} {:>13} {:>17}".format("module", "runs", "import_time", "startup_time", "softlayer_loaded"))
+        results = []
+        for module in args.modules.split(","):
+            result = run(module, args.runs, args_path)
+            results.append(result)
+            print("{module:<26} {runs:>5} {import_time:>12.4f} {startup_time:>13.4f} {softlayer_loaded!s:>17}".format(**result))
+    finally:
+        os.remove(args_path)
+    if args.json is not None:
+        with open(args.json, "w") as results_file:
+            json.dump({"interpreter_time": round(interpreter_time, 4), "modules": results}, results_file, indent=2)
+
+if __name__ == '__main__':
+    main()
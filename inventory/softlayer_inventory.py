@@ -0,0 +1,177 @@
+#!/usr/bin/python 
+# -*- coding: utf-8 -*-
+
+'''
+SoftLayer external inventory script.
+
+Lists every virtual guest of the account as a host named by its fqdn with
+its ip addresses, datacenter, power state, CPUs, RAM and tags as host
+variables. Hosts are grouped by datacenter, domain and tag.
+
+The guests are kept in a local cache. Subsequent runs only fetch the guests
+whose modifyDate changed since the last sync, plus a cheap id listing to
+drop canceled guests and to fetch any other guest missing from the cache. A full listing is done every
+SL_INVENTORY_FULL_SYNC_INTERVAL seconds (default 3600) or with --refresh.
+
+Credentials are read from .softlayer or SL_USERNAME / SL_API_KEY env
+variables. The cache is stored in SL_CACHE_DIR (default ~/.ansible/tmp/softlayer).
+The API calls go through a running scripts/softlayer_broker.py unless SL_BROKER=no.
+They are limited to SL_API_RATE_LIMIT calls per second (default 10).
+
+Usage:
+    inventory/softlayer_inventory.py --list
+    inventory/softlayer_inventory.py --host <fqdn>
+    inventory/softlayer_inventory.py --list --refresh
+'''
+
+import sys
+import os
+import re
+import json
+import time
+import argparse
+import datetime
+
+# the module_utils package lives one level above the inventory directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from ansible.module_utils.softlayer.readers import *
+except ImportError:
+    from module_utils.softlayer.readers import *
+
+class SoftLayerInventory(object):
+    _inventory_mask = ",".join([
+        IpAddressReader._ip_addresses_mask,
+        "modifyDate",
+        "datacenter.name",
+        "powerState.keyName",
+        "maxCpu",
+        "maxMemory",
+        "tagReferences.tag.name"])
+#   modifyDate is compared with a margin so that changes done while the
+#   previous sync was running are not missed
+    _sync_margin = datetime.timedelta(minutes=1)
+
+    def __init__(self, sl_client, cache, full_sync_interval):
+        self._sl_account = sl_client['Account']
+        self._cache = cache
+        self._full_sync_interval = full_sync_interval
+
+    def hosts(self, full_sync=False):
+        state = self._cache.load()
+        if full_sync or state is None \
+            or time.time() - state["full_sync_at"] > self._full_sync_interval:
+            state = self.__full_sync()
+        else:
+            state = self.__incremental_sync(state)
+        self._cache.store(state)
+        return state["hosts"]
+
+    def __full_sync(self):
+        sl_instances = self._sl_account.getVirtualGuests(mask=self._inventory_mask)
+        return self.__state(dict(self.__host(sl_instance) for sl_instance in sl_instances),
+                            time.time())
+
+    def __incremental_sync(self, state):
+        current_ids = set(str(sl_instance["id"]) for sl_instance in
+                          self._sl_account.getVirtualGuests(mask="id"))
+        hosts = dict((instance_id, host) for instance_id, host in state["hosts"].items()
+                     if instance_id in current_ids)
+        hosts.update(self.__host(sl_instance) for sl_instance in self.__modified_since(state["last_modify_date"]))
+#       guests which are not known yet but were not modified since the last
+#       sync either, e.g. when the cache was stored by a sync that failed
+        unknown_ids = current_ids - set(hosts.keys())
+        if len(unknown_ids) != 0:
+            unknown = self._sl_account.getVirtualGuests(
+                mask=self._inventory_mask,
+                filter={"virtualGuests": {"id": in_filter(sorted(int(instance_id) for instance_id in unknown_ids))}})
+            hosts.update(self.__host(sl_instance) for sl_instance in unknown)
+        return self.__state(hosts, state["full_sync_at"])
+
+    def __modified_since(self, last_modify_date):
+        """The guests modified since last_modify_date, all of them when no
+        guest had a modifyDate yet.
+        """
+        if last_modify_date is None:
+            return self._sl_account.getVirtualGuests(mask=self._inventory_mask)
+        return self._sl_account.getVirtualGuests(
+            mask=self._inventory_mask,
+            filter={"virtualGuests": {"modifyDate": {
+                "operation": "greaterThanDate",
+                "options": [{"name": "date", "value": [self.__filter_date(last_modify_date)]}]}}})
+
+    def __state(self, hosts, full_sync_at):
+        modify_dates = [host["softlayer_modify_date"] for host in hosts.values()
+                        if host["softlayer_modify_date"] is not None]
+        return {
+            "hosts": hosts,
+            "full_sync_at": full_sync_at,
+            "last_modify_date": max(modify_dates) if len(modify_dates) != 0 else None
+        }
+
+    def __filter_date(self, modify_date):
+#       modifyDate is in the account timezone e.g. 2016-01-02T10:20:30-06:00
+#       and object filters expect the same wall clock time
+        since = datetime.datetime.strptime(modify_date[:19], "%Y-%m-%dT%H:%M:%S") - self._sync_margin
+        return since.strftime("%m/%d/%Y %H:%M:%S")
+
+    def __host(self, sl_instance):
+        ip_addresses = IpAddressReader.ip_addresses(sl_instance)
+        return (str(sl_instance["id"]), {
+            "softlayer_id": sl_instance["id"],
+            "softlayer_fqdn": "{}.{}".format(sl_instance["hostname"], sl_instance["domain"]),
+            "softlayer_domain": sl_instance["domain"],
+            "ansible_host": ip_addresses["primaryIpAddress"] or ip_addresses["primaryBackendIpAddress"],
+            "softlayer_ip_addresses": ip_addresses,
+            "softlayer_datacenter": sl_instance.get("datacenter", {}).get("name"),
+            "softlayer_power_state": sl_instance.get("powerState", {}).get("keyName"),
+            "softlayer_cpus": sl_instance.get("maxCpu"),
+            "softlayer_ram": sl_instance.get("maxMemory"),
+            "softlayer_tags": [tag_reference["tag"]["name"] for tag_reference
+                               in sl_instance.get("tagReferences", [])],
+            "softlayer_modify_date": sl_instance.get("modifyDate")
+        })
+
+    @staticmethod
+    def inventory(hosts):
+        groups = {"softlayer": {"hosts": []}}
+        hostvars = {}
+        for host in hosts.values():
+            fqdn = host["softlayer_fqdn"]
+            hostvars[fqdn] = host
+            groups["softlayer"]["hosts"].append(fqdn)
+            group_names = ["domain_" + host["softlayer_domain"]]
+            if host["softlayer_datacenter"] is not None:
+                group_names.append("datacenter_" + host["softlayer_datacenter"])
+            group_names.extend("tag_" + tag for tag in host["softlayer_tags"])
+            for group_name in group_names:
+                groups.setdefault(SoftLayerInventory.group_name(group_name), {"hosts": []})["hosts"].append(fqdn)
+        groups["_meta"] = {"hostvars": hostvars}
+        return groups
+
+    @staticmethod
+    def group_name(name):
+        return re.sub(r"[^A-Za-z0-9_]", "_", name)
+
+def main():
+    parser = argparse.ArgumentParser(description="SoftLayer dynamic inventory")
+    parser.add_argument("--list", action="store_true", help="List all the hosts")
+    parser.add_argument("--host", help="Show the variables of a single host")
+    parser.add_argument("--refresh", action="store_true", help="Do a full listing ignoring the cache")
+    args = parser.parse_args()
+
+    sl_client_config = SLClientConfig({})
+    sl_client = create_sl_client(sl_client_config)
+    inventory = SoftLayerInventory(
+        sl_client,
+        JsonFileCache.for_account("inventory", sl_client, sl_client_config, 7 * 24 * 3600),
+        int(os.environ.get("SL_INVENTORY_FULL_SYNC_INTERVAL", 3600)))
+    groups = SoftLayerInventory.inventory(inventory.hosts(args.refresh))
+    if args.host is not None:
+        json.dump(groups["_meta"]["hostvars"].get(args.host, {}), sys.stdout)
+    else:
+        json.dump(groups, sys.stdout)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+"""Code shared by the SoftLayer modules.
+
+Ansible ships this package along with the modules importing it as
+ansible.module_utils.softlayer. Run from a checkout, the modules import it
+as module_utils.softlayer instead.
+"""
+import importlib
+
+
+class LazyModule(object):
+    """Stands in for a module that is only imported when one of its
+    attributes is first used, so that runs which never reach the API, like
+    those failing on their arguments, do not pay for the import.
+    """
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
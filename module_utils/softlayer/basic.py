@@ -0,0 +1,483 @@
+"""Virtual server basics shared by the SoftLayer modules."""
+import re
+import collections
+import time
+import random
+import threading
+try:
+    from ansible.module_utils.softlayer import LazyModule
+    from ansible.module_utils.softlayer.client import *
+except ImportError:
+    from module_utils.softlayer import LazyModule
+    from module_utils.softlayer.client import *
+
+SoftLayer = LazyModule("SoftLayer")
+
+class SoftlayerVirtualServerBasic(object):
+    __cached_sl_instance_id = None
+    
+    def __init__(self, sl_client, instance_config, instance_id_index=None, instance_poller=None):
+        self.sl_vs_manager = SoftLayer.VSManager(sl_client)
+        self.sl_client = sl_client
+        self.ic = instance_config
+        self.sl_virtual_guest = sl_client['Virtual_Guest']
+        self._instance_id_index = instance_id_index
+        self._instance_poller = instance_poller
+
+    def get_vs_id(self, cached_id=True):
+        if cached_id == True and self._instance_id_index is not None:
+            return self._instance_id_index.get(self.ic.fqdn)
+        if cached_id == True and self.__cached_sl_instance_id is not None:
+            return self.__cached_sl_instance_id
+        result = self.single_result(
+            self.sl_vs_manager.list_instances(
+                hostname=self.ic.get_host(),
+                domain=self.ic.get_domain(),
+                mask="id"))
+        if result is None:
+            self.__cached_sl_instance_id = None
+            return None
+        elif not cached_id:
+            self.__cached_sl_instance_id = None
+        else:
+            self.__cached_sl_instance_id = result.get("id")
+        return result.get("id")        
+    
+    def get_vs_object(self, mask):
+        """getObject of the instance or None if there is none. The id from
+        the instance index may belong to an instance cancelled since the
+        index was cached, so on ObjectNotFound the index is listed again
+        once and the id resolved anew.
+        """
+        instance_id = self.get_vs_id()
+        if instance_id is None:
+            return None
+        try:
+            return self.sl_virtual_guest.getObject(id=instance_id, mask=mask)
+        except SoftLayer.SoftLayerAPIError as sl_error:
+            if sl_error.faultCode != "SoftLayer_Exception_ObjectNotFound" or self._instance_id_index is None:
+                raise
+        self._instance_id_index.refresh()
+        instance_id = self.get_vs_id()
+        if instance_id is None:
+            return None
+        return self.sl_virtual_guest.getObject(id=instance_id, mask=mask)
+
+    def set_vs_id(self, instance_id):
+        if self._instance_id_index is not None:
+            self._instance_id_index.put(self.ic.fqdn, instance_id)
+        self.__cached_sl_instance_id = instance_id
+
+    _ready_mask = "id,provisionDate,activeTransaction.id"
+#   what waits poll for, the readiness and the sizing upgrades are waited for
+    _poll_mask = ",".join([_ready_mask, "maxCpu", "maxMemory", "networkComponents.maxSpeed"])
+
+    def poll(self, instance_id):
+        """The instance read with _poll_mask for a wait. Through the shared
+        InstancePoller when there is one, which returns None for instances
+        it does not list.
+        """
+        if self._instance_poller is not None:
+            return self._instance_poller.get(instance_id)
+        return self.sl_virtual_guest.getObject(id=instance_id, mask=SoftlayerVirtualServerBasic._poll_mask)
+
+    def is_ready(self, instance_id):
+        sl_instance = self.poll(instance_id)
+        return sl_instance is not None and SoftlayerVirtualServerBasic.ready(sl_instance)
+
+    @staticmethod
+    def ready(sl_instance):
+        """True if sl_instance, read with at least _ready_mask, is provisioned
+        and has no transaction running.
+        """
+        return bool(sl_instance.get("provisionDate")) and not sl_instance.get("activeTransaction")
+
+    def is_gone(self, instance_id):
+        try:
+            self.sl_virtual_guest.getObject(id=instance_id, mask="id")
+        except SoftLayer.SoftLayerAPIError as sl_error:
+            if sl_error.faultCode == "SoftLayer_Exception_ObjectNotFound":
+                return True
+            raise
+        return False
+
+    def single_result(self, result_list):
+        if len(result_list) == 0:
+            return None
+        else: return result_list[0]  
+
+
+class InstancePoller(object):
+    """Polls the instances waited for by concurrent threads, e.g. those of a
+    fleet, with one Account::getVirtualGuests listing filtered by their ids,
+    like softlayer_vs_wait, instead of a getObject per instance and poll.
+    A poll is answered from the latest listing if it was made since the
+    previous poll of the same wait, so that the waits of a fleet take about
+    one listing per poll interval, else it lists the instances anew. The
+    first poll of a wait always lists them, to see the action waited for.
+    """
+    def __init__(self, sl_client):
+        self._sl_account = sl_client['Account']
+        self._lock = threading.Lock()
+#       the number of the listing every waited for instance needs to be
+#       answered from a later one than
+        self._answered = {}
+        self._listings = 0
+        self._listed_ids = frozenset()
+        self._listed = {}
+
+    def get(self, instance_id):
+        """The instance read with SoftlayerVirtualServerBasic._poll_mask or
+        None if it is not listed. A wait is over once the instance is ready.
+        """
+        with self._lock:
+            answered = self._answered.setdefault(instance_id, self._listings)
+            if self._listings == answered or instance_id not in self._listed_ids:
+                self.__list()
+            sl_instance = self._listed.get(instance_id)
+            if sl_instance is not None and SoftlayerVirtualServerBasic.ready(sl_instance):
+                del self._answered[instance_id]
+            else:
+                self._answered[instance_id] = self._listings
+            return sl_instance
+
+    def __list(self):
+        instance_ids = sorted(self._answered.keys())
+        sl_instances = self._sl_account.getVirtualGuests(
+            mask=SoftlayerVirtualServerBasic._poll_mask,
+            filter={"virtualGuests": {"id": in_filter(instance_ids)}})
+        self._listings += 1
+        self._listed_ids = frozenset(instance_ids)
+        self._listed = dict((sl_instance["id"], sl_instance) for sl_instance in sl_instances)
+
+
+class VSInstanceIdIndex(object):
+    """Maps the fqdn of every instance in the account to its id.
+
+    The index is built from a single account-wide listing and kept in a
+    local cache file, so that all the modules of a play share one discovery.
+    """
+    def __init__(self, sl_vs_manager, cache):
+        self._sl_vs_manager = sl_vs_manager
+        self._cache = cache
+        self._ids_by_fqdn = None
+        self._fresh = False
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def for_client(sl_client, sl_client_config):
+        return VSInstanceIdIndex(
+            SoftLayer.VSManager(sl_client),
+            JsonFileCache.for_account("instance_ids", sl_client, sl_client_config,
+                                      sl_client_config.instance_cache_ttl))
+
+    def get(self, fqdn):
+        with self._lock:
+            if self._ids_by_fqdn is None:
+                self._ids_by_fqdn = self._cache.load()
+            if self._ids_by_fqdn is None:
+                self.refresh()
+#           the cached index may be older than the instance, so a miss
+#           is only trusted once the index was listed by this process
+            if fqdn not in self._ids_by_fqdn and not self._fresh:
+                self.refresh()
+            return self._ids_by_fqdn.get(fqdn)
+
+    def put(self, fqdn, instance_id):
+        with self._lock:
+            if self._ids_by_fqdn is not None:
+                if instance_id is None:
+                    self._ids_by_fqdn.pop(fqdn, None)
+                else:
+                    self._ids_by_fqdn[fqdn] = instance_id
+            self._cache.invalidate()
+
+    def refresh(self):
+        with self._lock:
+            ids_by_fqdn = {}
+            for sl_instance in self._sl_vs_manager.list_instances(mask="id,hostname,domain"):
+                fqdn = "{}.{}".format(sl_instance["hostname"], sl_instance["domain"])
+                ids_by_fqdn.setdefault(fqdn, sl_instance["id"])
+            self._ids_by_fqdn = ids_by_fqdn
+            self._fresh = True
+            self._cache.store(ids_by_fqdn)
+
+
+class SshKeyIndex(object):
+    """Maps the labels of the SSH keys in the account to their ids. Built
+    with a single listing on first use and reused for the rest of the run
+    and, when a cache is given, by subsequent runs.
+    """
+    def __init__(self, sl_client, cache=None):
+        self._sl_account = sl_client['Account']
+        self._cache = cache
+        self._ids_by_label = None
+        self._fresh = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_client(sl_client, sl_client_config):
+        return SshKeyIndex(
+            sl_client,
+            JsonFileCache.for_account("ssh_key_ids", sl_client, sl_client_config,
+                                      sl_client_config.instance_cache_ttl))
+
+    def key_ids(self, labels):
+        """Returns the ids of the keys with the given labels together with
+        the list of labels not found in the account.
+        """
+        with self._lock:
+            if self._ids_by_label is None and self._cache is not None:
+                self._ids_by_label = self._cache.load()
+            if self._ids_by_label is None \
+                or (not self._fresh and any(label not in self._ids_by_label for label in labels)):
+                self.__refresh()
+            key_ids = [self._ids_by_label[label] for label in labels if label in self._ids_by_label]
+            missing_labels = [label for label in labels if label not in self._ids_by_label]
+            return key_ids, missing_labels
+
+    def __refresh(self):
+        self._ids_by_label = dict(
+            (sl_ssh_key["label"], sl_ssh_key["id"])
+            for sl_ssh_key in self._sl_account.getSshKeys(mask="id,label"))
+        self._fresh = True
+        if self._cache is not None:
+            self._cache.store(self._ids_by_label)
+
+
+class ImageIndex(object):
+    """Maps the names and global identifiers of image templates to their
+    id, globalIdentifier and name. The private images of the account are
+    listed at once, public images are looked up one at a time when not
+    found among them. Cached like SshKeyIndex.
+    """
+    _image_mask = "id,name,globalIdentifier"
+    _guid_pattern = re.compile("^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+    def __init__(self, sl_client, cache=None):
+        self._sl_account = sl_client['Account']
+        self._sl_image_templates = sl_client['Virtual_Guest_Block_Device_Template_Group']
+        self._cache = cache
+        self._images = None
+        self._fresh = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_client(sl_client, sl_client_config):
+        return ImageIndex(
+            sl_client,
+            JsonFileCache.for_account("images", sl_client, sl_client_config,
+                                      sl_client_config.instance_cache_ttl))
+
+    def image(self, name_or_guid):
+        """The image with the given name or global identifier or None"""
+        with self._lock:
+            if self._images is None and self._cache is not None:
+                self._images = self._cache.load()
+            if self._images is None or (not self._fresh and name_or_guid not in self._images):
+                self.__refresh()
+            if name_or_guid not in self._images:
+                self.__add_public_image(name_or_guid)
+            return self._images.get(name_or_guid)
+
+    def __refresh(self):
+        self._images = {}
+        for sl_image in self._sl_account.getPrivateBlockDeviceTemplateGroups(mask=self._image_mask):
+            self.__add(sl_image)
+        self._fresh = True
+        self.__store()
+
+    def __add_public_image(self, name_or_guid):
+        field = "globalIdentifier" if self._guid_pattern.match(name_or_guid) else "name"
+        sl_images = self._sl_image_templates.getPublicImages(
+            mask=self._image_mask, filter={field: {"operation": name_or_guid}})
+        if len(sl_images) != 0:
+            self.__add(sl_images[0])
+            self.__store()
+
+    def __add(self, sl_image):
+        image = dict((field, sl_image.get(field)) for field in ["id", "name", "globalIdentifier"])
+        for key in [image["globalIdentifier"], image["name"]]:
+            if key:
+                self._images[key] = image
+
+    def __store(self):
+        if self._cache is not None:
+            self._cache.store(self._images)
+
+
+class Waiter(object):
+    """Polls a condition with exponential backoff and jitter until it holds
+    or the deadline passes, keeping count of the polls made and the time
+    spent waiting.
+    """
+    def __init__(self, initial_interval=1.0, max_interval=5.0, backoff_factor=2.0,
+                 jitter=0.2, clock=time.time, sleep=time.sleep):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self._clock = clock
+        self._sleep = sleep
+        self.polls = 0
+        self.waited = 0.0
+
+    @staticmethod
+    def from_params(params, clock=time.time, sleep=time.sleep):
+        return Waiter(
+            initial_interval=params.get("wait_initial_interval", 1.0),
+            max_interval=params.get("wait_max_interval", 5.0),
+            backoff_factor=params.get("wait_backoff_factor", 2.0),
+            jitter=params.get("wait_jitter", 0.2),
+            clock=clock, sleep=sleep)
+
+    def clone(self):
+        return Waiter(self.initial_interval, self.max_interval, self.backoff_factor,
+                      self.jitter, self._clock, self._sleep)
+
+    def wait(self, condition, timeout):
+        started = self._clock()
+        deadline = started + timeout
+        interval = self.initial_interval
+        try:
+            while True:
+                self.polls += 1
+                if condition():
+                    return True
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    return False
+                delay = interval * (1 + random.uniform(-self.jitter, self.jitter))
+                self._sleep(max(0, min(delay, remaining)))
+                interval = min(interval * self.backoff_factor, self.max_interval)
+        finally:
+            self.waited += self._clock() - started
+
+    def stats(self):
+        return {"polls": self.polls, "waited": round(self.waited, 3)}
+
+    @staticmethod
+    def arg_spec():
+        return dict(
+            wait_initial_interval = dict(type = 'float', default = 1.0),
+            wait_max_interval = dict(type = 'float', default = 5.0),
+            wait_backoff_factor = dict(type = 'float', default = 2.0),
+            wait_jitter = dict(type = 'float', default = 0.2),
+        )
+
+
+class VSInstanceConfigBasic(object):
+    def __init__(self, ansible_config=None):
+        self.from_ansible_config(ansible_config)
+           
+    def from_ansible_config(self, ansible_config):
+        self.fqdn = ansible_config.get("fqdn")
+  
+    def get_host(self):
+        return self.fqdn.partition(".")[0]
+         
+    def get_domain(self):
+        (hostname, dot, domain) = self.fqdn.partition(".")
+        if domain == "":
+            return hostname
+        else:
+            return domain
+         
+    @staticmethod
+    def arg_spec():
+        return dict(
+            fqdn = dict(type = 'str', required=True),
+        )
+
+
+def run_concurrently(func, items, max_workers):
+    """Applies func to every item on a bounded pool of worker threads and
+    returns the results in the order of items.
+    """
+    if len(items) == 0:
+        return []
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(max(1, min(max_workers, len(items))))
+    try:
+        return pool.map(func, items, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def in_filter(values):
+    """Object filter operation matching any of the given values."""
+    return {"operation": "in", "options": [{"name": "data", "value": list(values)}]}
+
+
+def merge_masks(*masks):
+    """Object mask selecting the properties of all the masks, where each
+    property is given once, e.g. a.b and a[c] become a[b,c].
+    """
+    properties = collections.OrderedDict()
+    for mask in masks:
+        _merge_mask_properties(properties, _mask_properties(mask))
+    return _format_mask(properties)
+
+
+def _mask_properties(mask):
+    """Nested dicts of the properties of a mask like a,b.c,d[e,f[g]]"""
+    properties = collections.OrderedDict()
+    depth = 0
+    start = 0
+    items = []
+    for position, char in enumerate(mask):
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append(mask[start:position])
+            start = position + 1
+    items.append(mask[start:])
+    for item in items:
+        item = item.strip()
+        if item == "":
+            continue
+        name = re.match(r"[^.\[]*", item).group(0)
+        rest = item[len(name):]
+        if rest.startswith("."):
+            children = _mask_properties(rest[1:])
+        elif rest.startswith("["):
+            children = _mask_properties(rest[1:-1])
+        else:
+            children = collections.OrderedDict()
+        _merge_mask_properties(properties, {name: children})
+    return properties
+
+
+def _merge_mask_properties(properties, other_properties):
+    for name, children in other_properties.items():
+        _merge_mask_properties(properties.setdefault(name, collections.OrderedDict()), children)
+
+
+def _format_mask(properties):
+    return ",".join(
+        "{}[{}]".format(name, _format_mask(children)) if children else name
+        for name, children in properties.items())
+
+
+class VSException(Exception):
+    def __init__(self, changed, msg):
+        self._changed = changed
+        self._msg = msg
+    def __str__(self):
+        return "Exception: {} Changed: {}, MSG: {}".format(type(self), self.changed(), self.msg())
+    def changed(self):
+        return self._changed
+    def msg(self):
+        return self._msg
+
+
+class SSHKeyException(Exception):
+    def __init__(self, msg):
+        self._msg = msg
+    def __str__(self):
+        return "Exception: {}, MSG: {}".format(type(self), self._msg)
+    def msg(self):
+        return self._msg
@@ -0,0 +1,509 @@
+"""SoftLayer clients and their transports for the broker, rate limiting,
+retries and instrumentation, plus the local caches and locks shared by the
+module runs of an account.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import random
+import socket
+import hashlib
+import tempfile
+import threading
+try:
+    from ansible.module_utils.softlayer import LazyModule
+except ImportError:
+    from module_utils.softlayer import LazyModule
+
+SoftLayer = LazyModule("SoftLayer")
+
+
+class JsonFileCache(object):
+    """A JSON document stored in a local file which expires ttl seconds
+    after it was written. A ttl of 0 disables the cache.
+    """
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+
+    @staticmethod
+    def for_account(name, sl_client, sl_client_config, ttl):
+        """The cache of the given name for the account of sl_client. Held by
+        the broker when the client talks to one, in cache_dir otherwise.
+        """
+        broker_transport = find_transport(sl_client, BrokerTransport)
+        if broker_transport is not None:
+            return BrokerCache(broker_transport, "{}-{}".format(name, account_key(sl_client, sl_client_config)), ttl)
+        return JsonFileCache(
+            os.path.join(sl_client_config.cache_dir,
+                         "{}-{}.json".format(name, account_key(sl_client, sl_client_config))),
+            ttl)
+
+    def load(self):
+        if not self.ttl:
+            return None
+        try:
+            if time.time() - os.path.getmtime(self.path) > self.ttl:
+                return None
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def store(self, data):
+        if not self.ttl:
+            return
+        try:
+            cache_dir = os.path.dirname(self.path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir, 0o700)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump(data, cache_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def invalidate(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class FileLock(object):
+    """An exclusive flock on a file in cache_dir, shared by all the
+    processes of the controller i.e. by all the forks of a play, and by
+    the threads of the process.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock_file = None
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def for_account(name, sl_client, sl_client_config):
+        return FileLock(os.path.join(sl_client_config.cache_dir,
+                                     "{}-{}.lock".format(name, account_key(sl_client, sl_client_config))))
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            lock_dir = os.path.dirname(self.path)
+            if not os.path.isdir(lock_dir):
+                try:
+                    os.makedirs(lock_dir, 0o700)
+                except OSError as os_error:
+                    if os_error.errno != errno.EEXIST:
+                        raise
+            self._lock_file = open(self.path, "a")
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        except Exception:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        finally:
+            self._thread_lock.release()
+
+    
+class BrokerTransport(object):
+    """Sends the calls through a local softlayer_broker process, which keeps
+    warm keep-alive clients and shared caches across module runs. Falls
+    back to a direct client whenever the broker cannot be reached.
+    """
+    def __init__(self, socket_path, username, api_key):
+        self.socket_path = socket_path
+        self.username = username
+        self._api_key = api_key
+        self._direct_client = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def connect(socket_path, username, api_key, start=False):
+        """A transport talking to the broker listening on socket_path or None
+        if there is none. With start the broker is started when not running.
+        """
+        broker_transport = BrokerTransport(socket_path, username, api_key)
+        if broker_transport.ping():
+            return broker_transport
+        if not start or not BrokerTransport.start(socket_path):
+            return None
+        for attempt in range(50):
+            time.sleep(0.1)
+            if broker_transport.ping():
+                return broker_transport
+        return None
+
+    @staticmethod
+    def start(socket_path):
+#       the broker lives in the scripts directory next to the modules, two
+#       levels above this package
+        broker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     os.pardir, os.pardir, "scripts", "softlayer_broker.py")
+        if not os.path.isfile(broker_script):
+            return False
+        socket_dir = os.path.dirname(socket_path)
+        if not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir, 0o700)
+        import subprocess
+        with open(os.devnull, "r+") as devnull:
+            subprocess.Popen([sys.executable, broker_script, "--socket", socket_path],
+                             stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, preexec_fn=os.setsid)
+        return True
+
+    def ping(self):
+        try:
+            return self.request({"op": "ping"}).get("result") == "pong"
+        except (socket.error, IOError, ValueError):
+            return False
+
+    def request(self, message):
+        broker_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            broker_socket.connect(self.socket_path)
+            broker_socket.sendall((json.dumps(message, default=str) + "\n").encode("utf-8"))
+            response = b""
+            while not response.endswith(b"\n"):
+                chunk = broker_socket.recv(65536)
+                if not chunk:
+                    raise IOError("Broker closed the connection")
+                response += chunk
+            return json.loads(response.decode("utf-8"))
+        finally:
+            broker_socket.close()
+
+    def __call__(self, request):
+        message = {
+            "op": "call",
+            "username": self.username,
+            "api_key": self._api_key,
+            "service": request.service,
+            "method": request.method,
+            "args": list(request.args),
+            "id": request.identifier,
+            "mask": request.mask,
+            "filter": request.filter,
+            "limit": request.limit,
+            "offset": request.offset
+        }
+        try:
+            response = self.request(message)
+        except socket.error as broker_error:
+#           only calls the broker never received are safe to repeat directly
+            if broker_error.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+            return self.__direct_call(request)
+        if "error" in response:
+            raise SoftLayer.SoftLayerAPIError(response["error"]["faultCode"], response["error"]["faultString"])
+        return response["result"]
+
+    def __direct_call(self, request):
+        with self._lock:
+            if self._direct_client is None:
+                self._direct_client = SoftLayer.Client(username=self.username, api_key=self._api_key)
+        return self._direct_client.call(request.service, request.method, *request.args,
+                                        id=request.identifier, mask=request.mask, filter=request.filter,
+                                        limit=request.limit, offset=request.offset)
+
+
+class BrokerCache(object):
+    """Same as JsonFileCache, but the document is held by the broker."""
+    def __init__(self, broker_transport, key, ttl):
+        self._broker_transport = broker_transport
+        self.key = key
+        self.ttl = ttl
+
+    def load(self):
+        if not self.ttl:
+            return None
+        return self.__request({"op": "cache_get", "key": self.key, "ttl": self.ttl}).get("result")
+
+    def store(self, data):
+        if not self.ttl:
+            return
+        self.__request({"op": "cache_put", "key": self.key, "value": data})
+
+    def invalidate(self):
+        self.__request({"op": "cache_invalidate", "key": self.key})
+
+    def __request(self, message):
+        try:
+            return self._broker_transport.request(message)
+        except (socket.error, IOError, ValueError):
+            return {}
+
+
+def account_key(sl_client, sl_client_config):
+    """Short stable key of the account of sl_client naming its local caches"""
+    broker_transport = find_transport(sl_client, BrokerTransport)
+    username = getattr(broker_transport, "username", None) \
+        or getattr(getattr(sl_client, "auth", None), "username", None) \
+        or sl_client_config.sl_username or "default"
+    return hashlib.sha1(username.encode("utf-8")).hexdigest()[:16]
+
+def find_transport(sl_client, transport_type):
+    """The transport of the given type among the transports of sl_client
+    wrapping each other, or None.
+    """
+    transport = getattr(sl_client, "transport", None)
+    while transport is not None:
+        if isinstance(transport, transport_type):
+            return transport
+        transport = getattr(transport, "transport", None)
+    return None
+
+
+def create_sl_client(sl_client_config):
+    """A SoftLayer client talking to the local broker when it is running
+    (or started on demand with use_broker), a direct client otherwise.
+    Calls are rate limited with the budget of the account shared by all the
+    processes of the controller, and throttled or transient errors retried.
+    """
+    sl_client = None
+    if sl_client_config.use_broker is not False:
+        settings = SoftLayer.config.get_client_settings(
+            username=sl_client_config.sl_username, api_key=sl_client_config.api_key)
+        broker_transport = BrokerTransport.connect(
+            sl_client_config.broker_socket, settings.get("username"), settings.get("api_key"),
+            start=sl_client_config.use_broker is True)
+        if broker_transport is not None:
+            sl_client = SoftLayer.BaseClient(transport=broker_transport)
+    if sl_client is None:
+        sl_client = SoftLayer.Client(username=sl_client_config.sl_username, api_key=sl_client_config.api_key)
+    if sl_client_config.api_rate_limit:
+        sl_client.transport = RateLimitedTransport(
+            sl_client.transport, TokenBucket.for_account(sl_client, sl_client_config))
+    sl_client.transport = RetryingTransport(sl_client.transport, sl_client_config.api_retries)
+    return sl_client
+
+
+class TokenBucket(object):
+    """Token bucket of rate tokens per second holding up to burst tokens.
+    Its state is kept in a file locked with flock on every take, so the
+    budget is shared by all the processes and threads using the file.
+    """
+    def __init__(self, path, rate, burst, clock=time.time, sleep=time.sleep):
+        self.path = path
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self._clock = clock
+        self._sleep = sleep
+
+    @staticmethod
+    def for_account(sl_client, sl_client_config):
+        return TokenBucket(
+            os.path.join(sl_client_config.cache_dir,
+                         "ratelimit-{}.json".format(account_key(sl_client, sl_client_config))),
+            sl_client_config.api_rate_limit, sl_client_config.api_burst)
+
+    def take(self):
+        """Takes a token, sleeping until there is one. Returns the seconds slept."""
+        waited = 0.0
+        while True:
+            delay = self.__try_take()
+            if delay <= 0:
+                return waited
+            self._sleep(delay)
+            waited += delay
+
+    def __try_take(self):
+        """Takes a token and returns 0 or returns the seconds until there is one"""
+        bucket_dir = os.path.dirname(self.path)
+        if not os.path.isdir(bucket_dir):
+            try:
+                os.makedirs(bucket_dir, 0o700)
+            except OSError as os_error:
+                if os_error.errno != errno.EEXIST:
+                    raise
+        with open(self.path, "a+") as bucket_file:
+            fcntl.flock(bucket_file.fileno(), fcntl.LOCK_EX)
+            try:
+                bucket_file.seek(0)
+                try:
+                    state = json.loads(bucket_file.read())
+                except ValueError:
+                    state = {}
+                now = self._clock()
+                tokens = min(self.burst, state.get("tokens", self.burst)
+                             + max(0.0, now - state.get("updated", now)) * self.rate)
+                delay = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    delay = (1 - tokens) / self.rate
+                bucket_file.seek(0)
+                bucket_file.truncate()
+                bucket_file.write(json.dumps({"tokens": tokens, "updated": now}))
+                bucket_file.flush()
+                return delay
+            finally:
+                fcntl.flock(bucket_file.fileno(), fcntl.LOCK_UN)
+
+
+class RateLimitedTransport(object):
+    """Takes a token of the bucket before every call. The time spent waiting
+    for it is left in request.throttle_wait.
+    """
+    def __init__(self, transport, token_bucket):
+        self.transport = transport
+        self.token_bucket = token_bucket
+
+    def __call__(self, request):
+        request.throttle_wait = getattr(request, "throttle_wait", 0.0) + self.token_bucket.take()
+        return self.transport(request)
+
+
+class RetryingTransport(object):
+    """Retries throttled calls (HTTP 429) and, for read only get* methods,
+    calls failing with a 5xx or connection error, with exponential backoff
+    and jitter. The number of retries is left in request.retries.
+    """
+    _throttled = 429
+
+    def __init__(self, transport, retries=5, initial_interval=1.0, max_interval=30.0,
+                 sleep=time.sleep):
+        self.transport = transport
+        self.retries = retries
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self._sleep = sleep
+
+    def __call__(self, request):
+        request.retries = 0
+        while True:
+            try:
+                return self.transport(request)
+            except SoftLayer.SoftLayerAPIError as sl_error:
+                if request.retries >= self.retries or not self.__retryable(request, sl_error):
+                    raise
+            interval = min(self.max_interval, self.initial_interval * 2 ** request.retries)
+            self._sleep(interval * random.uniform(0.5, 1.0))
+            request.retries += 1
+
+    def __retryable(self, request, sl_error):
+        if sl_error.faultCode == self._throttled:
+            return True
+#       other calls than reads may have been processed before failing
+        if not request.method.startswith("get"):
+            return False
+        return sl_error.faultCode == 0 or (isinstance(sl_error.faultCode, int) and 500 <= sl_error.faultCode < 600)
+
+
+class InstrumentedTransport(object):
+    """Wraps a SoftLayer transport recording the service, method, object
+    mask, latency, payload size and retries of every call made through it.
+    Each call is optionally appended to a NDJSON trace file.
+    """
+    def __init__(self, transport, trace_file=None, clock=time.time):
+        self.transport = transport
+        self.calls = []
+        self._trace_file = trace_file
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def install(sl_client, sl_client_config):
+        instrumented_transport = InstrumentedTransport(sl_client.transport, sl_client_config.api_trace_file)
+        sl_client.transport = instrumented_transport
+        return instrumented_transport
+
+    def __call__(self, request):
+        started = self._clock()
+        result = None
+        error = None
+        try:
+            result = self.transport(request)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.__record(request, started, result, error)
+
+    def __record(self, request, started, result, error):
+        call = {
+            "service": request.service,
+            "method": request.method,
+            "id": request.identifier,
+            "mask": request.mask,
+            "started": started,
+            "latency": self._clock() - started,
+            "payload_bytes": len(json.dumps(result, default=str)) if error is None else 0,
+            "retries": getattr(request, "retries", 0),
+            "throttle_wait": getattr(request, "throttle_wait", 0.0),
+            "error": None if error is None else str(error)
+        }
+        with self._lock:
+            self.calls.append(call)
+            if self._trace_file is not None:
+                with open(self._trace_file, "a") as trace_file:
+                    trace_file.write(json.dumps(call, default=str) + "\n")
+
+    def stats(self):
+        with self._lock:
+            calls = list(self.calls)
+        by_method = {}
+        for call in calls:
+            method_stats = by_method.setdefault(
+                "{}::{}".format(call["service"], call["method"]),
+                {"calls": 0, "latency": 0.0, "payload_bytes": 0})
+            method_stats["calls"] += 1
+            method_stats["latency"] += call["latency"]
+            method_stats["payload_bytes"] += call["payload_bytes"]
+        for method_stats in by_method.values():
+            method_stats["latency"] = round(method_stats["latency"], 3)
+        return {
+            "calls": len(calls),
+            "errors": len([call for call in calls if call["error"] is not None]),
+            "retries": sum(call["retries"] for call in calls),
+            "throttle_wait": round(sum(call["throttle_wait"] for call in calls), 3),
+            "latency": round(sum(call["latency"] for call in calls), 3),
+            "payload_bytes": sum(call["payload_bytes"] for call in calls),
+            "by_method": by_method
+        }
+
+
+class SLClientConfig(object):
+    def __init__(self, params):
+        self.api_key= params.get("api_key")
+        self.sl_username = params.get("sl_username")
+        self.cache_dir = params.get("cache_dir") or os.environ.get("SL_CACHE_DIR") \
+            or os.path.expanduser(os.path.join("~", ".ansible", "tmp", "softlayer"))
+        self.instance_cache_ttl = params.get("instance_cache_ttl", 300)
+        self.api_trace_file = params.get("api_trace_file") or os.environ.get("SL_API_TRACE")
+        self.use_broker = params.get("use_broker")
+        if self.use_broker is None and os.environ.get("SL_BROKER") is not None:
+            self.use_broker = os.environ.get("SL_BROKER").lower() in ["1", "yes", "true"]
+        self.broker_socket = params.get("broker_socket") or os.path.join(self.cache_dir, "broker.sock")
+        self.api_rate_limit = params.get("api_rate_limit")
+        if self.api_rate_limit is None:
+            self.api_rate_limit = float(os.environ.get("SL_API_RATE_LIMIT", 10))
+        self.api_burst = params.get("api_burst") or 20
+        self.api_retries = params.get("api_retries", 5)
+        if self.api_retries is None:
+            self.api_retries = 5
+    
+    @staticmethod
+    def arg_spec():
+        return dict(
+            api_key = dict(type = 'str'),
+            sl_username = dict(type = 'str'),
+            cache_dir = dict(type = 'str'),
+            instance_cache_ttl = dict(type = 'int', default = 300),
+            api_trace_file = dict(type = 'str'),
+            use_broker = dict(type = 'bool'),
+            broker_socket = dict(type = 'str'),
+            api_rate_limit = dict(type = 'float'),
+            api_burst = dict(type = 'int', default = 20),
+            api_retries = dict(type = 'int', default = 5),
+        )
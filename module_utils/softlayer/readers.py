@@ -0,0 +1,122 @@
+"""Readers of the addresses and credentials of instances, shared by
+softlayer_vs_ip, softlayer_vs_credentials, softlayer_vs and the inventory.
+"""
+import fnmatch
+import re
+try:
+    from ansible.module_utils.softlayer.basic import *
+except ImportError:
+    from module_utils.softlayer.basic import *
+
+
+class IpAddressReader(SoftlayerVirtualServerBasic):
+    _ip_addresses_mask = ",".join([
+        "id",
+        "hostname",
+        "domain",
+        "primaryIpAddress",
+        "primaryBackendIpAddress",
+        "networkComponents[name,port,primaryIpAddress,macAddress,maxSpeed,networkVlan[id,vlanNumber,name]]"])
+
+    def __init__(self, sl_client, instance_config, instance_id_index=None):
+        SoftlayerVirtualServerBasic.__init__(self, sl_client, instance_config, instance_id_index)
+ 
+    def read_ip_address(self):
+        sl_instance = self.get_vs_object(mask='primaryBackendIpAddress, primaryIpAddress')
+        if sl_instance is None:
+            raise Exception("Instance {} not found".format(self.ic.fqdn))
+        return sl_instance
+
+    def read_ip_addresses(self, fqdns=None, domain=None, hostname=None):
+        guest_filter = {}
+        if fqdns is not None:
+            fqdns = set(fqdns)
+            guest_filter["hostname"] = in_filter(set(fqdn.partition(".")[0] for fqdn in fqdns))
+        elif hostname is not None:
+            guest_filter["hostname"] = IpAddressReader.pattern_filter(hostname)
+        if domain is not None:
+            guest_filter["domain"] = {"operation": domain}
+        sl_instances = self.sl_client['Account'].getVirtualGuests(
+            mask=self._ip_addresses_mask, filter={"virtualGuests": guest_filter})
+        ip_addresses = {}
+        for sl_instance in sl_instances:
+            fqdn = "{}.{}".format(sl_instance["hostname"], sl_instance["domain"])
+            if fqdns is not None and fqdn not in fqdns:
+                continue
+            if hostname is not None and not fnmatch.fnmatchcase(sl_instance["hostname"], hostname):
+                continue
+            ip_addresses[fqdn] = IpAddressReader.ip_addresses(sl_instance)
+        return ip_addresses
+
+    @staticmethod
+    def ip_addresses(sl_instance):
+        return {
+            "id": sl_instance["id"],
+            "primaryIpAddress": sl_instance.get("primaryIpAddress"),
+            "primaryBackendIpAddress": sl_instance.get("primaryBackendIpAddress"),
+            "networkComponents": [
+                {
+                    "name": "{}{}".format(network_component.get("name"), network_component.get("port")),
+                    "primaryIpAddress": network_component.get("primaryIpAddress"),
+                    "macAddress": network_component.get("macAddress"),
+                    "maxSpeed": network_component.get("maxSpeed"),
+                    "vlan": network_component.get("networkVlan")
+                }
+                for network_component in sl_instance.get("networkComponents", [])]
+        }
+
+    @staticmethod
+    def pattern_filter(pattern):
+        """Narrows a shell style pattern down to an object filter on its
+        literal prefix. Matches are checked again locally with fnmatch.
+        """
+        literal_prefix = re.split(r"[*?\[]", pattern)[0]
+        if literal_prefix == pattern:
+            return {"operation": pattern}
+        if literal_prefix == "":
+            return {}
+        return {"operation": "^= " + literal_prefix}
+
+
+class CredentialsReader(SoftlayerVirtualServerBasic):
+    _credentials_mask = "softwareComponents[softwareDescription.operatingSystem,passwords[username,password]]"
+
+    def __init__(self, sl_client, instance_config, instance_id_index=None):
+        SoftlayerVirtualServerBasic.__init__(self, sl_client, instance_config, instance_id_index)
+ 
+    def read_credentials(self):
+        sl_instance = self.get_vs_object(mask=self._credentials_mask)
+        if sl_instance is None:
+            raise Exception("Instance {} not found".format(self.ic.fqdn))
+        return CredentialsReader.os_credentials(sl_instance)
+
+    def read_credentials_of(self, fqdns):
+        hostnames = set(fqdn.partition(".")[0] for fqdn in fqdns)
+        sl_instances = self.sl_client['Account'].getVirtualGuests(
+            mask="id,hostname,domain," + self._credentials_mask,
+            filter={"virtualGuests": {"hostname": in_filter(hostnames)}})
+        sl_instances_by_fqdn = dict(
+            ("{}.{}".format(sl_instance["hostname"], sl_instance["domain"]), sl_instance)
+            for sl_instance in sl_instances)
+        missing_fqdns = [fqdn for fqdn in fqdns if fqdn not in sl_instances_by_fqdn]
+        if len(missing_fqdns) != 0:
+            raise Exception("Instances {} not found".format(", ".join(missing_fqdns)))
+        return dict((fqdn, CredentialsReader.os_credentials(sl_instances_by_fqdn[fqdn])) for fqdn in fqdns)
+
+    @staticmethod
+    def os_credentials(sl_instance):
+        """The first username and password of the operating system of
+        sl_instance, read with at least _credentials_mask.
+        """
+        os_component = CredentialsReader._find_os_component(sl_instance.get("softwareComponents", []))
+        passwords = os_component.get("passwords", [])
+        return passwords[0] if len(passwords) != 0 else None
+
+    @staticmethod
+    def _find_os_component(components):
+        for comp in components:
+            if comp.get("softwareDescription", {}).get("operatingSystem") == 1:
+                return comp;
+            else:
+                continue
+        raise Exception("No operating system component found on instance")
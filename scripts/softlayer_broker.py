@@ -0,0 +1,164 @@
+#!/usr/bin/python 
+# -*- coding: utf-8 -*-
+
+'''
+Local SoftLayer API broker.
+
+A long running process listening on a Unix socket. It keeps one warm
+SoftLayer client, with its keep-alive HTTP session, per account and a shared
+in-memory cache (instance ids, SSH key indexes, product catalogs) for all
+the module runs of a play. Modules talk to it through
+module_utils.softlayer.client.BrokerTransport and use a direct client when it
+is not running. It is started on demand by modules run with use_broker and
+exits after being idle for --idle-timeout seconds.
+
+The protocol is one JSON request per line, answered by one JSON response
+per line:
+    {"op": "ping"}
+    {"op": "call", "username", "api_key", "service", "method", "args", "id",
+     "mask", "filter", "limit", "offset"}
+    {"op": "cache_get", "key", "ttl"}
+    {"op": "cache_put", "key", "value"}
+    {"op": "cache_invalidate", "key"}
+Responses hold either a result or an error with faultCode and faultString.
+
+Usage:
+    scripts/softlayer_broker.py --socket ~/.ansible/tmp/softlayer/broker.sock
+'''
+
+import SoftLayer
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import argparse
+import threading
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+class SoftLayerBroker(object):
+    def __init__(self, clock=time.time):
+        self._clients = {}
+        self._cache = {}
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.last_request_at = clock()
+
+    def handle(self, message):
+        self.last_request_at = self._clock()
+        op = message.get("op")
+        try:
+            if op == "ping":
+                return {"result": "pong"}
+            if op == "call":
+                return {"result": self.__call(message)}
+            if op == "cache_get":
+                return {"result": self.__cache_get(message["key"], message["ttl"])}
+            if op == "cache_put":
+                with self._lock:
+                    self._cache[message["key"]] = (self._clock(), message["value"])
+                return {"result": True}
+            if op == "cache_invalidate":
+                with self._lock:
+                    self._cache.pop(message["key"], None)
+                return {"result": True}
+            return self.__error("SoftLayer_Exception_Public", "Unknown broker op {}".format(op))
+        except SoftLayer.SoftLayerAPIError as sl_error:
+            return self.__error(sl_error.faultCode, sl_error.faultString)
+        except Exception as e:
+            return self.__error("SoftLayer_Exception_Broker", str(e))
+
+    def __call(self, message):
+        return self.__client(message.get("username"), message.get("api_key")).call(
+            message["service"], message["method"], *message.get("args", []),
+            id=message.get("id"), mask=message.get("mask"), filter=message.get("filter"),
+            limit=message.get("limit"), offset=message.get("offset"))
+
+    def __client(self, username, api_key):
+        with self._lock:
+            sl_client = self._clients.get((username, api_key))
+            if sl_client is None:
+                sl_client = SoftLayer.Client(username=username, api_key=api_key)
+                self._clients[(username, api_key)] = sl_client
+            return sl_client
+
+    def __cache_get(self, key, ttl):
+        with self._lock:
+            stored_at, value = self._cache.get(key, (None, None))
+        if stored_at is None or self._clock() - stored_at > ttl:
+            return None
+        return value
+
+    def __error(self, fault_code, fault_string):
+        return {"error": {"faultCode": fault_code, "faultString": fault_string}}
+
+
+class BrokerRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                response = self.server.broker.handle(json.loads(line.decode("utf-8")))
+            except ValueError as ve:
+                response = {"error": {"faultCode": "SoftLayer_Exception_Broker", "faultString": str(ve)}}
+            self.wfile.write((json.dumps(response, default=str) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    timeout = 10
+
+    def __init__(self, socket_path, broker):
+        self.broker = broker
+        socketserver.UnixStreamServer.__init__(self, socket_path, BrokerRequestHandler)
+
+    def serve_until_idle(self, idle_timeout):
+        while time.time() - self.broker.last_request_at < idle_timeout:
+            self.handle_request()
+
+
+def remove_stale_socket(socket_path):
+    """Removes the socket left behind by a broker which is not running
+    anymore. Returns False if a broker is listening on it.
+    """
+    if not os.path.exists(socket_path):
+        return True
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+        return False
+    except socket.error as probe_error:
+        if probe_error.errno != errno.ECONNREFUSED:
+            raise
+        os.remove(socket_path)
+        return True
+    finally:
+        probe.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SoftLayer API broker")
+    parser.add_argument("--socket", required=True, help="Path of the Unix socket to listen on")
+    parser.add_argument("--idle-timeout", type=int, default=900,
+                        help="Seconds without requests after which the broker exits")
+    args = parser.parse_args()
+
+    socket_path = os.path.expanduser(args.socket)
+    if not remove_stale_socket(socket_path):
+        sys.exit("A broker is already listening on {}".format(socket_path))
+    os.umask(0o077)
+    server = BrokerServer(socket_path, SoftLayerBroker())
+    try:
+        server.serve_until_idle(args.idle_timeout)
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+if __name__ == '__main__':
+    main()
@@ -20,10 +20,55 @@ options:
         description:
             - SoftLayer username
         default: null
+    api_trace_file:
+        description:
+            - Appends a NDJSON record of every SoftLayer API call made to this file.
+            - Defaults to SL_API_TRACE env variable. The result always holds an
+            - api_stats summary of the calls.
+        default: null
+    use_broker:
+        description:
+            - Sends the API calls through the local scripts/softlayer_broker.py process,
+            - which keeps warm clients and caches shared by all module runs.
+            - By default the broker is used when it is running, yes starts it on
+            - demand and no never uses it. Defaults to SL_BROKER env variable.
+        type: bool
+        default: null
+    broker_socket:
+        description:
+            - Unix socket of the broker
+        default: <cache_dir>/broker.sock
+    api_rate_limit:
+        description:
+            - The maximum SoftLayer API calls per second. The budget is shared
+            - through a lock file in cache_dir by all the module runs of the
+            - account on the controller. 0 disables the limit. Defaults to
+            - SL_API_RATE_LIMIT env variable or 10. The time spent waiting is
+            - reported as throttle_wait in api_stats.
+        type: float
+        default: null
+    api_burst:
+        description:
+            - The number of calls that can be made at once before the rate limit applies
+        type: integer
+        default: 20
+    api_retries:
+        description:
+            - How many times a throttled call (HTTP 429), or a read failing with
+            - a 5xx or connection error, is retried with exponential backoff.
+        type: integer
+        default: 5
     keys_to_check_in:
         description:
             - List of ssh key dicts i.e. label:value, key:value
+            - Keys are matched by label and key fingerprint. A key whose label
+            - changed is renamed in place instead of being deleted and added.
         default: {}
+    parallelism:
+        description:
+            - The maximum number of keys added, deleted or renamed at the same time
+        type: integer
+        default: 10
            
 author: scoss
 notes:
@@ -37,20 +82,26 @@ notes:
     -    label: key1
     -  - key: ssh-rsa AAAAB3NzaC1yc2EAAA...
     -    label: key2
+    - The result holds the number of added, deleted and renamed keys.
 '''
 
 
 from ansible.module_utils.basic import *
-import SoftLayer
-import sys
-import logging
-import time
-from softlayer_vs_basic.py import SLClientConfig
+import base64
+import binascii
+import hashlib
+try:
+    from ansible.module_utils.softlayer.basic import *
+except ImportError:
+    from module_utils.softlayer.basic import *
 
     
 class SshKeysConfig(object):
     def __init__(self, ansible_config):
         self.ssh_keys = ansible_config.get("ssh_keys")
+        self.parallelism = ansible_config.get("parallelism", 10)
+        labels = set()
+        fingerprints = set()
         for ssh_key in self.ssh_keys:
             label = ssh_key.get("label")
             key = ssh_key.get("key")
@@ -58,74 +109,118 @@ class SshKeysConfig(object):
                 raise ValueError("No label provided for key {}".format(key))
             if key is None or key == "":
                 raise ValueError("No key provided for label {}".format(label))
-            for ssh_key2 in self.ssh_keys:
-                if ssh_key2 is ssh_key:
-                    continue
-                if ssh_key2["label"] == ssh_key["label"]:
-                    raise ValueError("label {} is not unique".format(ssh_key2["label"]))
-                if ssh_key2["key"] == ssh_key["key"]:
-                    raise ValueError("ssh_key {} is not unique".format(ssh_key2["key"]))
+            if label in labels:
+                raise ValueError("label {} is not unique".format(label))
+            fingerprint = SshKeysConfig.fingerprint(key)
+            if fingerprint in fingerprints:
+                raise ValueError("ssh_key {} is not unique".format(key))
+            labels.add(label)
+            fingerprints.add(fingerprint)
                 
     @staticmethod
     def arg_spec():
         return dict(
-            ssh_keys = dict(type = 'list')
+            ssh_keys = dict(type = 'list'),
+            parallelism = dict(type = 'int', default = 10)
         )
-           
-    def sl_keys_to_delete(self, sl_keys):
-        return filter(
-            lambda sl_ssh_key: self._doesnt_have_key(sl_ssh_key, self.ssh_keys), 
-            sl_keys)
-    
-    def config_keys_to_add(self, sl_keys):
-        return filter(
-            lambda config_ssh_key: self._doesnt_have_key(config_ssh_key, sl_keys),
-            self.ssh_keys)
-    
-    def _doesnt_have_key(self, key_to_check, keys_list):
-        for ssh_key in keys_list    :
-            if ssh_key["label"] == key_to_check["label"] and \
-                ssh_key["key"] == key_to_check["key"]:
-                return False   
-        return True
+
+    @staticmethod
+    def fingerprint(key):
+        """MD5 fingerprint of the key body, as shown by SoftLayer. The
+        key comment does not take part in it.
+        """
+        key_fields = key.strip().split()
+        key_body = key_fields[1] if len(key_fields) > 1 else key_fields[0]
+        try:
+            digest = hashlib.md5(base64.b64decode(key_body)).hexdigest()
+        except (TypeError, ValueError, binascii.Error):
+            digest = hashlib.md5(key_body.encode("utf-8")).hexdigest()
+        return ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+
+    @staticmethod
+    def identity(ssh_key):
+        return (ssh_key["label"], SshKeysConfig.fingerprint(ssh_key["key"]))
+
+    def diff(self, sl_keys):
+        """Returns the SoftLayer keys to delete, the (SoftLayer key, new label)
+        pairs to rename and the config keys to add to get from sl_keys to
+        the config.
+        """
+        config_keys_by_identity = dict(
+            (SshKeysConfig.identity(ssh_key), ssh_key) for ssh_key in self.ssh_keys)
+        in_sync = set()
+        sl_keys_out_of_sync = []
+        for sl_key in sl_keys:
+            identity = SshKeysConfig.identity(sl_key)
+            if identity in config_keys_by_identity and identity not in in_sync:
+                in_sync.add(identity)
+            else:
+                sl_keys_out_of_sync.append(sl_key)
+        config_keys_to_add_by_fingerprint = dict(
+            (fingerprint, ssh_key) for (label, fingerprint), ssh_key in config_keys_by_identity.items()
+            if (label, fingerprint) not in in_sync)
+
+        sl_keys_to_delete = []
+        sl_keys_to_rename = []
+        for sl_key in sl_keys_out_of_sync:
+            config_key = config_keys_to_add_by_fingerprint.pop(
+                SshKeysConfig.fingerprint(sl_key["key"]), None)
+            if config_key is None:
+                sl_keys_to_delete.append(sl_key)
+            else:
+                sl_keys_to_rename.append((sl_key, config_key["label"]))
+        return sl_keys_to_delete, sl_keys_to_rename, config_keys_to_add_by_fingerprint.values()
 
         
 class SshKeys(object):
     _mba_note = "maintained by ansible"
     
-    def __init__(self, sl_client, keys_config):
+    def __init__(self, sl_client, keys_config, key_index_cache=None):
         self._sl_ssh_keys_manager = SoftLayer.SshKeyManager(sl_client)
+        self._sl_account = sl_client['Account']
         self._kc = keys_config
+        self._key_index_cache = key_index_cache
 
     
     def sync_config(self):
         try:
             sl_keys = self._keys_maintained_by_ansible()
-            sl_keys_to_delete = self._kc.sl_keys_to_delete(sl_keys)
-            for ssh_key in sl_keys_to_delete:
-                self._sl_ssh_keys_manager.delete_key(ssh_key["id"])
-        
-            config_keys_to_add = self._kc.config_keys_to_add(sl_keys)
-            for ssh_key in config_keys_to_add:
-                self._sl_ssh_keys_manager.add_key(ssh_key["key"], ssh_key["label"], SshKeys._mba_note)
+            sl_keys_to_delete, sl_keys_to_rename, config_keys_to_add = self._kc.diff(sl_keys)
+#           deletes go first so that renamed and added keys never clash with
+#           labels that are about to go away
+            run_concurrently(
+                lambda ssh_key: self._sl_ssh_keys_manager.delete_key(ssh_key["id"]),
+                sl_keys_to_delete, self._kc.parallelism)
+            run_concurrently(
+                lambda rename: self._sl_ssh_keys_manager.edit_key(rename[0]["id"], label=rename[1]),
+                sl_keys_to_rename, self._kc.parallelism)
+            run_concurrently(
+                lambda ssh_key: self._sl_ssh_keys_manager.add_key(ssh_key["key"], ssh_key["label"], SshKeys._mba_note),
+                config_keys_to_add, self._kc.parallelism)
         except Exception as e:
+            self._invalidate_key_index()
             raise SSHKeyException(str(e))
-        return len(sl_keys_to_delete) != 0 or len(config_keys_to_add) != 0
+        changed = len(sl_keys_to_delete) + len(sl_keys_to_rename) + len(config_keys_to_add) != 0
+        if changed:
+            self._invalidate_key_index()
+        return {
+            "changed": changed,
+            "added": len(config_keys_to_add),
+            "deleted": len(sl_keys_to_delete),
+            "renamed": len(sl_keys_to_rename)
+        }
     
+    def _invalidate_key_index(self):
+        """Makes softlayer_vs resolve key labels from a fresh listing."""
+        if self._key_index_cache is not None:
+            self._key_index_cache.invalidate()
+
     def _keys_maintained_by_ansible(self):
-        sl_keys = self._sl_ssh_keys_manager.list_keys()
+        sl_keys = self._sl_account.getSshKeys(mask="id,label,key,notes")
         return filter(
             lambda ssh_key: True if ssh_key.get("notes") == SshKeys._mba_note else False,
             sl_keys)
 
-class SSHKeyException(Exception):
-    def __init__(self, msg):
-        self._msg = msg
-    def __str__(self):
-        return "Exception: {}, MSG: {}".format(type(self), self._msg)
-    def msg(self):
-        return self._msg
-   
 def main():
   
     module_helper = AnsibleModule(
@@ -135,21 +230,16 @@ def main():
     )
     
     sl_client_config = SLClientConfig(module_helper.params)
-    sl_client = SoftLayer.Client(username=sl_client_config.sl_username, api_key=sl_client_config.api_key)
+    sl_client = create_sl_client(sl_client_config)
+    api_calls = InstrumentedTransport.install(sl_client, sl_client_config)
 
     try:
-        ssh_keys = SshKeys(sl_client, SshKeysConfig(ansible_config=module_helper.params))
-        module_helper.exit_json(changed=ssh_keys.sync_config())
+        ssh_keys = SshKeys(sl_client, SshKeysConfig(ansible_config=module_helper.params),
+                           JsonFileCache.for_account("ssh_key_ids", sl_client, sl_client_config,
+                                                     sl_client_config.instance_cache_ttl))
+        module_helper.exit_json(api_stats=api_calls.stats(), **ssh_keys.sync_config())
     except Exception as se:
-        module_helper.fail_json(msg=str(se))
-
-main()
-
-
-
-
-
-
-
-
+        module_helper.fail_json(msg=str(se), api_stats=api_calls.stats())
 
+if __name__ == '__main__':
+    main()
@@ -28,11 +28,105 @@ options:
         description:
             - SoftLayer username
         default: null
+    api_trace_file:
+        description:
+            - Appends a NDJSON record of every SoftLayer API call made to this file.
+            - Defaults to SL_API_TRACE env variable. The result always holds an
+            - api_stats summary of the calls.
+        default: null
+    use_broker:
+        description:
+            - Sends the API calls through the local scripts/softlayer_broker.py process,
+            - which keeps warm clients and caches shared by all module runs.
+            - By default the broker is used when it is running, yes starts it on
+            - demand and no never uses it. Defaults to SL_BROKER env variable.
+        type: bool
+        default: null
+    broker_socket:
+        description:
+            - Unix socket of the broker
+        default: <cache_dir>/broker.sock
+    api_rate_limit:
+        description:
+            - The maximum SoftLayer API calls per second. The budget is shared
+            - through a lock file in cache_dir by all the module runs of the
+            - account on the controller. 0 disables the limit. Defaults to
+            - SL_API_RATE_LIMIT env variable or 10. The time spent waiting is
+            - reported as throttle_wait in api_stats.
+        type: float
+        default: null
+    api_burst:
+        description:
+            - The number of calls that can be made at once before the rate limit applies
+        type: integer
+        default: 20
+    api_retries:
+        description:
+            - How many times a throttled call (HTTP 429), or a read failing with
+            - a 5xx or connection error, is retried with exponential backoff.
+        type: integer
+        default: 5
+    cache_dir:
+        description:
+            - Directory holding the local caches shared between module runs.
+            - Defaults to SL_CACHE_DIR env variable or ~/.ansible/tmp/softlayer
+        default: null
+    instance_cache_ttl:
+        description:
+            - Seconds the cached fqdn to instance id index of the account is
+            - reused by subsequent module runs. 0 disables the cache.
+        type: integer
+        default: 300
     fqdn:
         description:
             - Fully qualified hostname of the instance. 
+            - Required unless instances is given.
         type: string
-        required: true
+        required: false
+    instances:
+        description:
+            - Fleet mode. List of instance dicts each having at least fqdn and
+            - any of the other instance options. Options not given in an entry
+            - default to the values given to the module. Entries are checked
+            - like the module options, unknown options or values of the wrong
+            - type fail the module before anything is done. wait and the
+            - wait_* options apply to the whole fleet and cannot be given per
+            - entry. All instances are discovered with a single account
+            - listing and reconciled concurrently. The result holds a results
+            - dict keyed by fqdn.
+        type: list
+        default: null
+    parallelism:
+        description:
+            - The maximum number of instances reconciled at the same time in
+            - fleet mode. The waits of the instances are polled together with
+            - one listing per poll, so the calls do not grow with parallelism.
+        type: integer
+        default: 10
+    batch_size:
+        description:
+            - Fleet mode. The maximum number of instances being recreated,
+            - upgraded or OS reloaded at the same time. The next instance is
+            - started as soon as any of them is done, reading and comparing
+            - instances is not limited. Requires wait, as an instance is done
+            - once its transaction finished, the module fails if wait is 0.
+            - Should not exceed parallelism.
+        type: integer
+        default: null
+    max_in_flight_per_datacenter:
+        description:
+            - Fleet mode. Same as batch_size, but per datacenter the instance is in.
+        type: integer
+        default: null
+    max_failures:
+        description:
+            - Fleet mode. The rollout stops once more instances failed. Instances
+            - not yet taken down are then reported as failed and skipped. The
+            - result holds a rollout dict with the failures, whether the rollout
+            - was aborted and the highest number of instances down at a time.
+            - Requires wait like batch_size.
+        type: integer
+        default: null
     payment_scheme:
         description:
             - Indicates wether payment is on hourly or monthly basis.
@@ -50,8 +144,9 @@ options:
         description:
             - The short name of the data center where the server should be run
             - Changing the value causes instance recreation
+            - Required unless state is absent.
         type: string
-        required: true
+        required: false
     os_code:
         description:
             - The SoftLayer reference code for operation system. For example DEBIAN_7_64
@@ -59,8 +154,25 @@ options:
             - to a concrete reference code. At the moment of writing DEBIAN_LATES is
             - normalized to DEBIAN_7_64
             - Changing the value causes instance recreation
+            - Required unless state is absent or the instance is built from an image.
         type: string
-        required: true
+        required: false
+    image_id:
+        description:
+            - The global identifier of a private or public image template the
+            - instance is created and OS reloaded from instead of os_code.
+            - Booting a prebuilt image is much faster than running a post install
+            - script on a fresh OS.
+            - Changing the value causes OS reload.
+        type: string
+        default: null
+    image_name:
+        description:
+            - Same as image_id, but the image template is given by its name. Names
+            - and global identifiers are resolved through a cached index of the
+            - account images, refreshed when an image is not found in it.
+        type: string
+        default: null
     private:
         description:
             - Indicates wether the instance should be attached only to a private network
@@ -78,8 +190,10 @@ options:
             - User provided data that will be accessible from the system. Could be used to
             - pass parameters to the post install script. Data is accessible by
             - mounting /dev/xvdh1. Path to raw data is openstack/latest/user_data.
-            - If changed nothing will happen. This is basically used the first time
-            - a system is created to configure first-time users setup
+            - If changed nothing will happen but a warning and an entry in the
+            - change_log. User data is only read from existing instances when it
+            - is set. This is basically used the first time a system is created to
+            - configure first-time users setup
         type: string
         default: null
     
@@ -90,39 +204,166 @@ options:
         default: {}
     nic_spped:
         description:
-            - The speed of network interfaces attached to the instance.
-            - Changing the value causes instance recreation.
-        choice: ["10Mb", "100Mb", "1Gb"]
+            - The speed of network interfaces attached to the instance, for
+            - example 100Mb, 1Gb or 10Gb.
+            - Changing the value causes an in place upgrade.
+        default: 100Mb
     CPUs:
         description:
             - The number of CPUs on instance
             - Changing the value causes short downtime ~ 5 mins
-        choice: [1, 2, 4]
+        default: 1
     RAM:
         description:
             - The amount of memory in GB.
             - Changing the value causes short downtime ~ 5 mins
-        choice: ["1GB", "2GB", "4GB", "8GB"]
+            - Changes of CPUs, RAM and nic_speed are placed as a single upgrade
+            - order, so the instance is rebooted only once.
+        default: 1GB
+    catalog_cache_ttl:
+        description:
+            - datacenter, os_code, CPUs, RAM and nic_speed are validated against
+            - the options of the account product catalog before they are ordered,
+            - all of them before a create or recreate and the changed ones before
+            - an upgrade. Existing instances which are left as they are are not
+            - validated. In fleet mode the instances to be created are validated
+            - before any of them is changed. The catalog is read with
+            - Virtual_Guest::getCreateObjectOptions and cached for this many seconds.
+        type: integer
+        default: 86400
+    verify_order:
+        description:
+            - Verifies with generateOrderTemplate and verifyOrder that instances
+            - can be ordered before creating them. In fleet mode all instances are
+            - verified before any of them is changed. Successful verifications
+            - are cached for catalog_cache_ttl seconds by a hash of all the order
+            - parameters but hostname and domain, so hosts of the same profile
+            - are verified once.
+        type: bool
+        default: yes
+    return_facts:
+        description:
+            - Adds a facts dict to the result, with the instance id, fqdn,
+            - datacenter, power_state, ready, CPUs, RAM, nic_speed and the
+            - ip_addresses softlayer_vs_ip returns, so that it does not need to
+            - be run afterwards. The facts are read along with the instance
+            - config when nothing is done and with one more call after an
+            - action. There are none for absent instances and, in check mode,
+            - for instances to be created.
+        type: bool
+        default: no
+    return_credentials:
+        description:
+            - With return_facts, the facts also hold the OS credentials
+            - softlayer_vs_credentials returns, or null until the instance
+            - is provisioned.
+        type: bool
+        default: no
     wait:
         description:
             - The time in seconds to wait for change transtion
             - i.e. to start, stop, provision, shutdown the instance
             - 0 means do not wait i.e. create instance asynchronously
+            - Creating an instance in state present requires wait, as it can only
+            - be powered off once it is provisioned.
+            - An existing instance is only waited for before being compared with
+            - the config if a transaction is running on it.
+            - Whenever an action is performed the result holds a job dict with
+            - the instance id, fqdn, expected_state and started_at timestamp
+            - which could be passed to softlayer_vs_wait to wait for it later.
         type: integer
         default: 600
+    recreate_strategy:
+        description:
+            - How an instance is recreated when a setting requiring recreation
+            - changed. destroy_before_create cancels the instance and then
+            - provisions the new one. create_before_destroy provisions the
+            - new instance under a temporary hostname, waits for it, swaps the
+            - hostnames and cancels the old instance, so the downtime is a rename.
+            - create_before_destroy requires wait and bills both instances
+            - for a while.
+        choices: ['destroy_before_create', 'create_before_destroy']
+        default: destroy_before_create
+    spare_pool_size:
+        description:
+            - Number of spare instances kept for every profile i.e. combination
+            - of all the settings but fqdn. A new hourly instance matching a
+            - profile claims a ready spare, which is renamed and powered on in
+            - seconds, and the pool is refilled without waiting for the new
+            - spares to be provisioned. A failed refill is only reported as a
+            - warning, as the instance is synced by then. Spares provisioned
+            - this way keep running until the next claim of the profile or a
+            - spare_pool_only run powers them off, and a pool is empty until its
+            - first claim or spare_pool_only run. Spares of the pool are billed
+            - hourly.
+            - Claims are serialized through a lock file in cache_dir, so a pool
+            - is meant to be managed from a single controller. 0 disables it.
+        type: integer
+        default: 0
+    spare_domain:
+        description:
+            - Domain of the spare instances, which are named spare-<profile>-<suffix>
+        type: string
+        default: spares.local
+    spare_pool_only:
+        description:
+            - Maintains the spare pools of the profiles of the given instances
+            - instead of syncing the instances. Missing spares are provisioned
+            - and running ones powered off. With wait the new spares are waited
+            - for and powered off too, so that the pools are filled with powered
+            - off spares before the instances are created. The result holds a
+            - spare_pool dict, or spare_pools keyed by profile in fleet mode,
+            - with the number of spares, powered_off and created and the
+            - new_spare_ids.
+        type: bool
+        default: no
+    wait_initial_interval:
+        description:
+            - Seconds between the first two polls while waiting for a transaction
+            - or cancellation to finish. The interval grows exponentially.
+        type: float
+        default: 1.0
+    wait_max_interval:
+        description:
+            - The maximum seconds between two polls. It bounds how long a
+            - finished transaction goes unnoticed.
+        type: float
+        default: 5.0
+    wait_backoff_factor:
+        description:
+            - The factor by which the poll interval grows after each poll.
+        type: float
+        default: 2.0
+    wait_jitter:
+        description:
+            - Relative random deviation applied to every poll interval so that
+            - concurrent waits do not poll in lockstep.
+        type: float
+        default: 0.2
 
 author: scoss
 notes:
     - Instead of supplying api_key and username, .softlayer or env variables
+    - Supports check mode. The instance is read once, nothing is changed and
+    - nothing is waited for. The result holds a plan dict grouping the differing
+    - fields by the action they require i.e. recreated, upgraded or os_reloaded,
+    - and with --diff the before and after values of the fields.
 '''
 
 
 from ansible.module_utils.basic import *
-import SoftLayer
-import sys
-import logging
+from ansible.module_utils.parsing.convert_bool import boolean
 import time
-from softlayer_vs_basic import *
+import re
+import json
+import random
+import hashlib
+import threading
+import contextlib
+try:
+    from ansible.module_utils.softlayer.readers import *
+except ImportError:
+    from module_utils.softlayer.readers import *
 
 class VSState(object):
     @staticmethod
@@ -132,6 +373,12 @@ class VSState(object):
     @staticmethod
     def ABSENT(): return "absent"
 
+class RecreateStrategy(object):
+    @staticmethod
+    def DESTROY_BEFORE_CREATE(): return "destroy_before_create"
+    @staticmethod
+    def CREATE_BEFORE_DESTROY(): return "create_before_destroy"
+
 class VSPaymentScheme(object):
     @staticmethod
     def from_sl(sl_hourly):
@@ -160,28 +407,33 @@ class VSPaymentScheme(object):
     
 
 class NICSpeed(object):
+    _pattern = re.compile("^([0-9]+)(Mb|Gb)$")
+
     @staticmethod
     def to_sl(nic_speed):
-        if not type(nic_speed) is str:
+        """The speed in Mbps of a speed like 100Mb or 10Gb"""
+        if not isinstance(nic_speed, basestring):
             raise TypeError("String expected, was {}".format(type(nic_speed)))
-        elif nic_speed == NICSpeed.Gb1():
-            return 1000
-        elif nic_speed == NICSpeed.Mb10():
-            return 10
-        elif nic_speed == NICSpeed.Mb100():
-            return 100
-        else:
-            raise ValueError("One of {}, {} or {} expected".format(NICSpeed.Gb1, NICSpeed.Mb10, NICSpeed.Mb100))
+        match = NICSpeed._pattern.match(nic_speed)
+        if match is None:
+            raise ValueError("Speed like {} or {} expected, was {}".format(NICSpeed.Mb100(), NICSpeed.Gb1(), nic_speed))
+        return int(match.group(1)) * (1000 if match.group(2) == "Gb" else 1)
     
+    @staticmethod
+    def normalize(nic_speed):
+        """The speed as SoftLayer reports it, e.g. 1Gb for 1000Mb. Invalid
+        speeds are returned as they are, for validation to report them.
+        """
+        try:
+            return NICSpeed.from_sl(NICSpeed.to_sl(nic_speed))
+        except (TypeError, ValueError):
+            return nic_speed
+
     @staticmethod
     def from_sl(sl_nic_speed):
-        if sl_nic_speed == 1000:
-            return NICSpeed.Gb1()
-        if sl_nic_speed == 100:
-            return NICSpeed.Mb100()
-        if sl_nic_speed == 10:
-            return NICSpeed.Mb10()
-        raise ValueError("Unknown nic speed: {}MB".format(sl_nic_speed))
+        if sl_nic_speed >= 1000 and sl_nic_speed % 1000 == 0:
+            return "{}Gb".format(sl_nic_speed // 1000)
+        return "{}Mb".format(sl_nic_speed)
         
     @staticmethod
     def Gb1(): return "1Gb"
@@ -202,24 +454,21 @@ class CPUs(object):
         return 1
 
 class RAM(object):
+    _pattern = re.compile("^([0-9]+)GB$")
+
     @staticmethod
     def to_sl(ram):
-        if not type(ram) is str:
+        """The GBs of a size like 4GB"""
+        if not isinstance(ram, basestring):
             raise TypeError("String expected")
-        elif ram == RAM.GB1():
-            return 1
-        elif ram == RAM.GB2():
-            return 2
-        elif ram == RAM.GB4():
-            return 4
-        elif ram == RAM.GB8():
-            return 8
-        else:
-            raise ValueError("One of {}, {}, {} or {} expected".format(RAM.GB1(), RAM.GB2(), RAM.GB4(), RAM.GB8()))
+        match = RAM._pattern.match(ram)
+        if match is None:
+            raise ValueError("Size like {} or {} expected, was {}".format(RAM.GB1(), RAM.GB8(), ram))
+        return int(match.group(1))
     
     @staticmethod
     def from_sl_mb(ram):
-        return "{}GB".format(ram / 1024)
+        return "{}GB".format(ram // 1024)
         
     @staticmethod
     def GB1():
@@ -234,6 +483,131 @@ class RAM(object):
     def GB8():
         return "8GB"
     
+class ProductCatalog(object):
+    """The datacenters, OS codes and sizes instances of the account can be
+    created with, read from Virtual_Guest::getCreateObjectOptions and cached
+    per account. Every field is validated with a set lookup.
+    """
+    def __init__(self, sl_client, cache=None):
+        self._sl_virtual_guest = sl_client['Virtual_Guest']
+        self._cache = cache
+        self._options = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_client(sl_client, sl_client_config, ttl):
+        return ProductCatalog(sl_client, JsonFileCache.for_account("create_options", sl_client, sl_client_config, ttl))
+
+    @staticmethod
+    def arg_spec():
+        return dict(
+            catalog_cache_ttl = dict(type='int', default=86400)
+        )
+
+    def options(self):
+        with self._lock:
+            if self._options is None:
+                cached_options = self._cache.load() if self._cache is not None else None
+                if cached_options is None:
+                    cached_options = ProductCatalog.from_sl(self._sl_virtual_guest.getCreateObjectOptions())
+                    if self._cache is not None:
+                        self._cache.store(cached_options)
+                self._options = dict((field, frozenset(values)) for field, values in cached_options.items())
+            return self._options
+
+    @staticmethod
+    def from_sl(sl_options):
+        """The values of getCreateObjectOptions by field as lists"""
+        options = {"datacenter": set(), "os_code": set(), "CPUs": set(), "dedicated_CPUs": set(),
+                   "RAM": set(), "nic_speed": set()}
+        for option in sl_options.get("datacenters", []):
+            options["datacenter"].add(option["template"]["datacenter"]["name"])
+        for option in sl_options.get("operatingSystems", []):
+            options["os_code"].add(option["template"]["operatingSystemReferenceCode"])
+        for option in sl_options.get("processors", []):
+            cpus_field = "dedicated_CPUs" if option["template"].get("dedicatedAccountHostOnlyFlag") else "CPUs"
+            options[cpus_field].add(option["template"]["startCpus"])
+        for option in sl_options.get("memory", []):
+            options["RAM"].add(RAM.from_sl_mb(option["template"]["maxMemory"]))
+        for option in sl_options.get("networkComponents", []):
+            for network_component in option["template"].get("networkComponents", []):
+                options["nic_speed"].add(NICSpeed.from_sl(network_component["maxSpeed"]))
+        return dict((field, sorted(values)) for field, values in options.items())
+
+    def validate(self, instance_config, fields=None):
+        """Raises ValueError listing every setting of instance_config not
+        offered by the catalog. With fields only those settings are checked.
+        """
+        options = self.options()
+        cpus_field = "dedicated_CPUs" if instance_config.dedicated and options["dedicated_CPUs"] else "CPUs"
+        checks = [("datacenter", instance_config.datacenter, "datacenter"),
+                  ("os_code", instance_config.os_code, "os_code"),
+                  ("CPUs", instance_config.CPUs, cpus_field),
+                  ("RAM", instance_config.RAM, "RAM"),
+                  ("nic_speed", instance_config.nic_speed, "nic_speed")]
+        errors = ["{} {} is not one of {}".format(field, value, ", ".join(str(option) for option in sorted(options[option_field])))
+                  for field, value, option_field in checks
+                  if (fields is None or field in fields) and value and value not in options[option_field]]
+        if len(errors) != 0:
+            raise ValueError("Instance {}: {}".format(instance_config.fqdn, "; ".join(errors)))
+
+
+class OrderVerifier(object):
+    """Checks createObject parameters with Virtual_Guest::generateOrderTemplate
+    and Product_Order::verifyOrder. Verified parameters are remembered by a
+    hash of everything but hostname and domain, in a per account cache, so
+    identical profiles are verified once per cache lifetime. Order faults
+    are remembered for the run only, other errors e.g. of the transport are
+    raised as they are and not remembered.
+    """
+    def __init__(self, sl_client, cache=None):
+        self._sl_virtual_guest = sl_client['Virtual_Guest']
+        self._sl_product_order = sl_client['Product_Order']
+        self._cache = cache
+        self._verified = None
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def for_client(sl_client, sl_client_config, ttl):
+        return OrderVerifier(sl_client, JsonFileCache.for_account("verified_orders", sl_client, sl_client_config, ttl))
+
+    @staticmethod
+    def arg_spec():
+        return dict(
+            verify_order = dict(type='bool', default=True)
+        )
+
+    @staticmethod
+    def key(create_params):
+        profile = dict((field, value) for field, value in create_params.items() if field not in ["hostname", "domain"])
+        return hashlib.sha1(json.dumps(profile, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def verify(self, create_params):
+        """Raises ValueError with the reason if create_params cannot be ordered"""
+        key = OrderVerifier.key(create_params)
+#       verifications are serialized, so that concurrent instances of a
+#       profile wait for the first one to verify it
+        with self._lock:
+            if self._verified is None:
+                self._verified = (self._cache.load() if self._cache is not None else None) or {}
+            if key in self._verified:
+                return
+            if key not in self._failures:
+                try:
+                    order_template = self._sl_virtual_guest.generateOrderTemplate(create_params)
+                    self._sl_product_order.verifyOrder(order_template)
+                    self._verified[key] = True
+                    if self._cache is not None:
+                        self._cache.store(self._verified)
+                    return
+                except SoftLayer.SoftLayerAPIError as sl_error:
+                    if not str(sl_error.faultCode).startswith("SoftLayer_Exception_"):
+                        raise
+                    self._failures[key] = sl_error.faultString
+            raise ValueError(self._failures[key])
+
+
 class VSInstanceConfig(VSInstanceConfigBasic):
     def __init__(self, ansible_config=None, sl_get_instance=None):
         if (ansible_config==None) == (sl_get_instance==None):
@@ -254,6 +628,8 @@ class VSInstanceConfig(VSInstanceConfigBasic):
         self.dedicated = ansible_config.get("dedicated")
         self.datacenter = ansible_config.get("datacenter")
         self.os_code = ansible_config.get("os_code")
+        self.image_id = ansible_config.get("image_id") or None
+        self.image_name = ansible_config.get("image_name") or None
         self.private = ansible_config.get("private")
         self.post_install_script = ansible_config.get("post_install_script")
         if self.post_install_script == "":
@@ -266,9 +642,26 @@ class VSInstanceConfig(VSInstanceConfigBasic):
         self.root_ssh_keys = ansible_config.get("root_ssh_keys")
         if self.root_ssh_keys is None:
             self.root_ssh_keys = []
-        self.nic_speed = ansible_config.get("nic_speed")
+        self.nic_speed = NICSpeed.normalize(ansible_config.get("nic_speed"))
         self.CPUs = int(ansible_config.get("CPUs", 0))
         self.RAM = ansible_config.get("RAM")
+        self.recreate_strategy = ansible_config.get("recreate_strategy") or RecreateStrategy.DESTROY_BEFORE_CREATE()
+
+    def validate(self):
+        if self.fqdn is None or self.fqdn == "":
+            raise ValueError("fqdn is required")
+        if len([field for field in [self.os_code, self.image_id, self.image_name] if field]) > 1:
+            raise ValueError("Only one of os_code, image_id or image_name can be given for instance {}".format(self.fqdn))
+        if self.state == VSState.ABSENT():
+            return
+        if not self.datacenter:
+            raise ValueError("datacenter is required for instance {}".format(self.fqdn))
+        if not (self.os_code or self.image()):
+            raise ValueError("os_code, image_id or image_name is required for instance {}".format(self.fqdn))
+
+    def image(self):
+        """The image template global identifier or name the instance is built from"""
+        return self.image_id or self.image_name
         
     def __from_sl(self, sl_data):
         self.state = self.__read_state_from_sl(sl_data)
@@ -279,9 +672,13 @@ class VSInstanceConfig(VSInstanceConfigBasic):
         self.dedicated = sl_data.get("dedicatedAccountHostOnlyFlag", False)
         self.datacenter = sl_data["datacenter"]["name"]
         self.os_code = sl_data["operatingSystem"]["softwareLicense"]["softwareDescription"]["referenceCode"]
+        sl_image = sl_data.get("blockDeviceTemplateGroup") or {}
+        self.image_id = sl_image.get("globalIdentifier")
+        self.image_name = sl_image.get("name")
         self.private = sl_data.get("privateNetworkOnlyFlag", False)
         self.post_install_script = sl_data.get("post_uri", None)
-        self.root_ssh_keys = []
+        self.root_ssh_keys = [sl_ssh_key["label"] for sl_ssh_key in sl_data.get("sshKeys", [])]
+        self.user_data = self.__read_user_data_from_sl(sl_data)
         self.nic_speed = self.__read_nic_speed_from_sl(sl_data)
         self.CPUs = sl_data["maxCpu"]
         self.RAM = RAM.from_sl_mb(sl_data["maxMemory"])
@@ -300,12 +697,22 @@ class VSInstanceConfig(VSInstanceConfigBasic):
         network_components = sl_data.get("networkComponents")
         if network_components is None or len(network_components) == 0:
             return 0
-        eth1_speed = sl_data["networkComponents"][0]["maxSpeed"]
-        eth2_speed = sl_data["networkComponents"][1]["maxSpeed"]
-        if eth1_speed > eth2_speed:
-            common_port_speed = eth1_speed
-        else: common_port_speed = eth2_speed
+#       private only instances have a single network component
+        common_port_speed = max(network_component["maxSpeed"] for network_component in network_components)
         return NICSpeed.from_sl(common_port_speed)
+
+    def __read_user_data_from_sl(self, sl_data):
+        user_data = sl_data.get("userData")
+        if user_data is None:
+            return None
+        
+        for user_data_entry in user_data:
+            user_data_entry_type = user_data_entry.get("type")
+            if user_data_entry_type is not None and\
+                user_data_entry_type["keyname"] == "USER_DATA" and\
+                user_data_entry_type["name"] == "User Data":
+                return user_data_entry["value"]
+        return None
         
     @staticmethod
     def arg_spec():
@@ -313,22 +720,328 @@ class VSInstanceConfig(VSInstanceConfigBasic):
             state = dict(type = 'str', default = VSState.RUNNING(), choices = [VSState.PRESENT(),VSState.RUNNING(), VSState.ABSENT()]),
             payment_scheme = dict(type = 'str', default = VSPaymentScheme.HOURLY(), choices = [VSPaymentScheme.HOURLY(), VSPaymentScheme.MONTHLY()]),
             dedicated = dict(type = 'bool', default=False),
-            datacenter = dict(type ='str', required=True),
-            os_code = dict(type='str', required=True),
+            datacenter = dict(type ='str'),
+            os_code = dict(type='str'),
+            image_id = dict(type='str'),
+            image_name = dict(type='str'),
             private = dict(type='bool', default=True),
             post_install_script = dict(type='str'),
             user_data = dict(type='str'),
             root_ssh_keys = dict(type='list'),
-            nic_speed = dict(type='str', default = NICSpeed.Mb100(), choices = [NICSpeed.Mb100(), NICSpeed.Mb10(), NICSpeed.Gb1()]),
+            nic_speed = dict(type='str', default = NICSpeed.Mb100()),
 # due to bug https://github.com/ansible/ansible/issues/5463 ints cannot be really passed via variables
 # so made it accept strings
-            CPUs = dict(type='str', default = CPUs.CPUs1(), choices = [str(CPUs.CPUs1()), str(CPUs.CPUs2()), str(CPUs.CPUs4())]),
-            RAM = dict(type='str', default = RAM.GB1(), choices = [RAM.GB1(), RAM.GB2(), RAM.GB4(), RAM.GB8()]),
-            wait = dict(type='int', default=600)
+# the sizes are validated against the product catalog of the account
+            CPUs = dict(type='str', default = str(CPUs.CPUs1())),
+            RAM = dict(type='str', default = RAM.GB1()),
+            wait = dict(type='int', default=600),
+            recreate_strategy = dict(type='str', default = RecreateStrategy.DESTROY_BEFORE_CREATE(),
+                                     choices = [RecreateStrategy.DESTROY_BEFORE_CREATE(), RecreateStrategy.CREATE_BEFORE_DESTROY()])
         ) 
-        return dict(new_args, **VSInstanceConfigBasic.arg_spec())   
+        new_args.update(Waiter.arg_spec())
+        basic_args = VSInstanceConfigBasic.arg_spec()
+        basic_args["fqdn"] = dict(type = 'str')
+        return dict(new_args, **basic_args)
+
+    @staticmethod
+    def fleet_arg_spec():
+        return dict(
+            instances = dict(type='list'),
+            parallelism = dict(type='int', default=10)
+        )
+
+    @staticmethod
+    def from_fleet_config(ansible_config):
+        fleet_defaults = dict(ansible_config)
+        for fleet_arg in VSInstanceConfig.fleet_arg_spec().keys():
+            fleet_defaults.pop(fleet_arg, None)
+        fqdns = set()
+        instance_configs = []
+        for instance in ansible_config.get("instances"):
+            if not isinstance(instance, dict):
+                raise ValueError("instances entries must be dicts, was {}".format(type(instance)))
+            instance_config = VSInstanceConfig(
+                ansible_config=dict(fleet_defaults, **VSInstanceConfig.__instance_params(instance)))
+            instance_config.validate()
+            if instance_config.fqdn in fqdns:
+                raise ValueError("fqdn {} is not unique".format(instance_config.fqdn))
+            fqdns.add(instance_config.fqdn)
+            instance_configs.append(instance_config)
+        return instance_configs
+
+    @staticmethod
+    def __instance_params(instance):
+        """The options of an instances entry checked and converted against
+        the argument spec, as Ansible does for the module options. Unset
+        options are left out so that the module values apply.
+        """
+        fqdn = instance.get("fqdn")
+        arg_spec = VSInstanceConfig.arg_spec()
+        fleet_wide_args = ["wait"] + list(Waiter.arg_spec().keys())
+        fleet_wide = sorted(name for name in instance if name in fleet_wide_args)
+        if len(fleet_wide) != 0:
+            raise ValueError("{} of instance {} can only be given for the whole fleet".format(", ".join(fleet_wide), fqdn))
+        unknown = sorted(name for name in instance if name not in arg_spec)
+        if len(unknown) != 0:
+            raise ValueError("Unsupported parameters {} for instance {}, supported are {}".format(
+                ", ".join(unknown), fqdn, ", ".join(sorted(name for name in arg_spec if name not in fleet_wide_args))))
+        return dict((name, VSInstanceConfig.__checked_param(name, arg_spec[name], value, fqdn))
+                    for name, value in instance.items() if value is not None)
+
+    @staticmethod
+    def __checked_param(name, spec, value, fqdn):
+        param_type = spec.get("type", "str")
+        try:
+            if param_type == "bool":
+                value = boolean(value, strict=True)
+            elif param_type == "int":
+                if isinstance(value, bool) or isinstance(value, float) and value != int(value):
+                    raise ValueError()
+                value = int(value)
+            elif param_type == "list":
+                if isinstance(value, basestring):
+                    value = [item.strip() for item in value.split(",") if item.strip() != ""]
+                elif not isinstance(value, list):
+                    raise ValueError()
+            elif isinstance(value, (dict, list)):
+                raise ValueError()
+            elif not isinstance(value, basestring):
+                value = str(value)
+        except (TypeError, ValueError):
+            raise ValueError("{} of instance {} must be a {}, was {!r}".format(name, fqdn, param_type, value))
+        if spec.get("choices") is not None and value not in spec["choices"]:
+            raise ValueError("{} of instance {} must be one of {}, was {!r}".format(
+                name, fqdn, ", ".join(spec["choices"]), value))
+        return value
     
 
+class RollingUpdate(object):
+    """Limits how many instances of a fleet are taken down i.e. recreated,
+    upgraded or OS reloaded at the same time, overall and per datacenter.
+    An instance takes a slot as soon as one frees up, and the rollout stops
+    once more than max_failures instances failed. Without limits it only
+    counts the failures.
+    """
+    def __init__(self, batch_size=None, max_in_flight_per_datacenter=None, max_failures=None):
+        self.batch_size = batch_size
+        self.max_in_flight_per_datacenter = max_in_flight_per_datacenter
+        self.max_failures = max_failures
+        self.failures = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._in_flight_by_datacenter = {}
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def from_params(params):
+        """Raises ValueError if limits are given without wait, as an instance
+        only holds its slot while its transaction is waited for.
+        """
+        limits = [name for name in RollingUpdate.arg_spec().keys() if params.get(name) is not None]
+        if len(limits) != 0 and params.get("wait") == 0:
+            raise ValueError("{} cannot be used with wait 0".format(", ".join(sorted(limits))))
+        return RollingUpdate(params.get("batch_size"), params.get("max_in_flight_per_datacenter"),
+                             params.get("max_failures"))
+
+    @staticmethod
+    def arg_spec():
+        return dict(
+            batch_size = dict(type='int'),
+            max_in_flight_per_datacenter = dict(type='int'),
+            max_failures = dict(type='int')
+        )
+
+    def aborted(self):
+        return self.max_failures is not None and self.failures > self.max_failures
+
+    @contextlib.contextmanager
+    def slot(self, datacenter):
+        """Holds a slot of the rollout while taking down an instance of the
+        datacenter. Raises RolloutAborted once the rollout stopped.
+        """
+        with self._condition:
+            while not self.aborted() and not self.__has_free_slot(datacenter):
+                self._condition.wait()
+            if self.aborted():
+                raise RolloutAborted("Rollout stopped after {} failed instances".format(self.failures))
+            self._in_flight += 1
+            self._in_flight_by_datacenter[datacenter] = self._in_flight_by_datacenter.get(datacenter, 0) + 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._in_flight_by_datacenter[datacenter] -= 1
+                self._condition.notify_all()
+
+    def __has_free_slot(self, datacenter):
+        return (self.batch_size is None or self._in_flight < self.batch_size) \
+            and (self.max_in_flight_per_datacenter is None
+                 or self._in_flight_by_datacenter.get(datacenter, 0) < self.max_in_flight_per_datacenter)
+
+    def record_failure(self):
+        with self._condition:
+            self.failures += 1
+            self._condition.notify_all()
+
+    def stats(self):
+        return {"failures": self.failures, "aborted": self.aborted(), "max_in_flight": self.max_in_flight}
+
+
+class SparePool(object):
+    """Hourly instances provisioned ahead of time for a profile i.e. for all
+    the settings of an instance config but its fqdn. Spares are named
+    spare-<profile>-<suffix>.<domain> and powered off once provisioned.
+    Claiming one renames it to the fqdn of the instance, which takes seconds
+    instead of the minutes of provisioning.
+    """
+    _spare_mask = "id,hostname,domain,provisionDate,activeTransaction.id,powerState.keyName"
+
+    def __init__(self, sl_client, size, domain, claim_lock=None):
+        self._sl_account = sl_client['Account']
+        self._sl_virtual_guest = sl_client['Virtual_Guest']
+        self.size = size
+        self.domain = domain
+        self._claim_lock = claim_lock if claim_lock is not None else threading.Lock()
+
+    @staticmethod
+    def from_params(sl_client, sl_client_config, params):
+        if not params.get("spare_pool_size"):
+            return None
+        return SparePool(sl_client, params.get("spare_pool_size"), params.get("spare_domain"),
+                         FileLock.for_account("spare_pool", sl_client, sl_client_config))
+
+    @staticmethod
+    def arg_spec():
+        return dict(
+            spare_pool_size = dict(type='int', default=0),
+            spare_domain = dict(type='str', default="spares.local"),
+            spare_pool_only = dict(type='bool', default=False)
+        )
+
+    @staticmethod
+    def profile(instance_config):
+        ic = instance_config
+        settings = [ic.datacenter, ic.os_code, ic.image(), ic.CPUs, ic.RAM, ic.nic_speed, ic.private,
+                    ic.dedicated, ic.post_install_script, ic.user_data, sorted(ic.root_ssh_keys)]
+        return hashlib.sha1(json.dumps(settings).encode("utf-8")).hexdigest()[:10]
+
+    def accepts(self, instance_config):
+        return self.size > 0 and instance_config.payment_scheme == VSPaymentScheme.HOURLY()
+
+    def claim(self, instance_config):
+        """Renames a ready spare of the profile of instance_config to its fqdn
+        and returns it, or None if there is none. Does not wait nor refill the
+        pool, which is left to maintain.
+        """
+        profile = SparePool.profile(instance_config)
+#       spares are claimed one at a time, so that concurrent runs never claim
+#       the same one
+        with self._claim_lock:
+            ready_spares = [spare for spare in self.__spares(profile) if SoftlayerVirtualServerBasic.ready(spare)]
+            if len(ready_spares) == 0:
+                return None
+            claimed = random.choice(ready_spares)
+            self._sl_virtual_guest.editObject(
+                {"hostname": instance_config.get_host(), "domain": instance_config.get_domain()},
+                id=claimed["id"])
+        return claimed
+
+    def maintain(self, instance_config, create_spare, check_mode=False):
+        """Powers off the provisioned spares of the profile of instance_config
+        that still run and starts provisioning spares, by calling
+        create_spare(hostname, domain), up to the size of the pool, without
+        claiming any. Does not wait, the new spares run until powered off by
+        a later claim or maintenance.
+        """
+        profile = SparePool.profile(instance_config)
+        with self._claim_lock:
+            spares = self.__spares(profile)
+            if check_mode:
+                powered_off = len(self.__running_ready(spares))
+                new_spare_ids = [None] * max(0, self.size - len(spares))
+            else:
+                powered_off, new_spare_ids = self.__refill(profile, spares, create_spare)
+        return {
+            "profile": profile,
+            "spares": len(spares),
+            "powered_off": powered_off,
+            "created": len(new_spare_ids),
+            "new_spare_ids": [spare_id for spare_id in new_spare_ids if spare_id is not None]
+        }
+
+    def __spares(self, profile):
+        return self._sl_account.getVirtualGuests(mask=self._spare_mask, filter={"virtualGuests": {
+            "hostname": {"operation": "^= spare-{}-".format(profile)},
+            "domain": {"operation": self.domain}}})
+
+    @staticmethod
+    def __running_ready(spares):
+        return [spare for spare in spares
+                if SoftlayerVirtualServerBasic.ready(spare) and spare["powerState"]["keyName"] == "RUNNING"]
+
+    def __refill(self, profile, spares, create_spare):
+        """Returns the number of spares powered off and the ids of the new ones"""
+        running_spares = SparePool.__running_ready(spares)
+        for spare in running_spares:
+            self._sl_virtual_guest.powerOffSoft(id=spare["id"])
+        new_spare_ids = [create_spare("spare-{}-{:06x}".format(profile, random.getrandbits(24)), self.domain)
+                         for i in range(self.size - len(spares))]
+        return len(running_spares), new_spare_ids
+
+
+class InstanceFacts(object):
+    """The id, addresses, power state and sizing of an instance and, on
+    request, its OS credentials, i.e. what softlayer_vs_ip and
+    softlayer_vs_credentials would be run for afterwards. The fields are
+    read along with the config of the instance, or once after an action.
+    """
+    _sizing_mask = "maxCpu,maxMemory,powerState.keyName,datacenter.name"
+
+    def __init__(self, with_credentials=False):
+        self._with_credentials = with_credentials
+
+    @staticmethod
+    def from_params(params):
+        if not params.get("return_facts"):
+            return None
+        return InstanceFacts(params.get("return_credentials"))
+
+    @staticmethod
+    def arg_spec():
+        return dict(
+            return_facts = dict(type='bool', default=False),
+            return_credentials = dict(type='bool', default=False)
+        )
+
+    def mask(self):
+        masks = [IpAddressReader._ip_addresses_mask, self._sizing_mask, SoftlayerVirtualServerBasic._ready_mask]
+        if self._with_credentials:
+            masks.append(CredentialsReader._credentials_mask)
+        return merge_masks(*masks)
+
+    def from_sl(self, sl_data):
+        """Facts of an instance read with at least mask()"""
+        network_components = sl_data.get("networkComponents") or []
+        facts = {
+            "id": sl_data["id"],
+            "fqdn": "{}.{}".format(sl_data["hostname"], sl_data["domain"]),
+            "datacenter": (sl_data.get("datacenter") or {}).get("name"),
+            "power_state": (sl_data.get("powerState") or {}).get("keyName"),
+            "ready": SoftlayerVirtualServerBasic.ready(sl_data),
+            "CPUs": sl_data.get("maxCpu"),
+            "RAM": RAM.from_sl_mb(sl_data["maxMemory"]) if sl_data.get("maxMemory") else None,
+            "nic_speed": NICSpeed.from_sl(max(network_component["maxSpeed"] for network_component in network_components))
+                         if len(network_components) != 0 else None,
+            "ip_addresses": IpAddressReader.ip_addresses(sl_data)
+        }
+        if self._with_credentials:
+#           the OS is only known once the instance is provisioned
+            facts["credentials"] = CredentialsReader.os_credentials(sl_data) if sl_data.get("softwareComponents") else None
+        return facts
+
+
 class SoftlayerVirtualServer(SoftlayerVirtualServerBasic):
     _nothing = "nothing"
     _create = "created"
@@ -338,24 +1051,61 @@ class SoftlayerVirtualServer(SoftlayerVirtualServerBasic):
     _recreated = "recreated"
     _upgraded = "upgraded"
     _os_reloaded = "os_reloaded"
+#   everything needed to compare the instance with its config in a single call
+    _instance_config_mask = ",".join([
+        "id",
+        "hostname",
+        "domain",
+        "hourlyBillingFlag",
+        "dedicatedAccountHostOnlyFlag",
+        "privateNetworkOnlyFlag",
+        "maxCpu",
+        "maxMemory",
+        "powerState.keyName",
+        "datacenter.name",
+        "operatingSystem.softwareLicense.softwareDescription.referenceCode",
+        "networkComponents.maxSpeed",
+        "sshKeys.label",
+        "blockDeviceTemplateGroup[globalIdentifier,name]",
+        "provisionDate",
+        "activeTransaction.id"])
+    _user_data_mask = "userData[value,type[keyname,name]]"
     
-    def __init__(self, sl_client, instance_config, wait):
-        SoftlayerVirtualServerBasic.__init__(self, sl_client, instance_config)
-        self._sl_ssh_keys_manager = SoftLayer.SshKeyManager(sl_client)
+    def __init__(self, sl_client, instance_config, wait, instance_id_index=None, waiter=None,
+                 ssh_key_index=None, image_index=None, check_mode=False, spare_pool=None, rollout=None,
+                 catalog=None, order_verifier=None, facts=None, instance_poller=None):
+        SoftlayerVirtualServerBasic.__init__(self, sl_client, instance_config, instance_id_index, instance_poller)
+        self._ssh_key_index = ssh_key_index if ssh_key_index is not None else SshKeyIndex(sl_client)
+        self._image_index = image_index if image_index is not None else ImageIndex(sl_client)
         self._wait = wait
+        self._check_mode = check_mode
+        self._spare_pool = spare_pool
+        self._catalog = catalog
+        self._order_verifier = order_verifier
+        self._facts = facts
+        self._sl_data = None
+        self._rollout = rollout if rollout is not None else RollingUpdate()
+        self._waiter = waiter if waiter is not None else Waiter()
+        self._job_instance_id = None
+        self._started_at = None
+        self._warnings = []
     
     def sync_config(self, change_log):
-        sync_instance_config = self.__get_vs_instance_config_in_sl()
+        self._started_at = time.time()
+        sync_instance_config = self.__get_vs_instance_config_in_sl(with_user_data=self.ic.user_data is not None)
+        self.__reportUserData(sync_instance_config, change_log)
         actionPerformed = self.__handleState(sync_instance_config, change_log)
         if actionPerformed == self._create or actionPerformed == self._cancel:
             return self.__result(True, actionPerformed)
         if actionPerformed == self._nothing and self.ic.state == VSState.ABSENT():
-            return self.__result(True, actionPerformed)
-        changed = actionPerformed != self._nothing   
-        changed |= self.__handleSettingsRequiringInstanceRecreation(sync_instance_config, change_log)
-        if changed:
+            return self.__result(False, actionPerformed)
+        if self._check_mode:
+            return self.__planned_result(actionPerformed, sync_instance_config, change_log)
+        if self.__handleSettingsRequiringInstanceRecreation(sync_instance_config, change_log):
             return self.__result(True, self._recreated)
-        changed |= self.__handleUpgradableSettings(sync_instance_config, change_log)
+        if actionPerformed != self._nothing:
+            return self.__result(True, actionPerformed)
+        changed = self.__handleUpgradableSettings(sync_instance_config, change_log)
         if changed:
             return self.__result(True, self._upgraded)
         changed |= self.__handleSettingsRequiringOsReload(sync_instance_config, change_log)
@@ -363,49 +1113,198 @@ class SoftlayerVirtualServer(SoftlayerVirtualServerBasic):
             return self.__result(True, self._os_reloaded)
         return self.__result(False, self._nothing)
     
+    def fill_spare_pool(self):
+        """Maintains the spare pool of the profile of the instance instead of
+        syncing the instance. With wait the new spares are waited for and
+        powered off, so that the pool is ready for the next claims.
+        """
+        if self._spare_pool is None or not self._spare_pool.accepts(self.ic):
+            raise VSException(False, "Instance {} has no spare pool, which requires spare_pool_size and hourly"
+                              " payment_scheme".format(self.ic.fqdn))
+        self.__validate()
+        spare_pool = self._spare_pool.maintain(self.ic, self.__create_instance, self._check_mode)
+        if self._wait != 0:
+            for spare_id in spare_pool["new_spare_ids"]:
+                self.__wait_for_ready(spare_id)
+                self.__power_off(spare_id)
+            spare_pool["powered_off"] += len(spare_pool["new_spare_ids"])
+        return {"changed": spare_pool["powered_off"] + spare_pool["created"] != 0, "spare_pool": spare_pool,
+                "wait_stats": self._waiter.stats()}
+
+    def __validate(self, fields=None):
+        """Checks the settings going into an order against the catalog, all
+        of them for a createObject, the changed ones for an upgrade. The
+        settings of existing instances are left alone, as they may have been
+        ordered before an option was retired.
+        """
+        if self._catalog is not None:
+            try:
+                self._catalog.validate(self.ic, fields)
+            except ValueError as ve:
+                raise VSException(False, str(ve))
+
+    def __check_order(self):
+        """Checks that the instance can be created as configured before
+        anything is done about it.
+        """
+        if self.ic.state == VSState.PRESENT() and self._wait == 0:
+            raise VSException(False, "state {} of instance {} requires wait, as a new instance can only be powered"
+                              " off once it is provisioned".format(VSState.PRESENT(), self.ic.fqdn))
+        self.__validate()
+
+    def __planned_result(self, state_action, sync_instance_config, change_log):
+        """In check mode the handlers only log the differences, so all of
+        them are run to get the whole plan from the single read.
+        """
+        recreate = self.__handleSettingsRequiringInstanceRecreation(sync_instance_config, change_log)
+        upgrade = self.__handleUpgradableSettings(sync_instance_config, change_log)
+        os_reload = self.__handleSettingsRequiringOsReload(sync_instance_config, change_log)
+        if recreate:
+            return self.__result(True, self._recreated)
+        if state_action != self._nothing:
+            return self.__result(True, state_action)
+        if upgrade:
+            return self.__result(True, self._upgraded)
+        if os_reload:
+            return self.__result(True, self._os_reloaded)
+        return self.__result(False, self._nothing)
+
     def __result(self, changed, action_performed):
-        return {"changed": changed, "action_performed": action_performed}
+        result = {"changed": changed, "action_performed": action_performed,
+                  "wait_stats": self._waiter.stats()}
+        if len(self._warnings) != 0:
+            result["warnings"] = self._warnings
+        if action_performed != self._nothing and not self._check_mode:
+            result["job"] = self.__job()
+        if self._facts is not None:
+            sl_data = self.__read_facts(action_performed)
+            if sl_data is not None:
+                result["facts"] = self._facts.from_sl(sl_data)
+        return result
+
+    def __read_facts(self, action_performed):
+        """The instance as read along with its config when nothing was done,
+        else read once more. None once the instance is gone.
+        """
+        if self.ic.state == VSState.ABSENT():
+            return None
+        if action_performed == self._nothing or self._check_mode:
+            return self._sl_data
+        return self.sl_virtual_guest.getObject(id=self._job_instance_id or self.get_vs_id(), mask=self._facts.mask())
+
+    def __job(self):
+        """The handle softlayer_vs_wait uses to wait for the started work."""
+        return {
+            "id": self._job_instance_id or self.get_vs_id(),
+            "fqdn": self.ic.fqdn,
+            "expected_state": self.ic.state,
+            "started_at": self._started_at
+        }
     
     def __handleState(self, sync_instance_config, change_log):
         if sync_instance_config.state == self.ic.state:
             return self._nothing
-        change_log.log("state", sync_instance_config.state, self.ic.state)
-        if self.ic.state == VSState.RUNNING() and \
-            sync_instance_config.state == VSState.ABSENT():
+        action = self.__state_action(sync_instance_config.state)
+        change_log.log("state", sync_instance_config.state, self.ic.state, action)
+        if action == self._create:
+            self.__check_order()
+        if self._check_mode:
+            return action
+        if action == self._create:
             self.create()
-            return self._create
-        if self.ic.state == VSState.RUNNING() and \
-            sync_instance_config.state == VSState.PRESENT():
+        elif action == self._start:
             self.power_on()
-            return self._start
-        if self.ic.state == VSState.PRESENT() and \
-            sync_instance_config.state == VSState.ABSENT():
-            self.create()
+        elif action == self._stop:
             self.power_off()
-            return self._create
-        if self.ic.state == VSState.PRESENT() and \
-            sync_instance_config.state == VSState.RUNNING():
-            self.power_off()
-            return self._stop
-        if self.ic.state == VSState.ABSENT():
+        elif action == self._cancel:
             self.cancel()
+        return action
+
+    def __state_action(self, sl_state):
+        if self.ic.state == VSState.ABSENT():
             return self._cancel
+        if sl_state == VSState.ABSENT():
+            return self._create
+        if self.ic.state == VSState.RUNNING():
+            return self._start
+        return self._stop
     
-    def create(self):
-        try: 
-            ssh_key_ids = self.__key_ids()
-        except SSHKeyException as ssh_key_exception:
-            raise VSException(False, ssh_key_exception.msg())
-        
-        create_params = self.__generate_create_dict(
+    def create(self, hostname=None):
+        """Creates the instance in its configured state and waits for it. With
+        hostname a replacement of the instance is created under that hostname
+        and its id returned, leaving the id of the instance untouched.
+        """
+        if hostname is None and self.__claim_spare():
+            return self.get_vs_id()
+        instance_id = self.__create_instance(hostname or self.ic.get_host(), self.ic.get_domain())
+        if hostname is None:
+            self.set_vs_id(instance_id)
+        self._job_instance_id = instance_id
+        self.__wait_for_ready(instance_id)
+        if self.ic.state == VSState.PRESENT():
+            self.__power_off(instance_id)
+        return instance_id
+
+    def __claim_spare(self):
+        if self._spare_pool is None or not self._spare_pool.accepts(self.ic):
+            return False
+        spare = self._spare_pool.claim(self.ic)
+        if spare is not None:
+            self.set_vs_id(spare["id"])
+            self._job_instance_id = spare["id"]
+        self.__refill_spare_pool()
+        if spare is None:
+            return False
+        powered_on = spare["powerState"]["keyName"] == "RUNNING"
+        if self.ic.state == VSState.RUNNING() and not powered_on:
+            self.power_on()
+        elif self.ic.state == VSState.PRESENT() and powered_on:
+            self.power_off()
+        return True
+
+    def __refill_spare_pool(self):
+        """Starts replacing the claimed spare. The instance is synced by then,
+        so a failure is only reported as a warning.
+        """
+        try:
+            self._spare_pool.maintain(self.ic, self.__create_instance)
+        except VSException as se:
+            self._warnings.append("Unable to refill the spare pool of instance {}: {}".format(self.ic.fqdn, se.msg()))
+        except Exception as e:
+            self._warnings.append("Unable to refill the spare pool of instance {}: {}".format(self.ic.fqdn, e))
+
+    def __create_instance(self, hostname, domain):
+        """Places the createObject call and returns the id of the instance"""
+        create_params = self.__create_params(hostname, domain)
+        self.__verify_order(create_params)
+        return self.sl_virtual_guest.createObject(create_params)["id"]
+
+    def verify_order(self):
+        """Checks that the instance can be ordered without ordering it"""
+        self.__check_order()
+        self.__verify_order(self.__create_params(self.ic.get_host(), self.ic.get_domain()))
+
+    def __verify_order(self, create_params):
+        if self._order_verifier is None:
+            return
+        try:
+            self._order_verifier.verify(create_params)
+        except ValueError as ve:
+            raise VSException(False, "Instance {} cannot be ordered: {}".format(self.ic.fqdn, ve))
+
+    def __create_params(self, hostname, domain):
+        ssh_key_ids = self.__resolved_key_ids()
+        image = self.__resolved_image()
+        return self.__generate_create_dict(
             cpus = self.ic.CPUs,
-            memory = RAM.to_sl(self.ic.RAM),
+            memory = RAM.to_sl(self.ic.RAM) * 1024,
             hourly = VSPaymentScheme.to_sl(self.ic.payment_scheme),
-            hostname = self.ic.get_host(),
-            domain = self.ic.get_domain(),
+            hostname = hostname,
+            domain = domain,
             local_disk = False,
             datacenter = self.ic.datacenter,
             os_code = self.ic.os_code,
+            image_id = image["globalIdentifier"] if image is not None else None,
             dedicated = self.ic.dedicated,
             private = self.ic.private,
             post_uri = self.ic.post_install_script,
@@ -413,11 +1312,6 @@ class SoftlayerVirtualServer(SoftlayerVirtualServerBasic):
             nic_speed = NICSpeed.to_sl(self.ic.nic_speed),
             user_data = self.ic.user_data
         )
-        print "create_params: ", create_params
-        with open('/home/hristo/data.txt', 'w') as outfile:
-            json.dump(create_params, outfile)
-        self.sl_virtual_guest.createObject(create_params)
-        self.__wait_for_ready()
         
     def __generate_create_dict(
             self, cpus=None, memory=None, hourly=True,
@@ -504,7 +1398,6 @@ class SoftlayerVirtualServer(SoftlayerVirtualServerBasic):
                 )
 
         if post_uri:
-            print "post_uri", post_uri
             data['postInstallScriptUri'] = post_uri
 
         if ssh_keys:
@@ -512,204 +1405,462 @@ class SoftlayerVirtualServer(SoftlayerVirtualServerBasic):
 
         return data
     
-    def __wait_for_ready(self):
-        if self._wait == 0:
+    def __wait_for_ready(self, instance_id=None):
+        if self._wait == 0 or self._check_mode:
             return 
-        if not self.sl_vs_manager.wait_for_ready(self.get_vs_id(), self._wait, 5, True):
-            raise VSException(true, "Instance {}.{} did not complete transaction in the specified timeout {}"
+        if instance_id is None:
+            instance_id = self.get_vs_id()
+        if not self._waiter.wait(lambda: self.is_ready(instance_id), self._wait):
+            raise VSException(True, "Instance {}.{} did not complete transaction in the specified timeout {}"
                           .format(self.ic.get_host(), self.ic.get_domain(), self._wait)) 
         
     def power_off(self):
-        self.sl_virtual_guest.powerOffSoft(id=self.get_vs_id())
-        self.__wait_for_ready()
+        self.__power_off(self.get_vs_id())
+
+    def __power_off(self, instance_id):
+        self.sl_virtual_guest.powerOffSoft(id=instance_id)
+        self.__wait_for_ready(instance_id)
     
     def power_on(self):
         self.sl_virtual_guest.powerOn(id=self.get_vs_id())
         self.__wait_for_ready()
     
     def cancel(self):
-        self.sl_vs_manager.cancel_instance(self.get_vs_id())
-        self.__wait_for_cancel()
+        instance_id = self.get_vs_id()
+        self._job_instance_id = instance_id
+        self.sl_vs_manager.cancel_instance(instance_id)
+        self.__wait_for_cancel(instance_id)
+        self.set_vs_id(None)
+
+    def replace(self):
+        """Recreates the instance with its downtime reduced to a rename. The
+        replacement is provisioned under a temporary hostname first, then
+        the hostnames are swapped and the old instance is canceled.
+        """
+        if self._wait == 0:
+            raise VSException(False, "recreate_strategy {} of instance {} requires wait"
+                              .format(RecreateStrategy.CREATE_BEFORE_DESTROY(), self.ic.fqdn))
+        old_instance_id = self.get_vs_id()
+        new_instance_id = self.create(hostname=self.__temporary_hostname("new"))
+        self.sl_virtual_guest.editObject({"hostname": self.__temporary_hostname("old")}, id=old_instance_id)
+        self.sl_virtual_guest.editObject({"hostname": self.ic.get_host()}, id=new_instance_id)
+        self.set_vs_id(new_instance_id)
+        self.sl_vs_manager.cancel_instance(old_instance_id)
+        self._job_instance_id = new_instance_id
+
+    def __temporary_hostname(self, role):
+#       hostnames are limited to 63 characters
+        suffix = "-{}-{}".format(role, int(self._started_at or time.time()))
+        return self.ic.get_host()[:63 - len(suffix)] + suffix
     
-    def __wait_for_cancel(self):
-        time_to_wait_until = time.time() + self._wait
-        while time.time() <= time_to_wait_until:
-            if self.get_vs_id(False) is not None:
-                time.sleep(2)
-            else: return
-        raise VSException("Unable to cancel instance {} in the specified timeout {}".format(self.ic.fqdn, self.ic.wait))        
+    def __wait_for_cancel(self, instance_id):
+        if self._wait == 0:
+            return
+        if not self._waiter.wait(lambda: self.is_gone(instance_id), self._wait):
+            raise VSException(True, "Unable to cancel instance {} in the specified timeout {}".format(self.ic.fqdn, self._wait))
         
     def __handleSettingsRequiringInstanceRecreation(self, sync_instance_config, change_log):
         changed = False
         if sync_instance_config.dedicated != self.ic.dedicated:
-            change_log.log("dedicated", sync_instance_config.dedicated, self.ic.dedicated)
+            change_log.log("dedicated", sync_instance_config.dedicated, self.ic.dedicated, self._recreated)
             changed = True
         if sync_instance_config.datacenter != self.ic.datacenter:
-            change_log.log("datacenter",  sync_instance_config.datacenter, self.ic.datacenter)
+            change_log.log("datacenter",  sync_instance_config.datacenter, self.ic.datacenter, self._recreated)
             changed = True
-        if sync_instance_config.os_code != self.ic.os_code:
-            change_log.log("os_code", sync_instance_config.os_code, self.ic.os_code)
+#       the OS of instances built from images is given by the image
+        if self.ic.os_code and sync_instance_config.os_code != self.ic.os_code:
+            change_log.log("os_code", sync_instance_config.os_code, self.ic.os_code, self._recreated)
             changed = True
         if sync_instance_config.payment_scheme != self.ic.payment_scheme:
-            change_log.log("payment_scheme", sync_instance_config.payment_scheme, self.ic.payment_scheme)
+            change_log.log("payment_scheme", sync_instance_config.payment_scheme, self.ic.payment_scheme, self._recreated)
             changed = True
         if sync_instance_config.private != self.ic.private:
-            change_log.log("private", sync_instance_config.private, self.ic.private)
+            change_log.log("private", sync_instance_config.private, self.ic.private, self._recreated)
             changed = True
         if changed:
-            self.cancel()
-            self.create()
+            self.__check_order()
+        if changed and not self._check_mode:
+            with self._rollout.slot(sync_instance_config.datacenter):
+                if self.ic.recreate_strategy == RecreateStrategy.CREATE_BEFORE_DESTROY():
+                    self.replace()
+                else:
+                    self.cancel()
+                    self.create()
         return changed
     
     def __handleUpgradableSettings(self, sync_instance_config, change_log):
-        changed = sync_instance_config.CPUs != self.ic.CPUs
-        if sync_instance_config.CPUs != self.ic.CPUs:
-            change_log.log("CPUs", sync_instance_config.CPUs, self.ic.CPUs)
-        if sync_instance_config.RAM != self.ic.RAM:
-            change_log.log("RAM", sync_instance_config.RAM, self.ic.RAM)
-            changed = true;
-        
-#        if changed:
-#             self.sl_vs_manager.upgrade(instance_id=self.get_vs_id(),
-#                                         cpus=self.ic.CPUs,
-#                                         memory=RAM.to_sl(self.ic.RAM))
-        
+        cpus_changed = sync_instance_config.CPUs != self.ic.CPUs
+        if cpus_changed:
+            change_log.log("CPUs", sync_instance_config.CPUs, self.ic.CPUs, self._upgraded)
+        ram_changed = sync_instance_config.RAM != self.ic.RAM
+        if ram_changed:
+            change_log.log("RAM", sync_instance_config.RAM, self.ic.RAM, self._upgraded)
         nic_speed_changed = sync_instance_config.nic_speed != self.ic.nic_speed
         if nic_speed_changed:
-            change_log.log("nic_speed", sync_instance_config.nic_speed, self.ic.nic_speed)
-#            self.sl_vs_manager.change_port_speed(instance_id=self.get_vs_id(),
-#                                                  public=False,
-#                                                  speed=NICSpeed.to_sl(self.ic.nic_speed))
-#            if self.ic.private:
-#                self.sl_vs_manager.change_port_speed(instance_id=self.get_vs_id(),
-#                                                      public=True,
-#                                                      speed=NICSpeed.to_sl(self.ic.nic_speed))
-        changed = changed or nic_speed_changed
-        self.__wait_for_ready()
+            change_log.log("nic_speed", sync_instance_config.nic_speed, self.ic.nic_speed, self._upgraded)
+        changed = cpus_changed or ram_changed or nic_speed_changed
+        if changed:
+            self.__validate([field for field, field_changed in [("CPUs", cpus_changed), ("RAM", ram_changed),
+                                                                ("nic_speed", nic_speed_changed)] if field_changed])
+        if changed and not self._check_mode:
+            with self._rollout.slot(sync_instance_config.datacenter):
+                self.upgrade(cpus = self.ic.CPUs if cpus_changed else None,
+                             memory = RAM.to_sl(self.ic.RAM) if ram_changed else None,
+                             nic_speed = NICSpeed.to_sl(self.ic.nic_speed) if nic_speed_changed else None)
         return changed
+
+    def upgrade(self, cpus=None, memory=None, nic_speed=None):
+        """Upgrades the given dimensions (memory in GB) with a single order, so
+        that the instance is rebooted once, and waits for the upgrade.
+        """
+        instance_id = self.get_vs_id()
+        try:
+            self.sl_vs_manager.upgrade(instance_id, cpus=cpus, memory=memory, nic_speed=nic_speed,
+                                       public=not self.ic.dedicated)
+        except SoftLayer.SoftLayerError as sl_error:
+            raise VSException(False, "Unable to upgrade instance {}: {}".format(self.ic.fqdn, sl_error))
+        self._job_instance_id = instance_id
+        self.__wait_for_upgrade(instance_id, cpus, memory, nic_speed)
+
+    def __wait_for_upgrade(self, instance_id, cpus, memory, nic_speed):
+        if self._wait == 0:
+            return
+#       the order is only turned into a transaction after a while, so the
+#       instance is ready only once it has the new sizing
+        def upgraded():
+            sl_instance = self.poll(instance_id)
+            return sl_instance is not None and self.ready(sl_instance) \
+                and (cpus is None or sl_instance["maxCpu"] == cpus) \
+                and (memory is None or sl_instance["maxMemory"] == memory * 1024) \
+                and (nic_speed is None or all(network_component["maxSpeed"] == nic_speed
+                                              for network_component in sl_instance.get("networkComponents", [])))
+        if not self._waiter.wait(upgraded, self._wait):
+            raise VSException(True, "Instance {} was not upgraded in the specified timeout {}".format(self.ic.fqdn, self._wait))
     
+    def __reportUserData(self, sync_instance_config, change_log):
+        """User data is only used when an instance is created, so a difference
+        is logged without an action and warned about.
+        """
+        if self.ic.user_data is None or sync_instance_config.state == VSState.ABSENT() \
+            or sync_instance_config.user_data == self.ic.user_data:
+            return
+        change_log.log("user_data", sync_instance_config.user_data, self.ic.user_data)
+        self._warnings.append("user_data of instance {} differs from its config, which is only applied to new"
+                              " instances".format(self.ic.fqdn))
+
     def __handleSettingsRequiringOsReload(self, sync_instance_config, change_log):
         changed = False
         if sync_instance_config.post_install_script != self.ic.post_install_script:
-             change_log.log("post_install_script", sync_instance_config.post_install_script,  self.ic.post_install_script)
+             change_log.log("post_install_script", sync_instance_config.post_install_script,  self.ic.post_install_script,
+                            self._os_reloaded)
              changed = True
         if not (set(sync_instance_config.root_ssh_keys).issubset(set(self.ic.root_ssh_keys)) and \
             set(sync_instance_config.root_ssh_keys).issuperset(set(self.ic.root_ssh_keys))):
-            change_log.log("root_ssh_keys", sync_instance_config.root_ssh_keys, self.ic.root_ssh_keys)
+            change_log.log("root_ssh_keys", sync_instance_config.root_ssh_keys, self.ic.root_ssh_keys, self._os_reloaded)
+            changed = True
+        image = self.__resolved_image()
+        if image is not None and sync_instance_config.image_id != image["globalIdentifier"]:
+            change_log.log("image_id", sync_instance_config.image_id, image["globalIdentifier"], self._os_reloaded)
             changed = True
        
-        if changed :
-            self.sl_vs_manager.reload_instance(instance_id=self.get_vs_id(),
-                                                post_uri=self.ic.post_install_script,
-                                                ssh_keys=self.ic.root_ssh_keys)
-            self.__wait_for_ready()
+        if changed and not self._check_mode:
+            with self._rollout.slot(sync_instance_config.datacenter):
+                self.sl_vs_manager.reload_instance(instance_id=self.get_vs_id(),
+                                                    post_uri=self.ic.post_install_script,
+                                                    ssh_keys=self.__resolved_key_ids(),
+                                                    image_id=image["id"] if image is not None else None)
+                self.__wait_for_ready()
         return changed  
     
 
+    def __resolved_key_ids(self):
+        try: 
+            return self.__key_ids()
+        except SSHKeyException as ssh_key_exception:
+            raise VSException(False, ssh_key_exception.msg())
+
+    def __resolved_image(self):
+        """The image of the config resolved through the image index or None
+        when the instance is built from os_code.
+        """
+        if not self.ic.image():
+            return None
+        image = self._image_index.image(self.ic.image())
+        if image is None:
+            raise VSException(False, "Image template {} not found".format(self.ic.image()))
+        return image
+
     def __key_ids(self):
-        key_ids = []
-        for key_label in self.ic.root_ssh_keys:
-            found_label = self.single_result(self._sl_ssh_keys_manager.list_keys(label=key_label))
-            if found_label is None:
-                raise SSHKeyException("SSH Key with label {} not found".format(key_label))
-            key_ids.append(found_label["id"])
+        key_ids, missing_labels = self._ssh_key_index.key_ids(self.ic.root_ssh_keys)
+        if len(missing_labels) != 0:
+            raise SSHKeyException("SSH Keys with labels {} not found".format(", ".join(missing_labels)))
         return key_ids
             
     
-    def __get_vs_instance_config_in_sl(self):
-        if self.get_vs_id() is None:
-            return VSInstanceConfig(None, None)
-#       make sure there's no transaction running before getting the instance
-#       because it's very likely to change right after the transaction is finished
-        self.__wait_for_ready()
-        sl_data = self.sl_vs_manager.get_instance(self.get_vs_id())
-        instance_config_in_sl = VSInstanceConfig(sl_get_instance=sl_data)
-        instance_config_in_sl.root_ssh_keys = self.__get_ssh_keys_in_sl(self.get_vs_id())
-#       loaded but currently unused. Difference between metadata in VM and
-#       configuration will be ignored. This is because seting it via set_user_data metod
+    def __get_vs_instance_config_in_sl(self, with_user_data=False):
+#       user data is only read when it is configured. Difference between metadata in VM and
+#       configuration is only reported. This is because seting it via set_user_data metod
 #       sets the new metadata in Softlayer model but doesn't update it on the filesystem
 #       from where it is actually used by the scripts. Also to avoid very complicated
 #       scripts for updating the filesystem it would be best to restart the system.
 #       this would unfortunatelly lead to differences if later one changes the configuration
 #       in git so that new vms are created with different metadata, for example different users
-        instance_config_in_sl.user_data = self.__get_user_data(self.get_vs_id())
-        return instance_config_in_sl  
-    
-    def __get_ssh_keys_in_sl(self, instance_id):
-        label_ssh_key_map = self.sl_virtual_guest.getSshKeys(id=instance_id, mask="label")
-        return map(lambda label_ssh_key_pair: label_ssh_key_pair["label"] , label_ssh_key_map)
-    
-    def __get_user_data(self, instance_id):
-        user_data = self.sl_virtual_guest.getUserData(id=instance_id);
-        if user_data is None:
-            return None
-        
-        for user_data_entry in user_data:
-            user_data_entry_type = user_data_entry["type"]
-            if user_data_entry_type is not None and\
-                user_data_entry_type["keyname"] == "USER_DATA" and\
-                user_data_entry_type["name"] == "User Data":
-                return user_data_entry["value"]
-        return None
+        mask = self._instance_config_mask
+        if with_user_data:
+            mask = ",".join([mask, self._user_data_mask])
+        if self._facts is not None:
+            mask = merge_masks(mask, self._facts.mask())
+        sl_data = self.get_vs_object(mask)
+        if sl_data is None:
+            return VSInstanceConfig(None, None)
+#       the instance is very likely to change right after a running transaction
+#       is finished, so it is waited for and read again. Idle instances are used
+#       as read.
+        if not self.ready(sl_data) and self._wait != 0 and not self._check_mode:
+            self.__wait_for_ready()
+            sl_data = self.sl_virtual_guest.getObject(id=self.get_vs_id(), mask=mask)
+        self._sl_data = sl_data
+        return VSInstanceConfig(sl_get_instance=sl_data)
+
+class SoftlayerVirtualServerFleet(object):
+    def __init__(self, sl_client, instance_configs, wait, parallelism, instance_id_index, waiter,
+                 ssh_key_index, image_index, check_mode=False, spare_pool=None, rollout=None,
+                 catalog=None, order_verifier=None, facts=None, instance_poller=None):
+        self.sl_client = sl_client
+#       the waits of all the instances are polled together
+        self.instance_poller = instance_poller if instance_poller is not None else InstancePoller(sl_client)
+        self.catalog = catalog
+        self.facts = facts
+        self.order_verifier = order_verifier
+        self.spare_pool = spare_pool
+        self.rollout = rollout if rollout is not None else RollingUpdate()
+        self._check_mode = check_mode
+        self.ssh_key_index = ssh_key_index
+        self.image_index = image_index
+        self._waiter = waiter
+        self.instance_id_index = instance_id_index
+        self.instance_configs = instance_configs
+        self._wait = wait
+        self._parallelism = parallelism
+
+    def sync_config(self):
+        instance_results = self.__verify_orders()
+        if not any(result.get("failed", False) for result in instance_results):
+            instance_results = run_concurrently(
+                self.__sync_instance,
+                self.instance_configs,
+                self._parallelism)
+        results = dict(
+            (instance_config.fqdn, instance_result)
+            for instance_config, instance_result in zip(self.instance_configs, instance_results))
+        changes = dict((fqdn, result["change_log"]) for fqdn, result in results.items() if result["change_log"])
+        warnings = [warning for result in instance_results for warning in result.get("warnings", [])]
+        fleet_result = {
+            "changed": any(result["changed"] for result in instance_results),
+            "failed": any(result.get("failed", False) for result in instance_results),
+            "results": results,
+            "rollout": self.rollout.stats(),
+            "diff": {
+                "before": dict((fqdn, ChangeLog.diff(change)["before"]) for fqdn, change in changes.items()),
+                "after": dict((fqdn, ChangeLog.diff(change)["after"]) for fqdn, change in changes.items())
+            }
+        }
+        if len(warnings) != 0:
+            fleet_result["warnings"] = warnings
+        return fleet_result
+
+    def fill_spare_pools(self):
+        """Maintains the spare pool of every profile of the instances once,
+        instead of syncing them.
+        """
+        instance_configs_by_profile = dict(
+            (SparePool.profile(instance_config), instance_config) for instance_config in self.instance_configs
+            if instance_config.state != VSState.ABSENT())
+        profiles = sorted(instance_configs_by_profile.keys())
+        results = run_concurrently(
+            self.__fill_spare_pool,
+            [instance_configs_by_profile[profile] for profile in profiles],
+            self._parallelism)
+        return {
+            "changed": any(result["changed"] for result in results),
+            "failed": any(result.get("failed", False) for result in results),
+            "spare_pools": dict(zip(profiles, results))
+        }
+
+    def __fill_spare_pool(self, instance_config):
+        try:
+            return self.__virtual_server(instance_config).fill_spare_pool()
+        except VSException as se:
+            return {"changed": se.changed(), "failed": True, "msg": se.msg()}
+
+    def __verify_orders(self):
+        """Verifies that every instance to be created is offered by the
+        catalog and could be ordered before any of them is changed, so that
+        a bad profile does not leave a half synced fleet. Identical profiles
+        are verified once.
+        """
+        if self.catalog is None and self.order_verifier is None:
+            return [{"changed": False, "change_log": {}} for instance_config in self.instance_configs]
+        return run_concurrently(self.__verify_order, self.instance_configs, self._parallelism)
+
+    def __verify_order(self, instance_config):
+        result = {"changed": False, "change_log": {}}
+#       only instances to be created are ordered, existing ones are left to
+#       their sync even when their profile could no longer be ordered
+        if instance_config.state == VSState.ABSENT() or self.instance_id_index.get(instance_config.fqdn) is not None:
+            return result
+        try:
+            self.__virtual_server(instance_config).verify_order()
+        except VSException as se:
+            result.update(failed=True, msg=se.msg())
+        except Exception as e:
+            result.update(failed=True, msg=str(e))
+        return result
+
+    def __virtual_server(self, instance_config):
+        return SoftlayerVirtualServer(self.sl_client, instance_config, self._wait,
+                                      self.instance_id_index, self._waiter.clone(),
+                                      self.ssh_key_index, self.image_index, self._check_mode,
+                                      self.spare_pool, self.rollout, self.catalog, self.order_verifier,
+                                      self.facts, self.instance_poller)
+
+    def __sync_instance(self, instance_config):
+        change_log = ChangeLog()
+        vs = self.__virtual_server(instance_config)
+        try:
+            result = vs.sync_config(change_log)
+        except RolloutAborted as ra:
+            result = {"changed": False, "failed": True, "skipped": True, "msg": str(ra)}
+        except VSException as se:
+            self.rollout.record_failure()
+            result = {"changed": se.changed(), "failed": True, "msg": se.msg()}
+        except Exception as e:
+            self.rollout.record_failure()
+            result = {"changed": False, "failed": True, "msg": str(e)}
+        result["change_log"] = change_log.to_dict()
+        result["plan"] = change_log.plan()
+        return result
+
 
 class ChangeLog(object):
-    __dict = {}
+    def __init__(self):
+        self.__dict = {}
+        self.__plan = {}
     
-    def log(self, field, old, new):
+    def log(self, field, old, new, action=None):
         self.__dict[field] = {"old": old, "new": new}
+        if action is not None:
+            self.__plan.setdefault(action, []).append(field)
     
     def to_dict(self):
         return self.__dict
+
+    def plan(self):
+        """The differing fields grouped by the action they require"""
+        return self.__plan
+
+    def to_diff(self):
+        return ChangeLog.diff(self.__dict)
+
+    @staticmethod
+    def diff(changes):
+        """Ansible --diff view of a change log dict"""
+        return {
+            "before": dict((field, change["old"]) for field, change in changes.items()),
+            "after": dict((field, change["new"]) for field, change in changes.items())
+        }
     
        
-class VSException(Exception):
-    def __init__(self, changed, msg):
-        self._changed = changed
-        self._msg = msg
-    def __str__(self):
-        return "Exception: {} Changed: {}, MSG: {}".format(type(self), self.changed(), self.msg())
-    def changed(self):
-        return self._changed
-    def msg(self):
-        return self._msg
-
-class SSHKeyException(Exception):
-    def __init__(self, msg):
-        self._msg = msg
-    def __str__(self):
-        return "Exception: {}, MSG: {}".format(type(self), _msg)
-    def msg(self):
-        return self._msg
-        
+class RolloutAborted(Exception):
+    pass
+
     
 def main():
     
     module_helper = AnsibleModule(
         argument_spec = dict(
             SLClientConfig.arg_spec().items() + VSInstanceConfig.arg_spec().items()
-        )
+            + VSInstanceConfig.fleet_arg_spec().items() + SparePool.arg_spec().items()
+            + RollingUpdate.arg_spec().items() + ProductCatalog.arg_spec().items()
+            + OrderVerifier.arg_spec().items() + InstanceFacts.arg_spec().items()
+        ),
+        required_one_of = [["fqdn", "instances"]],
+        mutually_exclusive = [["fqdn", "instances"]],
+        supports_check_mode = True
     )
+    try:
+        rollout = RollingUpdate.from_params(module_helper.params)
+    except ValueError as ve:
+        module_helper.fail_json(changed=False, msg=str(ve))
     
     sl_client_config = SLClientConfig(module_helper.params)
-    sl_client = SoftLayer.Client(username=sl_client_config.sl_username, api_key=sl_client_config.api_key)
+    sl_client = create_sl_client(sl_client_config)
+    api_calls = InstrumentedTransport.install(sl_client, sl_client_config)
+    instance_id_index = VSInstanceIdIndex.for_client(sl_client, sl_client_config)
+    ssh_key_index = SshKeyIndex.for_client(sl_client, sl_client_config)
+    image_index = ImageIndex.for_client(sl_client, sl_client_config)
+    spare_pool = SparePool.from_params(sl_client, sl_client_config, module_helper.params)
+    catalog = ProductCatalog.for_client(sl_client, sl_client_config, module_helper.params.get("catalog_cache_ttl"))
+    order_verifier = None
+    if module_helper.params.get("verify_order"):
+        order_verifier = OrderVerifier.for_client(sl_client, sl_client_config, module_helper.params.get("catalog_cache_ttl"))
+    facts = InstanceFacts.from_params(module_helper.params)
+    if module_helper.params.get("instances") is not None:
+        try:
+            instance_configs = VSInstanceConfig.from_fleet_config(module_helper.params)
+        except ValueError as ve:
+            module_helper.fail_json(changed=False, msg=str(ve), api_stats=api_calls.stats())
+        fleet = SoftlayerVirtualServerFleet(sl_client, instance_configs,
+                                            module_helper.params.get("wait"),
+                                            module_helper.params.get("parallelism"),
+                                            instance_id_index,
+                                            Waiter.from_params(module_helper.params),
+                                            ssh_key_index,
+                                            image_index,
+                                            module_helper.check_mode,
+                                            spare_pool,
+                                            rollout,
+                                            catalog,
+                                            order_verifier,
+                                            facts)
+        if module_helper.params.get("spare_pool_only"):
+            result = fleet.fill_spare_pools()
+        else:
+            result = fleet.sync_config()
+        if result["failed"]:
+            module_helper.fail_json(msg="Failed to sync some of the instances", api_stats=api_calls.stats(), **result)
+        module_helper.exit_json(api_stats=api_calls.stats(), **result)
+
+    instance_config = VSInstanceConfig(ansible_config=module_helper.params)
+    try:
+        instance_config.validate()
+    except ValueError as ve:
+        module_helper.fail_json(changed=False, msg=str(ve), api_stats=api_calls.stats())
     vs = SoftlayerVirtualServer(sl_client,
-                                 VSInstanceConfig(ansible_config=module_helper.params),
-                                  module_helper.params.get("wait"))
+                                 instance_config,
+                                  module_helper.params.get("wait"),
+                                  instance_id_index,
+                                  Waiter.from_params(module_helper.params),
+                                  ssh_key_index,
+                                  image_index,
+                                  module_helper.check_mode,
+                                  spare_pool,
+                                  catalog=catalog,
+                                  order_verifier=order_verifier,
+                                  facts=facts)
     try:
+        if module_helper.params.get("spare_pool_only"):
+            module_helper.exit_json(api_stats=api_calls.stats(), **vs.fill_spare_pool())
         change_log = ChangeLog()
         result = vs.sync_config(change_log)
         result['change_log'] = change_log.to_dict()
-        module_helper.exit_json(**result)
+        result['plan'] = change_log.plan()
+        result['diff'] = change_log.to_diff()
+        module_helper.exit_json(api_stats=api_calls.stats(), **result)
     except VSException as se:
-        module_helper.fail_json(changed=se.changed(), msg=str(se))
-
-main()
-
-
-
-
-
-
-
-
+        module_helper.fail_json(changed=se.changed(), msg=str(se), api_stats=api_calls.stats())
+    except Exception as e:
+        module_helper.fail_json(changed=False, msg=str(e), api_stats=api_calls.stats())
 
+if __name__ == '__main__':
+    main()
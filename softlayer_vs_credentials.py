@@ -11,6 +11,8 @@ description:
     - Result could be stored using register keyword in ansible.
     - Username and password could be read like <result_ansible_var>.password and
     - <result_ansible_var>.username
+    - When fqdns is given, the credentials of all the instances are read with a
+    - single account call and the result is a dict keyed by fqdn.
 
 requirements:
     - Requires SoftLayer python client
@@ -24,11 +26,67 @@ options:
         description:
             - SoftLayer username
         default: null
+    api_trace_file:
+        description:
+            - Appends a NDJSON record of every SoftLayer API call made to this file.
+            - Defaults to SL_API_TRACE env variable. The result always holds an
+            - api_stats summary of the calls.
+        default: null
+    use_broker:
+        description:
+            - Sends the API calls through the local scripts/softlayer_broker.py process,
+            - which keeps warm clients and caches shared by all module runs.
+            - By default the broker is used when it is running, yes starts it on
+            - demand and no never uses it. Defaults to SL_BROKER env variable.
+        type: bool
+        default: null
+    broker_socket:
+        description:
+            - Unix socket of the broker
+        default: <cache_dir>/broker.sock
+    api_rate_limit:
+        description:
+            - The maximum SoftLayer API calls per second. The budget is shared
+            - through a lock file in cache_dir by all the module runs of the
+            - account on the controller. 0 disables the limit. Defaults to
+            - SL_API_RATE_LIMIT env variable or 10. The time spent waiting is
+            - reported as throttle_wait in api_stats.
+        type: float
+        default: null
+    api_burst:
+        description:
+            - The number of calls that can be made at once before the rate limit applies
+        type: integer
+        default: 20
+    api_retries:
+        description:
+            - How many times a throttled call (HTTP 429), or a read failing with
+            - a 5xx or connection error, is retried with exponential backoff.
+        type: integer
+        default: 5
+    cache_dir:
+        description:
+            - Directory holding the local caches shared between module runs.
+            - Defaults to SL_CACHE_DIR env variable or ~/.ansible/tmp/softlayer
+        default: null
+    instance_cache_ttl:
+        description:
+            - Seconds the cached fqdn to instance id index of the account is
+            - reused by subsequent module runs. 0 disables the cache.
+        type: integer
+        default: 300
     fqdn:
         description:
             - The fully qualified domain name of the instance.
+            - Required unless fqdns is given.
         type: string
-        required: true
+        required: false
+    fqdns:
+        description:
+            - List of fully qualified domain names of instances to read the
+            - credentials of.
+        type: list
+        default: null
 
 author: scoss
 notes:
@@ -36,46 +94,35 @@ notes:
 '''
 
 from ansible.module_utils.basic import *
-import SoftLayer
-import sys
-import logging
-import time
-from softlayer_vs_basic import *
+try:
+    from ansible.module_utils.softlayer.readers import *
+except ImportError:
+    from module_utils.softlayer.readers import *
 
-class CredentialsReader(SoftlayerVirtualServerBasic):
-    def __init__(self, sl_client, instance_config):
-        SoftlayerVirtualServerBasic.__init__(self, sl_client, instance_config)
-        self._sl_software_component_service = self.sl_client['SoftLayer_Software_Component']
- 
-    def read_credentials(self):
-        installed_components = self.sl_virtual_guest.getSoftwareComponents(id=self.get_vs_id(True)) 
-        os_component = self._find_os_component(installed_components)
-        return self.single_result(self._sl_software_component_service.getPasswords(id=os_component["id"]))
-    
-    def _find_os_component(self, components):
-        for comp in components:
-            comp_description = self._sl_software_component_service.getSoftwareDescription(id=comp["id"])
-            if comp_description["operatingSystem"] == 1:
-                return comp;
-            else:
-                continue
-        raise Exception("No operating system component found on instance")
-                
 def main():
     
     module_helper = AnsibleModule(
         argument_spec = dict(
             SLClientConfig.arg_spec().items() + VSInstanceConfigBasic.arg_spec().items()
-        )
+            + [("fqdn", dict(type = 'str')), ("fqdns", dict(type = 'list'))]
+        ),
+        required_one_of = [["fqdn", "fqdns"]],
+        mutually_exclusive = [["fqdn", "fqdns"]]
     )
     
     sl_client_config = SLClientConfig(module_helper.params)
-    sl_client = SoftLayer.Client(username=sl_client_config.sl_username, api_key=sl_client_config.api_key)
+    sl_client = create_sl_client(sl_client_config)
+    api_calls = InstrumentedTransport.install(sl_client, sl_client_config)
+    instance_id_index = VSInstanceIdIndex.for_client(sl_client, sl_client_config)
     vs = CredentialsReader(sl_client,
-                                 VSInstanceConfigBasic(ansible_config=module_helper.params))
+                                 VSInstanceConfigBasic(ansible_config=module_helper.params),
+                                 instance_id_index)
     try:
-        module_helper.exit_json(changed=False, result=vs.read_credentials())
+        if module_helper.params.get("fqdns") is not None:
+            module_helper.exit_json(changed=False, result=vs.read_credentials_of(module_helper.params.get("fqdns")), api_stats=api_calls.stats())
+        module_helper.exit_json(changed=False, result=vs.read_credentials(), api_stats=api_calls.stats())
     except Exception as se:
-        module_helper.fail_json(changed=False, msg=str(se))
+        module_helper.fail_json(changed=False, msg=str(se), api_stats=api_calls.stats())
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
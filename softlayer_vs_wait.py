@@ -0,0 +1,235 @@
+#!/usr/bin/python 
+# -*- coding: utf-8 -*-
+
+DOCUMENTATION = '''
+---
+module: softlayer_vs_wait
+short_description: Waits for virtual server jobs started by softlayer_vs
+description:
+    - Waits for the instances of one or more softlayer_vs jobs to reach their
+    - expected state i.e. running, present (halted) or absent (canceled).
+    - Used together with wait set to 0 in softlayer_vs to start many
+    - provisions, do other work in the meantime and join at the end.
+    - All pending instances are checked with a single account call per poll.
+    - The result holds a results dict keyed by fqdn.
+
+requirements:
+    - Requires SoftLayer python client
+    - Requires Ansible
+options:
+    api_key:
+        description:
+            - SoftLayer API Key
+        default: null
+    sl_username:
+        description:
+            - SoftLayer username
+        default: null
+    api_trace_file:
+        description:
+            - Appends a NDJSON record of every SoftLayer API call made to this file.
+            - Defaults to SL_API_TRACE env variable. The result always holds an
+            - api_stats summary of the calls.
+        default: null
+    use_broker:
+        description:
+            - Sends the API calls through the local scripts/softlayer_broker.py process,
+            - which keeps warm clients and caches shared by all module runs.
+            - By default the broker is used when it is running, yes starts it on
+            - demand and no never uses it. Defaults to SL_BROKER env variable.
+        type: bool
+        default: null
+    broker_socket:
+        description:
+            - Unix socket of the broker
+        default: <cache_dir>/broker.sock
+    api_rate_limit:
+        description:
+            - The maximum SoftLayer API calls per second. The budget is shared
+            - through a lock file in cache_dir by all the module runs of the
+            - account on the controller. 0 disables the limit. Defaults to
+            - SL_API_RATE_LIMIT env variable or 10. The time spent waiting is
+            - reported as throttle_wait in api_stats.
+        type: float
+        default: null
+    api_burst:
+        description:
+            - The number of calls that can be made at once before the rate limit applies
+        type: integer
+        default: 20
+    api_retries:
+        description:
+            - How many times a throttled call (HTTP 429), or a read failing with
+            - a 5xx or connection error, is retried with exponential backoff.
+        type: integer
+        default: 5
+    jobs:
+        description:
+            - List of job dicts as returned in the job entry of softlayer_vs.
+            - Registered softlayer_vs results are accepted as well, including
+            - fleet mode results. Results with no job are ignored.
+        type: list
+        required: true
+    wait:
+        description:
+            - The time in seconds to wait for all the jobs to finish
+        type: integer
+        default: 600
+    wait_initial_interval:
+        description:
+            - Seconds between the first two polls. The interval grows exponentially.
+        type: float
+        default: 1.0
+    wait_max_interval:
+        description:
+            - The maximum seconds between two polls. It bounds how long a
+            - finished transaction goes unnoticed.
+        type: float
+        default: 5.0
+    wait_backoff_factor:
+        description:
+            - The factor by which the poll interval grows after each poll.
+        type: float
+        default: 2.0
+    wait_jitter:
+        description:
+            - Relative random deviation applied to every poll interval.
+        type: float
+        default: 0.2
+
+author: scoss
+notes:
+    - Instead of supplying api_key and username, .softlayer or env variables
+    - Example:
+    - - softlayer_vs: fqdn={{ item }} datacenter=ams01 os_code=DEBIAN_7_64 wait=0
+    -   with_items: "{{ hosts }}"
+    -   register: provisioning
+    - - softlayer_vs_wait:
+    -     jobs: "{{ provisioning.results }}"
+'''
+
+from ansible.module_utils.basic import *
+import time
+try:
+    from ansible.module_utils.softlayer.basic import *
+except ImportError:
+    from module_utils.softlayer.basic import *
+
+class VSJobs(object):
+    def __init__(self, ansible_config):
+        self.jobs = {}
+        for entry in ansible_config.get("jobs"):
+            for job in self.__jobs_in(entry):
+                if job.get("id") is None:
+                    raise ValueError("No instance id in job {}".format(job))
+                self.jobs[int(job["id"])] = job
+
+    def __jobs_in(self, entry):
+        if not isinstance(entry, dict):
+            raise ValueError("jobs entries must be dicts, was {}".format(type(entry)))
+        if "expected_state" in entry:
+            return [entry]
+        if "job" in entry:
+            return [entry["job"]]
+        if "results" in entry:
+            results = entry["results"]
+            if isinstance(results, dict):
+                results = results.values()
+            return [job for result in results for job in self.__jobs_in(result)]
+        return []
+
+    @staticmethod
+    def arg_spec():
+        return dict(
+            jobs = dict(type = 'list', required = True),
+            wait = dict(type = 'int', default = 600)
+        )
+
+
+class VSJobsWaiter(object):
+    _poll_mask = "id,provisionDate,activeTransaction.id,powerState.keyName"
+
+    def __init__(self, sl_client, vs_jobs, wait, waiter):
+        self._sl_account = sl_client['Account']
+        self._jobs = vs_jobs.jobs
+        self._wait = wait
+        self._waiter = waiter
+        self._done = {}
+
+    def wait(self):
+        self._waiter.wait(self.__poll, self._wait)
+        results = {}
+        for instance_id, job in self._jobs.items():
+            results[job["fqdn"]] = {
+                "id": instance_id,
+                "expected_state": job["expected_state"],
+                "done": instance_id in self._done,
+                "elapsed": self.__elapsed(job, self._done.get(instance_id))
+            }
+        return {
+            "changed": False,
+            "failed": len(self._done) != len(self._jobs),
+            "results": results,
+            "wait_stats": self._waiter.stats()
+        }
+
+    def __poll(self):
+        pending_ids = [instance_id for instance_id in self._jobs.keys() if instance_id not in self._done]
+        if len(pending_ids) == 0:
+            return True
+        sl_instances = self._sl_account.getVirtualGuests(
+            mask=self._poll_mask,
+            filter={"virtualGuests": {"id": in_filter(pending_ids)}})
+        sl_instances_by_id = dict((sl_instance["id"], sl_instance) for sl_instance in sl_instances)
+        now = time.time()
+        for instance_id in pending_ids:
+            if self.__reached(self._jobs[instance_id]["expected_state"], sl_instances_by_id.get(instance_id)):
+                self._done[instance_id] = now
+        return len(self._done) == len(self._jobs)
+
+    def __reached(self, expected_state, sl_instance):
+        if expected_state == "absent":
+            return sl_instance is None
+        if sl_instance is None:
+            return False
+        if not sl_instance.get("provisionDate") or sl_instance.get("activeTransaction"):
+            return False
+        power_state = sl_instance.get("powerState", {}).get("keyName")
+        if expected_state == "running":
+            return power_state == "RUNNING"
+        return power_state == "HALTED"
+
+    def __elapsed(self, job, done_at):
+        if job.get("started_at") is None:
+            return None
+        return round((done_at or time.time()) - job["started_at"], 3)
+
+def main():
+    
+    module_helper = AnsibleModule(
+        argument_spec = dict(
+            SLClientConfig.arg_spec().items() + VSJobs.arg_spec().items()
+            + Waiter.arg_spec().items()
+        )
+    )
+    
+    sl_client_config = SLClientConfig(module_helper.params)
+    sl_client = create_sl_client(sl_client_config)
+    api_calls = InstrumentedTransport.install(sl_client, sl_client_config)
+    try:
+        vs_jobs = VSJobs(module_helper.params)
+    except ValueError as ve:
+        module_helper.fail_json(changed=False, msg=str(ve), api_stats=api_calls.stats())
+    jobs_waiter = VSJobsWaiter(sl_client, vs_jobs, module_helper.params.get("wait"),
+                               Waiter.from_params(module_helper.params))
+    try:
+        result = jobs_waiter.wait()
+    except Exception as se:
+        module_helper.fail_json(changed=False, msg=str(se), api_stats=api_calls.stats())
+    if result["failed"]:
+        module_helper.fail_json(msg="Not all jobs finished in the specified timeout {}".format(
+            module_helper.params.get("wait")), api_stats=api_calls.stats(), **result)
+    module_helper.exit_json(api_stats=api_calls.stats(), **result)
+
+if __name__ == '__main__':
+    main()
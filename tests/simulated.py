@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+'''
+Helpers running the modules against the in-process SoftLayer simulator.
+'''
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SoftLayer
+from softlayer_simulator import SimulatedSoftLayer, VirtualClock
+from softlayer_vs import SoftlayerVirtualServer, VSInstanceConfig, ChangeLog
+from module_utils.softlayer.basic import *
+
+DOMAIN = "example.com"
+
+def simulator(guests=0, ssh_keys=0):
+    simulated = SimulatedSoftLayer(VirtualClock())
+    simulated.populate(guests=guests, ssh_keys=ssh_keys)
+    simulated.reset_calls()
+    return simulated
+
+def instance_config(**params):
+    config = dict((name, spec.get("default")) for name, spec in VSInstanceConfig.arg_spec().items())
+    config.update(datacenter="ams01", os_code="DEBIAN_7_64", root_ssh_keys=["key0", "key1"])
+    config.update(params)
+    return VSInstanceConfig(ansible_config=config)
+
+def no_cache():
+    return JsonFileCache(os.path.join(tempfile.gettempdir(), "softlayer-test-cache.json"), 0)
+
+def instance_id_index(simulated):
+    return VSInstanceIdIndex(SoftLayer.VSManager(simulated.client()), no_cache())
+
+def waiter(simulated):
+    return Waiter(clock=simulated.clock.time, sleep=simulated.clock.sleep)
+
+def virtual_server(simulated, config, wait=3600, **kwargs):
+    return SoftlayerVirtualServer(simulated.client(), config, wait, instance_id_index(simulated),
+                                  waiter(simulated), **kwargs)
+
+def guests_by_fqdn(simulated):
+    return dict(("{}.{}".format(guest["hostname"], guest["domain"]), guest)
+                for guest in simulated.guests.values())
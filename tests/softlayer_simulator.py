@@ -0,0 +1,560 @@
+# -*- coding: utf-8 -*-
+
+'''
+In-process fake of the SoftLayer API for measuring and regression testing the
+modules without a live account.
+
+SimulatedSoftLayer is a transport i.e. it is passed to SoftLayer.BaseClient
+and receives every SoftLayer.transports.Request the client and its managers
+make. It keeps the state of an account (virtual guests, SSH keys, software
+components) and models provisioning, power, OS reload and cancellation
+transactions which take configurable durations on a VirtualClock. Every
+call advances the clock by a configurable latency, so waits and round
+trips show up as simulated wall time without really sleeping. Concurrent
+threads each advance their own timeline, so a fleet takes about as long as
+its slowest instance. Transactions are checked against the timeline of the
+calling thread, which is only exact for threads working on their own guests.
+
+Object masks are not applied, results always hold every simulated property.
+Object filters support the exact, in, ^=, *=, $=, _= and date operations.
+
+Example:
+    clock = VirtualClock()
+    simulator = SimulatedSoftLayer(clock)
+    simulator.populate(guests=100, ssh_keys=100)
+    sl_client = simulator.client()
+    waiter = Waiter(clock=clock.time, sleep=clock.sleep)
+'''
+
+import SoftLayer
+import threading
+import datetime
+import time
+import itertools
+import copy
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+class VirtualClock(object):
+    """Simulated time. Every thread has a timeline of its own, so that the
+    waits and calls of concurrent threads overlap as they would for real
+    instead of adding up. A thread starts at the time of the thread which
+    created the clock, i.e. the one running the scenario, and that thread
+    continues at the latest time any thread reached, as it is the one
+    waiting for the others to finish. The sleeps of the other threads take
+    pace real seconds per simulated second, so that concurrent threads run
+    in about the order of their timelines, e.g. polls made at the same
+    simulated time meet.
+    """
+    def __init__(self, now=1.0e9, pace=0.001):
+        self._root = threading.current_thread()
+        self.pace = pace
+        self._root_now = now
+        self._latest = now
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def time(self):
+        with self._lock:
+            return self.__now()
+
+    def sleep(self, seconds):
+        if self.pace and threading.current_thread() is not self._root:
+            time.sleep(max(0, seconds) * self.pace)
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        with self._lock:
+            now = self.__now() + max(0, seconds)
+            if threading.current_thread() is self._root:
+                self._root_now = now
+            else:
+                self._local.now = now
+            self._latest = max(self._latest, now)
+
+    def __now(self):
+        if threading.current_thread() is self._root:
+            self._root_now = max(self._root_now, self._latest)
+            return self._root_now
+        if not hasattr(self._local, "now"):
+            self._local.now = self._root_now
+        return self._local.now
+
+
+class SimulatedTransaction(object):
+    def __init__(self, name, until, on_complete=None):
+        self.name = name
+        self.until = until
+        self.on_complete = on_complete
+
+
+class SimulatedSoftLayer(object):
+#   upgradable sizes as (categoryCode, capacity, units, description)
+    upgrade_items = \
+        [("guest_core", cpus, units, "{} x 2.0 GHz Cores".format(cpus))
+         for cpus in [1, 2, 4, 8, 16] for units in ["CORE", "PRIVATE_CORE"]] + \
+        [("ram", memory, "GB", "{} GB".format(memory)) for memory in [1, 2, 4, 8, 16, 32, 64]] + \
+        [("port_speed", speed, "Mbps", "{} Mbps Public & Private Network Uplinks".format(speed))
+         for speed in [10, 100, 1000]]
+
+    datacenters = ["ams01", "dal05", "fra02", "lon02", "sjc01", "wdc01"]
+    os_codes = ["CENTOS_7_64", "DEBIAN_7_64", "DEBIAN_8_64", "UBUNTU_16_64"]
+
+    def __init__(self, clock=None, latency=0.1, latency_per_object=0.0005,
+                 provision_time=300, power_time=30, reload_time=600,
+                 cancel_time=60, upgrade_time=300):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.latency = latency
+        self.latency_per_object = latency_per_object
+        self.provision_time = provision_time
+        self.power_time = power_time
+        self.reload_time = reload_time
+        self.cancel_time = cancel_time
+        self.upgrade_time = upgrade_time
+        self.guests = {}
+        self.ssh_keys = {}
+        self.images = {}
+        self.calls = []
+#       the requests of the calls, for checking their masks and filters
+        self.requests = []
+        self._ids = itertools.count(1000)
+        self._lock = threading.RLock()
+
+    def client(self):
+        return SoftLayer.BaseClient(transport=self)
+
+    def call_count(self, service=None, method=None):
+        return len([call for call in self.calls
+                    if (service is None or call[0] == service) and (method is None or call[1] == method)])
+
+    def reset_calls(self):
+        self.calls = []
+        self.requests = []
+
+    def __call__(self, request):
+        service = request.service.replace("SoftLayer_", "", 1)
+        handler = getattr(self, "_{}_{}".format(service, request.method), None)
+        with self._lock:
+            self.calls.append((service, request.method))
+            self.requests.append(request)
+            if handler is None:
+                raise SoftLayer.SoftLayerAPIError(
+                    "SoftLayer_Exception_Public",
+                    "Method {}::{} is not simulated".format(request.service, request.method))
+            self.__complete_transactions()
+            result = handler(request)
+            result = copy.deepcopy(result)
+        objects = len(result) if isinstance(result, list) else 1
+        self.clock.advance(self.latency + self.latency_per_object * objects)
+        return result
+
+#   state
+
+    def populate(self, guests=0, ssh_keys=0, datacenter="ams01", os_code="DEBIAN_7_64",
+                 domain="example.com"):
+        key_ids = [self.add_ssh_key("key{}".format(i), self.ssh_key_text(i), "maintained by ansible")
+                   for i in range(ssh_keys)]
+        for i in range(guests):
+            self.add_guest("host{}".format(i), domain, datacenter=datacenter, os_code=os_code,
+                           ssh_key_ids=key_ids[:2])
+
+    @staticmethod
+    def ssh_key_text(i):
+        return "ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQ{:040d} key{}".format(i, i)
+
+    def add_ssh_key(self, label, key, notes=None):
+        with self._lock:
+            key_id = next(self._ids)
+            self.ssh_keys[key_id] = {"id": key_id, "label": label, "key": key, "notes": notes}
+            return key_id
+
+    def add_image(self, name, os_code="DEBIAN_7_64", public=False):
+        with self._lock:
+            image_id = next(self._ids)
+            self.images[image_id] = {
+                "id": image_id,
+                "name": name,
+                "globalIdentifier": "0000{:04d}-0000-4000-8000-{:012d}".format(image_id % 10000, image_id),
+                "operatingSystemReferenceCode": os_code,
+                "_public": public
+            }
+            return image_id
+
+    def add_guest(self, hostname, domain, datacenter="ams01", os_code="DEBIAN_7_64", cpus=1,
+                  memory=1024, hourly=True, dedicated=False, private=True, nic_speed=100,
+                  ssh_key_ids=None, user_data=None, provisioned=True, image_id=None):
+        with self._lock:
+            guest_id = next(self._ids)
+            network_components = [self.__network_component(guest_id, "eth", 0, nic_speed, "10.0")]
+            if not private:
+                network_components.append(self.__network_component(guest_id, "eth", 1, nic_speed, "169.50"))
+            self.guests[guest_id] = {
+                "id": guest_id,
+                "globalIdentifier": "guid-{}".format(guest_id),
+                "hostname": hostname,
+                "domain": domain,
+                "fullyQualifiedDomainName": "{}.{}".format(hostname, domain),
+                "hourlyBillingFlag": hourly,
+                "dedicatedAccountHostOnlyFlag": dedicated,
+                "privateNetworkOnlyFlag": private,
+                "startCpus": cpus,
+                "maxCpu": cpus,
+                "maxMemory": memory,
+                "powerState": {"keyName": "RUNNING", "name": "Running"},
+                "datacenter": {"name": datacenter},
+                "operatingSystem": {"softwareLicense": {"softwareDescription": {"referenceCode": os_code}}},
+                "networkComponents": network_components,
+                "primaryBackendIpAddress": network_components[0]["primaryIpAddress"],
+                "primaryIpAddress": None if private else network_components[1]["primaryIpAddress"],
+                "sshKeys": [self.__guest_ssh_key(key_id) for key_id in (ssh_key_ids or [])],
+                "userData": [self.__user_data(user_data)] if user_data else [],
+                "softwareComponents": [{
+                    "id": next(self._ids),
+                    "softwareDescription": {"operatingSystem": 1, "referenceCode": os_code},
+                    "passwords": [{"id": next(self._ids), "username": "root",
+                                   "password": "secret{}".format(guest_id)}]
+                }],
+                "blockDeviceTemplateGroup": self.__image_view(self.images[image_id]) if image_id else None,
+                "tagReferences": [],
+                "createDate": self.__date(),
+                "modifyDate": self.__date(),
+                "provisionDate": self.__date() if provisioned else None,
+                "_transaction": None
+            }
+            return guest_id
+
+    def __network_component(self, guest_id, name, port, speed, network):
+        return {
+            "name": name,
+            "port": port,
+            "maxSpeed": speed,
+            "speed": speed,
+            "macAddress": "06:00:00:{:02x}:{:02x}:{:02x}".format(port, (guest_id >> 8) & 0xff, guest_id & 0xff),
+            "primaryIpAddress": "{}.{}.{}".format(network, (guest_id >> 8) & 0xff, guest_id & 0xff),
+            "networkVlan": {"id": 100 + port, "vlanNumber": 900 + port, "name": None}
+        }
+
+    def __guest_ssh_key(self, key_id):
+        return {"id": key_id, "label": self.ssh_keys[key_id]["label"]}
+
+    def __user_data(self, value):
+        return {"value": value, "type": {"keyname": "USER_DATA", "name": "User Data"}}
+
+    def __date(self):
+        return datetime.datetime.utcfromtimestamp(self.clock.time()).strftime("%Y-%m-%dT%H:%M:%S-00:00")
+
+    def __start_transaction(self, guest, name, duration, on_complete=None):
+        if guest["_transaction"] is not None:
+            raise SoftLayer.SoftLayerAPIError(
+                "SoftLayer_Exception_Public",
+                "Guest {} has an active transaction {}".format(guest["id"], guest["_transaction"].name))
+        guest["_transaction"] = SimulatedTransaction(name, self.clock.time() + duration, on_complete)
+        guest["modifyDate"] = self.__date()
+
+    def __complete_transactions(self):
+        now = self.clock.time()
+        for guest in list(self.guests.values()):
+            transaction = guest["_transaction"]
+            if transaction is not None and transaction.until <= now:
+                guest["_transaction"] = None
+                if transaction.on_complete is not None:
+                    transaction.on_complete(guest)
+                guest["modifyDate"] = self.__date()
+
+    def __guest(self, request):
+        guest = self.guests.get(request.identifier)
+        if guest is None:
+            raise SoftLayer.SoftLayerAPIError(
+                "SoftLayer_Exception_ObjectNotFound",
+                "Unable to find object with id of '{}'.".format(request.identifier))
+        return guest
+
+    def __guest_view(self, guest):
+        view = dict((key, value) for key, value in guest.items() if not key.startswith("_"))
+        transaction = guest["_transaction"]
+        if transaction is not None:
+            view["activeTransaction"] = {"id": id(transaction), "transactionStatus": {"name": transaction.name}}
+        return view
+
+    def __image_view(self, image):
+        return dict((key, value) for key, value in image.items() if not key.startswith("_"))
+
+    def __image_by_guid(self, global_identifier):
+        for image in self.images.values():
+            if image["globalIdentifier"] == global_identifier:
+                return image
+        raise SoftLayer.SoftLayerAPIError(
+            "SoftLayer_Exception_ObjectNotFound",
+            "Unable to find image template {}.".format(global_identifier))
+
+    def __ssh_key(self, request):
+        ssh_key = self.ssh_keys.get(request.identifier)
+        if ssh_key is None:
+            raise SoftLayer.SoftLayerAPIError(
+                "SoftLayer_Exception_ObjectNotFound",
+                "Unable to find object with id of '{}'.".format(request.identifier))
+        return ssh_key
+
+#   object filters
+
+    def __filtered(self, objects, request, collection=None):
+        object_filter = request.filter or {}
+        if collection is not None:
+            object_filter = object_filter.get(collection, {})
+        return [obj for obj in objects
+                if all(self.__matches(obj.get(field), operation) for field, operation in object_filter.items())]
+
+    def __matches(self, value, operation):
+        if not isinstance(operation, dict) or "operation" not in operation:
+            return True
+        op = operation["operation"]
+        if op == "in":
+            return value in operation["options"][0]["value"]
+        if not isinstance(op, string_types):
+            return value == op
+        if op.startswith("^= "):
+            return value is not None and value.startswith(op[3:])
+        if op.startswith("$= "):
+            return value is not None and value.endswith(op[3:])
+        if op.startswith("*= "):
+            return value is not None and op[3:] in value
+        if op.startswith("_= "):
+            return value is not None and value.lower() == op[3:].lower()
+        if op in ["greaterThanDate", "lessThanDate", "betweenDate"]:
+            return value is not None and self.__matches_date(value, op, operation["options"])
+        return value == op
+
+    def __matches_date(self, value, op, options):
+#       dates of filters are wall clock times like those of the values
+        dates = dict((option["name"], datetime.datetime.strptime(option["value"][0], "%m/%d/%Y %H:%M:%S"))
+                     for option in options)
+        date = datetime.datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+        if op == "greaterThanDate":
+            return date > dates["date"]
+        if op == "lessThanDate":
+            return date < dates["date"]
+        return dates["startDate"] <= date <= dates["endDate"]
+
+#   SoftLayer_Account
+
+    def _Account_getVirtualGuests(self, request):
+        return self.__filtered(
+            [self.__guest_view(guest) for guest in self.guests.values()], request, "virtualGuests")
+
+    def _Account_getHourlyVirtualGuests(self, request):
+        return [guest for guest in self._Account_getVirtualGuests(request) if guest["hourlyBillingFlag"]]
+
+    def _Account_getMonthlyVirtualGuests(self, request):
+        return [guest for guest in self._Account_getVirtualGuests(request) if not guest["hourlyBillingFlag"]]
+
+    def _Account_getSshKeys(self, request):
+        return self.__filtered(list(self.ssh_keys.values()), request, "sshKeys")
+
+    def _Account_getPrivateBlockDeviceTemplateGroups(self, request):
+        return self.__filtered([self.__image_view(image) for image in self.images.values() if not image["_public"]],
+                               request, "privateBlockDeviceTemplateGroups")
+
+#   SoftLayer_Virtual_Guest
+
+    def _Virtual_Guest_getObject(self, request):
+        return self.__guest_view(self.__guest(request))
+
+    def _Virtual_Guest_createObject(self, request):
+        template = request.args[0]
+        image = None
+        if "blockDeviceTemplateGroup" in template:
+            image = self.__image_by_guid(template["blockDeviceTemplateGroup"]["globalIdentifier"])
+        guest_id = self.add_guest(
+            template["hostname"], template["domain"],
+            datacenter=template.get("datacenter", {}).get("name"),
+            os_code=image["operatingSystemReferenceCode"] if image else template.get("operatingSystemReferenceCode"),
+            image_id=image["id"] if image else None,
+            cpus=template["startCpus"],
+            memory=template["maxMemory"],
+            hourly=template.get("hourlyBillingFlag", True),
+            dedicated=template.get("dedicatedAccountHostOnlyFlag", False),
+            private=template.get("privateNetworkOnlyFlag", False),
+            nic_speed=template.get("networkComponents", [{}])[0].get("maxSpeed", 100),
+            ssh_key_ids=[ssh_key["id"] for ssh_key in template.get("sshKeys", [])],
+            user_data=template.get("userData", [{}])[0].get("value"),
+            provisioned=False)
+        guest = self.guests[guest_id]
+        guest["powerState"] = {"keyName": "HALTED", "name": "Halted"}
+        self.__start_transaction(guest, "PROVISION", self.provision_time, self.__provisioned)
+        return self.__guest_view(guest)
+
+    def __provisioned(self, guest):
+        guest["provisionDate"] = self.__date()
+        guest["powerState"] = {"keyName": "RUNNING", "name": "Running"}
+
+    def _Virtual_Guest_deleteObject(self, request):
+        guest = self.__guest(request)
+        guest["_transaction"] = None
+        self.__start_transaction(guest, "RECLAIM_WAIT", self.cancel_time,
+                                 lambda guest: self.guests.pop(guest["id"], None))
+        return True
+
+    def _Virtual_Guest_powerOn(self, request):
+        self.__start_transaction(self.__guest(request), "POWER_ON", self.power_time,
+                                 lambda guest: guest.update(powerState={"keyName": "RUNNING", "name": "Running"}))
+        return True
+
+    def _Virtual_Guest_powerOffSoft(self, request):
+        self.__start_transaction(self.__guest(request), "POWER_OFF", self.power_time,
+                                 lambda guest: guest.update(powerState={"keyName": "HALTED", "name": "Halted"}))
+        return True
+
+    _Virtual_Guest_powerOff = _Virtual_Guest_powerOffSoft
+
+    def _Virtual_Guest_reloadOperatingSystem(self, request):
+        config = request.args[1] if len(request.args) > 1 else {}
+        guest = self.__guest(request)
+        ssh_keys = [self.__guest_ssh_key(key_id) for key_id in config.get("sshKeyIds", [])]
+        reloaded = {"sshKeys": ssh_keys}
+        if "imageTemplateId" in config:
+            image = self.images[config["imageTemplateId"]]
+            reloaded["blockDeviceTemplateGroup"] = self.__image_view(image)
+            reloaded["operatingSystem"] = {"softwareLicense": {"softwareDescription": {
+                "referenceCode": image["operatingSystemReferenceCode"]}}}
+        self.__start_transaction(guest, "RELOAD", self.reload_time,
+                                 lambda guest: guest.update(reloaded))
+        return True
+
+    def _Virtual_Guest_editObject(self, request):
+        guest = self.__guest(request)
+        template = request.args[0]
+        for field in ["hostname", "domain", "notes"]:
+            if field in template:
+                guest[field] = template[field]
+        guest["fullyQualifiedDomainName"] = "{}.{}".format(guest["hostname"], guest["domain"])
+        guest["modifyDate"] = self.__date()
+        return True
+
+    def _Virtual_Guest_getCreateObjectOptions(self, request):
+        return {
+            "datacenters": [{"template": {"datacenter": {"name": name}}} for name in self.datacenters],
+            "operatingSystems": [{"template": {"operatingSystemReferenceCode": os_code}} for os_code in self.os_codes],
+            "processors": [{"template": dict({"startCpus": capacity},
+                                             **({"dedicatedAccountHostOnlyFlag": True} if units == "PRIVATE_CORE" else {}))}
+                           for category_code, capacity, units, _ in self.upgrade_items if category_code == "guest_core"],
+            "memory": [{"template": {"maxMemory": capacity * 1024}}
+                       for category_code, capacity, _, _ in self.upgrade_items if category_code == "ram"],
+            "networkComponents": [{"template": {"networkComponents": [{"maxSpeed": capacity}]}}
+                                  for category_code, capacity, _, _ in self.upgrade_items if category_code == "port_speed"]
+        }
+
+    def _Virtual_Guest_generateOrderTemplate(self, request):
+        template = request.args[0]
+        options = self._Virtual_Guest_getCreateObjectOptions(request)
+        datacenter = template.get("datacenter", {}).get("name")
+        if datacenter not in self.datacenters:
+            raise SoftLayer.SoftLayerAPIError("SoftLayer_Exception_Public", "Invalid datacenter {}".format(datacenter))
+        os_code = template.get("operatingSystemReferenceCode")
+        if os_code is not None and os_code not in self.os_codes:
+            raise SoftLayer.SoftLayerAPIError("SoftLayer_Exception_Public", "Invalid operating system {}".format(os_code))
+        if template["maxMemory"] not in [option["template"]["maxMemory"] for option in options["memory"]]:
+            raise SoftLayer.SoftLayerAPIError("SoftLayer_Exception_Public", "Invalid memory {}".format(template["maxMemory"]))
+        return {
+            "complexType": "SoftLayer_Container_Product_Order_Virtual_Guest",
+            "location": datacenter,
+            "quantity": 1,
+            "useHourlyPricing": template.get("hourlyBillingFlag", True),
+            "virtualGuests": [{"hostname": template["hostname"], "domain": template["domain"]}],
+            "prices": []
+        }
+
+    def _Virtual_Guest_getUpgradeItemPrices(self, request):
+        self.__guest(request)
+        return [{
+            "id": 5000 + index,
+            "locationGroupId": None,
+            "categories": [{"categoryCode": category_code}],
+            "item": {"capacity": capacity, "units": units, "description": description}
+        } for index, (category_code, capacity, units, description) in enumerate(self.upgrade_items)]
+
+    def _Virtual_Guest_getSshKeys(self, request):
+        return self.__guest(request)["sshKeys"]
+
+    def _Virtual_Guest_getUserData(self, request):
+        return self.__guest(request)["userData"]
+
+    def _Virtual_Guest_getSoftwareComponents(self, request):
+        return self.__guest(request)["softwareComponents"]
+
+#   SoftLayer_Virtual_Guest_Block_Device_Template_Group
+
+    def _Virtual_Guest_Block_Device_Template_Group_getPublicImages(self, request):
+        return self.__filtered([self.__image_view(image) for image in self.images.values() if image["_public"]],
+                               request)
+
+#   SoftLayer_Product_Order
+
+    def _Product_Order_verifyOrder(self, request):
+        return request.args[0]
+
+    def _Product_Order_placeOrder(self, request):
+        order = request.args[0]
+        if order.get("complexType") != "SoftLayer_Container_Product_Order_Virtual_Guest_Upgrade":
+            raise SoftLayer.SoftLayerAPIError(
+                "SoftLayer_Exception_Public", "Order type {} is not simulated".format(order.get("complexType")))
+        changes = {}
+        for price in order["prices"]:
+            category_code, capacity, _, _ = self.upgrade_items[price["id"] - 5000]
+            changes[category_code] = capacity
+        for virtual_guest in order["virtualGuests"]:
+            guest = self.guests.get(virtual_guest["id"])
+            if guest is None:
+                raise SoftLayer.SoftLayerAPIError(
+                    "SoftLayer_Exception_ObjectNotFound",
+                    "Unable to find object with id of '{}'.".format(virtual_guest["id"]))
+            self.__start_transaction(guest, "UPGRADE", self.upgrade_time,
+                                     lambda guest: self.__upgraded(guest, changes))
+        return {"orderId": next(self._ids)}
+
+    def __upgraded(self, guest, changes):
+        if "guest_core" in changes:
+            guest["startCpus"] = guest["maxCpu"] = changes["guest_core"]
+        if "ram" in changes:
+            guest["maxMemory"] = changes["ram"] * 1024
+        if "port_speed" in changes:
+            for network_component in guest["networkComponents"]:
+                network_component["maxSpeed"] = network_component["speed"] = changes["port_speed"]
+
+#   SoftLayer_Security_Ssh_Key
+
+    def _Security_Ssh_Key_createObject(self, request):
+        template = request.args[0]
+        return self.ssh_keys[self.add_ssh_key(template["label"], template["key"], template.get("notes"))]
+
+    def _Security_Ssh_Key_deleteObject(self, request):
+        self.__ssh_key(request)
+        del self.ssh_keys[request.identifier]
+        return True
+
+    def _Security_Ssh_Key_editObject(self, request):
+        ssh_key = self.__ssh_key(request)
+        ssh_key.update(request.args[0])
+        return True
+
+    def _Security_Ssh_Key_getObject(self, request):
+        return self.__ssh_key(request)
+
+#   SoftLayer_Software_Component
+
+    def __software_component(self, request):
+        for guest in self.guests.values():
+            for component in guest["softwareComponents"]:
+                if component["id"] == request.identifier:
+                    return component
+        raise SoftLayer.SoftLayerAPIError(
+            "SoftLayer_Exception_ObjectNotFound",
+            "Unable to find object with id of '{}'.".format(request.identifier))
+
+    def _Software_Component_getSoftwareDescription(self, request):
+        return self.__software_component(request)["softwareDescription"]
+
+    def _Software_Component_getPasswords(self, request):
+        return self.__software_component(request)["passwords"]
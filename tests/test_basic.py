@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+
+from simulated import *
+from module_utils.softlayer.readers import IpAddressReader
+
+
+class MergeMasksTest(unittest.TestCase):
+    def test_properties_are_given_once(self):
+        self.assertEqual(merge_masks("id,hostname", "hostname,domain"), "id,hostname,domain")
+
+    def test_dotted_and_bracketed_properties_are_merged(self):
+        self.assertEqual(
+            merge_masks("networkComponents.maxSpeed", "networkComponents[name,networkVlan[id]]"),
+            "networkComponents[maxSpeed,name,networkVlan[id]]")
+
+    def test_nested_dotted_properties(self):
+        self.assertEqual(
+            merge_masks("a.b.c", "a[b[d],e]"),
+            "a[b[c,d],e]")
+
+    def test_whitespace_and_empty_items_are_ignored(self):
+        self.assertEqual(merge_masks("primaryBackendIpAddress, primaryIpAddress,"),
+                         "primaryBackendIpAddress,primaryIpAddress")
+
+
+class WaiterTest(unittest.TestCase):
+    def test_finished_transaction_is_noticed_within_seconds(self):
+        simulated = simulator()
+        done_at = simulated.clock.time() + 300
+        waiter = Waiter(clock=simulated.clock.time, sleep=simulated.clock.sleep)
+        self.assertTrue(waiter.wait(lambda: simulated.clock.time() >= done_at, 600))
+        self.assertLess(simulated.clock.time() - done_at, 6.0)
+
+    def test_deadline(self):
+        simulated = simulator()
+        waiter = Waiter(clock=simulated.clock.time, sleep=simulated.clock.sleep)
+        self.assertFalse(waiter.wait(lambda: False, 60))
+        self.assertEqual(waiter.stats()["waited"], 60)
+
+
+class SshKeyIndexTest(unittest.TestCase):
+    def test_labels_are_resolved_with_one_listing(self):
+        simulated = simulator(ssh_keys=20)
+        index = SshKeyIndex(simulated.client())
+        labels = ["key{}".format(i) for i in range(20)]
+        key_ids, missing_labels = index.key_ids(labels)
+        self.assertEqual((sorted(key_ids), missing_labels), (sorted(simulated.ssh_keys), []))
+        index.key_ids(labels[:5])
+        self.assertEqual(simulated.calls, [("Account", "getSshKeys")])
+
+    def test_missing_labels_are_reported_together(self):
+        simulated = simulator(ssh_keys=2)
+        index = SshKeyIndex(simulated.client())
+        self.assertEqual(index.key_ids(["key0", "lost0", "key1", "lost1"])[1], ["lost0", "lost1"])
+        self.assertEqual(simulated.call_count(), 1)
+        vs = virtual_server(simulated, instance_config(fqdn="new." + DOMAIN, root_ssh_keys=["key0", "lost0", "lost1"]),
+                            ssh_key_index=index)
+        with self.assertRaises(VSException) as raised:
+            vs.sync_config(ChangeLog())
+        self.assertIn("lost0, lost1", raised.exception.msg())
+        self.assertEqual(simulated.call_count("Virtual_Guest", "createObject"), 0)
+
+    def test_cached_index_is_listed_again_on_a_miss(self):
+        simulated = simulator(ssh_keys=2)
+        cache = JsonFileCache(os.path.join(tempfile.mkdtemp(), "ssh_key_ids.json"), 300)
+        SshKeyIndex(simulated.client(), cache).key_ids(["key0"])
+        new_key_id = simulated.add_ssh_key("key2", SimulatedSoftLayer.ssh_key_text(2))
+        simulated.reset_calls()
+        index = SshKeyIndex(simulated.client(), cache)
+        self.assertEqual(len(index.key_ids(["key0", "key1"])[0]), 2)
+        self.assertEqual(simulated.call_count(), 0)
+        self.assertEqual(index.key_ids(["key2"]), ([new_key_id], []))
+        self.assertEqual(index.key_ids(["lost0"]), ([], ["lost0"]))
+        self.assertEqual(simulated.call_count("Account", "getSshKeys"), 1)
+
+
+class InstancePollerTest(unittest.TestCase):
+    def test_polls_of_a_round_share_a_listing(self):
+        simulated = simulator(guests=10)
+        instance_ids = sorted(simulated.guests.keys())
+        poller = InstancePoller(simulated.client())
+        for instance_id in instance_ids:
+            simulated.client()['Virtual_Guest'].powerOffSoft(id=instance_id)
+            self.assertIsNotNone(poller.get(instance_id))
+#       the first poll of every wait lists the instances anew
+        self.assertEqual(simulated.call_count("Account", "getVirtualGuests"), 10)
+        for i in range(3):
+            for instance_id in instance_ids:
+                poller.get(instance_id)
+        self.assertEqual(simulated.call_count("Account", "getVirtualGuests"), 13)
+        self.assertEqual(simulated.call_count("Virtual_Guest", "getObject"), 0)
+
+    def test_first_poll_of_a_wait_sees_the_action(self):
+        simulated = simulator(guests=2)
+        host0_id, host1_id = sorted(simulated.guests.keys())
+        poller = InstancePoller(simulated.client())
+        simulated.client()['Virtual_Guest'].powerOffSoft(id=host1_id)
+        poller.get(host1_id)
+        self.assertTrue(SoftlayerVirtualServerBasic.ready(poller.get(host0_id)))
+        simulated.client()['Virtual_Guest'].powerOffSoft(id=host0_id)
+        self.assertFalse(SoftlayerVirtualServerBasic.ready(poller.get(host0_id)))
+        simulated.clock.sleep(simulated.power_time)
+        self.assertTrue(SoftlayerVirtualServerBasic.ready(poller.get(host0_id)))
+
+
+class StaleInstanceIdTest(unittest.TestCase):
+    def setUp(self):
+        self.simulated = simulator(guests=2)
+        self.cache = JsonFileCache(os.path.join(tempfile.mkdtemp(), "instance_ids.json"), 300)
+        VSInstanceIdIndex(SoftLayer.VSManager(self.simulated.client()), self.cache).refresh()
+
+    def reader(self):
+        index = VSInstanceIdIndex(SoftLayer.VSManager(self.simulated.client()), self.cache)
+        return IpAddressReader(self.simulated.client(), instance_config(fqdn="host0." + DOMAIN), index)
+
+    def test_cached_id_of_a_cancelled_instance_is_resolved_again(self):
+        del self.simulated.guests[self.reader().get_vs_id()]
+        new_id = self.simulated.add_guest("host0", DOMAIN)
+        self.assertEqual(self.reader().get_vs_object("id")["id"], new_id)
+
+    def test_cached_id_of_a_gone_instance_is_none(self):
+        del self.simulated.guests[self.reader().get_vs_id()]
+        self.assertIsNone(self.reader().get_vs_object("id"))
+
+
+if __name__ == '__main__':
+    unittest.main()
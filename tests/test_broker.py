@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import socket
+import tempfile
+import threading
+import unittest
+
+from simulated import *
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from softlayer_broker import SoftLayerBroker, BrokerServer, remove_stale_socket
+
+
+class BrokerTest(unittest.TestCase):
+    def setUp(self):
+        self.simulated = simulator(guests=3)
+        self.now = [1000.0]
+        self.broker = SoftLayerBroker(clock=lambda: self.now[0])
+#       the warm client of the account talks to the simulator
+        self.broker._clients[("user", "key")] = self.simulated.client()
+        self.socket_path = os.path.join(tempfile.mkdtemp(), "broker.sock")
+        self.server = BrokerServer(self.socket_path, self.broker)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01})
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.broker_transport = BrokerTransport.connect(self.socket_path, "user", "key")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_calls_are_made_by_the_warm_client_of_the_broker(self):
+        self.assertIsNotNone(self.broker_transport)
+        sl_client = SoftLayer.BaseClient(transport=self.broker_transport)
+        guests = sl_client['Account'].getVirtualGuests(mask="id,hostname")
+        self.assertEqual(sorted(guest["hostname"] for guest in guests), ["host0", "host1", "host2"])
+        guest_id = guests[0]["id"]
+        self.assertEqual(sl_client['Virtual_Guest'].getObject(id=guest_id)["id"], guest_id)
+        self.assertEqual(self.simulated.calls, [("Account", "getVirtualGuests"), ("Virtual_Guest", "getObject")])
+        self.assertEqual(self.simulated.requests[0].mask, "id,hostname")
+        self.assertEqual(len(self.broker._clients), 1)
+
+    def test_api_errors_are_raised_by_the_transport(self):
+        sl_client = SoftLayer.BaseClient(transport=self.broker_transport)
+        with self.assertRaises(SoftLayer.SoftLayerAPIError) as raised:
+            sl_client['Virtual_Guest'].getUnknown(id=1)
+        self.assertEqual(raised.exception.faultCode, "SoftLayer_Exception_Public")
+
+    def test_caches_of_the_account_are_held_by_the_broker(self):
+        sl_client = SoftLayer.BaseClient(transport=self.broker_transport)
+        cache = JsonFileCache.for_account("instance_ids", sl_client, SLClientConfig({}), 300)
+        self.assertIsInstance(cache, BrokerCache)
+        self.assertIsNone(cache.load())
+        cache.store({"host0." + DOMAIN: 1000})
+        self.assertEqual(cache.load(), {"host0." + DOMAIN: 1000})
+        self.now[0] += 301
+        self.assertIsNone(cache.load())
+        cache.store({"host0." + DOMAIN: 1000})
+        cache.invalidate()
+        self.assertIsNone(cache.load())
+
+    def test_stale_socket_is_removed_only_when_no_broker_listens(self):
+        self.assertFalse(remove_stale_socket(self.socket_path))
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertTrue(remove_stale_socket(self.socket_path))
+        self.assertFalse(os.path.exists(self.socket_path))
+
+
+class BrokerTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.socket_path = os.path.join(tempfile.mkdtemp(), "broker.sock")
+
+    def test_no_transport_without_a_broker(self):
+        self.assertIsNone(BrokerTransport.connect(self.socket_path, "user", "key"))
+
+    def test_calls_are_made_directly_once_the_broker_is_gone(self):
+        simulated = simulator(guests=1)
+        broker_transport = BrokerTransport(self.socket_path, "user", "key")
+        broker_transport._direct_client = simulated.client()
+        guests = SoftLayer.BaseClient(transport=broker_transport)['Account'].getVirtualGuests()
+        self.assertEqual([guest["hostname"] for guest in guests], ["host0"])
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests")])
+
+    def test_cache_without_a_broker_is_a_miss(self):
+        cache = BrokerCache(BrokerTransport(self.socket_path, "user", "key"), "instance_ids", 300)
+        cache.store({"host0." + DOMAIN: 1000})
+        self.assertIsNone(cache.load())
+
+
+if __name__ == '__main__':
+    unittest.main()
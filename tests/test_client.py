@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import tempfile
+import unittest
+
+from simulated import *
+
+
+class JsonFileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "cache", "index.json")
+
+    def test_stored_document_is_loaded(self):
+        JsonFileCache(self.path, 300).store({"host0.example.com": 1000})
+        self.assertEqual(JsonFileCache(self.path, 300).load(), {"host0.example.com": 1000})
+
+    def test_document_expires_after_ttl(self):
+        cache = JsonFileCache(self.path, 300)
+        cache.store({"host0.example.com": 1000})
+        written_at = time.time() - 301
+        os.utime(self.path, (written_at, written_at))
+        self.assertIsNone(cache.load())
+
+    def test_ttl_0_disables_the_cache(self):
+        cache = JsonFileCache(self.path, 0)
+        cache.store({"host0.example.com": 1000})
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(cache.load())
+
+    def test_unreadable_document_is_a_miss(self):
+        cache = JsonFileCache(self.path, 300)
+        cache.store({})
+        with open(self.path, "w") as cache_file:
+            cache_file.write("{not json")
+        self.assertIsNone(cache.load())
+
+    def test_invalidated_document_is_a_miss(self):
+        cache = JsonFileCache(self.path, 300)
+        cache.store({"host0.example.com": 1000})
+        cache.invalidate()
+        self.assertIsNone(cache.load())
+        cache.invalidate()
+
+
+class VSInstanceIdIndexTest(unittest.TestCase):
+    def test_ids_are_resolved_from_one_shared_listing(self):
+        simulated = simulator(guests=20)
+        cache = JsonFileCache(os.path.join(tempfile.mkdtemp(), "instance_ids.json"), 300)
+        index = VSInstanceIdIndex(SoftLayer.VSManager(simulated.client()), cache)
+        guests = guests_by_fqdn(simulated)
+        for fqdn, guest in guests.items():
+            self.assertEqual(index.get(fqdn), guest["id"])
+        self.assertIsNone(index.get("missing." + DOMAIN))
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests")])
+#       the next module run of the play reads the index from the cache
+        other_index = VSInstanceIdIndex(SoftLayer.VSManager(simulated.client()), cache)
+        self.assertEqual(other_index.get("host0." + DOMAIN), guests["host0." + DOMAIN]["id"])
+        self.assertEqual(simulated.call_count(), 1)
+
+
+class InstrumentedTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.simulated = simulator(guests=3)
+        self.sl_client = self.simulated.client()
+        self.trace_file = os.path.join(tempfile.mkdtemp(), "trace.ndjson")
+        self.instrumented = InstrumentedTransport.install(
+            self.sl_client, SLClientConfig({"api_trace_file": self.trace_file}))
+
+    def test_calls_are_recorded_and_summed_up(self):
+        self.sl_client['Account'].getVirtualGuests(mask="id,hostname")
+        guest_id = guests_by_fqdn(self.simulated)["host0." + DOMAIN]["id"]
+        self.sl_client['Virtual_Guest'].getObject(id=guest_id)
+        self.assertRaises(SoftLayer.SoftLayerAPIError, self.sl_client['Virtual_Guest'].getUnknown, id=guest_id)
+        self.assertEqual([(call["service"], call["method"]) for call in self.instrumented.calls],
+                         [("SoftLayer_Account", "getVirtualGuests"), ("SoftLayer_Virtual_Guest", "getObject"),
+                          ("SoftLayer_Virtual_Guest", "getUnknown")])
+        self.assertEqual(self.instrumented.calls[0]["mask"], "id,hostname")
+        self.assertEqual(self.instrumented.calls[1]["id"], guest_id)
+        self.assertEqual(self.instrumented.calls[2]["payload_bytes"], 0)
+        stats = self.instrumented.stats()
+        self.assertEqual(stats["calls"], 3)
+        self.assertEqual(stats["errors"], 1)
+        self.assertGreater(stats["payload_bytes"], 0)
+        self.assertEqual(stats["by_method"]["SoftLayer_Account::getVirtualGuests"]["calls"], 1)
+        self.assertEqual(stats["payload_bytes"],
+                         sum(method_stats["payload_bytes"] for method_stats in stats["by_method"].values()))
+
+    def test_calls_are_appended_to_the_trace_file(self):
+        self.sl_client['Account'].getVirtualGuests()
+        self.sl_client['Account'].getSshKeys()
+        with open(self.trace_file) as trace_file:
+            calls = [json.loads(line) for line in trace_file]
+        self.assertEqual([call["method"] for call in calls], ["getVirtualGuests", "getSshKeys"])
+        self.assertEqual(calls[0]["error"], None)
+        self.assertEqual(calls[0]["retries"], 0)
+
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.path = os.path.join(tempfile.mkdtemp(), "ratelimit", "account.json")
+
+#   rates of powers of two keep the simulated times exact
+    def token_bucket(self, rate=4, burst=5):
+        return TokenBucket(self.path, rate, burst, clock=self.clock.time, sleep=self.clock.sleep)
+
+    def test_burst_is_taken_without_waiting(self):
+        token_bucket = self.token_bucket()
+        self.assertEqual([token_bucket.take() for i in range(5)], [0.0] * 5)
+        self.assertEqual(token_bucket.take(), 0.25)
+        self.assertEqual(self.clock.now, 1000.25)
+
+    def test_tokens_are_added_at_the_rate(self):
+        token_bucket = self.token_bucket()
+        for i in range(5):
+            token_bucket.take()
+        self.clock.now += 0.75
+        self.assertEqual([token_bucket.take() for i in range(3)], [0.0] * 3)
+        self.assertEqual(token_bucket.take(), 0.25)
+#       the bucket never holds more than burst tokens
+        self.clock.now += 60
+        self.assertEqual([token_bucket.take() for i in range(5)], [0.0] * 5)
+        self.assertGreater(token_bucket.take(), 0)
+
+    def test_budget_is_shared_through_the_file(self):
+        for i in range(5):
+            self.token_bucket().take()
+        self.assertGreater(self.token_bucket().take(), 0)
+
+    def test_calls_take_a_token(self):
+        simulated = simulator(guests=1)
+        sl_client = simulated.client()
+        sl_client.transport = RateLimitedTransport(sl_client.transport, self.token_bucket(rate=1, burst=1))
+        for i in range(3):
+            sl_client['Account'].getVirtualGuests()
+        self.assertEqual(simulated.call_count(), 3)
+        self.assertEqual(self.clock.slept, [1.0, 1.0])
+        self.assertEqual(simulated.requests[-1].throttle_wait, 1.0)
+
+
+class RetryingTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.simulated = simulator(guests=1)
+        self.clock = FakeClock()
+        self.sl_client = self.simulated.client()
+        self.sl_client.transport = RetryingTransport(self.sl_client.transport, retries=3, sleep=self.clock.sleep)
+
+    def fail(self, method, fault_code, times):
+        """Makes the first calls of the simulated method fail with fault_code"""
+        handler = getattr(self.simulated, method)
+        failures = [times]
+        def failing(request):
+            if failures[0] > 0:
+                failures[0] -= 1
+                raise SoftLayer.SoftLayerAPIError(fault_code, "failed")
+            return handler(request)
+        setattr(self.simulated, method, failing)
+
+    def test_transient_errors_of_reads_are_retried(self):
+        for fault_code in [429, 503, 0]:
+            self.simulated.reset_calls()
+            self.fail("_Account_getVirtualGuests", fault_code, 2)
+            self.assertEqual(len(self.sl_client['Account'].getVirtualGuests()), 1)
+            self.assertEqual(self.simulated.call_count(), 3)
+            self.assertEqual(self.simulated.requests[-1].retries, 2)
+
+    def test_backoff_is_exponential(self):
+        self.fail("_Account_getVirtualGuests", 503, 3)
+        self.sl_client['Account'].getVirtualGuests()
+        self.assertEqual(len(self.clock.slept), 3)
+        for interval, slept in zip([1.0, 2.0, 4.0], self.clock.slept):
+            self.assertTrue(interval / 2 <= slept <= interval)
+
+    def test_retries_are_bounded(self):
+        self.fail("_Account_getVirtualGuests", 503, 10)
+        self.assertRaises(SoftLayer.SoftLayerAPIError, self.sl_client['Account'].getVirtualGuests)
+        self.assertEqual(self.simulated.call_count(), 4)
+
+    def test_only_throttled_writes_are_retried(self):
+        guest_id = list(self.simulated.guests)[0]
+        self.fail("_Virtual_Guest_powerOffSoft", 503, 1)
+        self.assertRaises(SoftLayer.SoftLayerAPIError, self.sl_client['Virtual_Guest'].powerOffSoft, id=guest_id)
+        self.assertEqual(self.simulated.call_count(), 1)
+        self.fail("_Virtual_Guest_powerOffSoft", 429, 1)
+        self.assertTrue(self.sl_client['Virtual_Guest'].powerOffSoft(id=guest_id))
+        self.assertEqual(self.simulated.call_count(), 3)
+
+    def test_api_faults_are_not_retried(self):
+        self.assertRaises(SoftLayer.SoftLayerAPIError, self.sl_client['Virtual_Guest'].getObject, id=1)
+        self.assertEqual(self.simulated.call_count(), 1)
+        self.assertEqual(self.clock.slept, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+import unittest
+
+from simulated import *
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "inventory"))
+
+from softlayer_inventory import SoftLayerInventory
+
+
+class IncrementalSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.simulated = simulator(guests=5)
+        self.cache = JsonFileCache(os.path.join(tempfile.mkdtemp(), "inventory.json"), 300)
+#       the guests modified within a margin of the latest modifyDate are
+#       fetched again by every sync, so all but host4 are left out of it
+        self.simulated.clock.sleep(600)
+        self.simulated.client()['Virtual_Guest'].editObject(
+            {"notes": "latest"}, id=guests_by_fqdn(self.simulated)["host4." + DOMAIN]["id"])
+        self.inventory().hosts()
+        self.simulated.clock.sleep(600)
+        self.simulated.reset_calls()
+
+    def inventory(self):
+        return SoftLayerInventory(self.simulated.client(), self.cache, 3600)
+
+    def hosts_by_fqdn(self, hosts):
+        return dict((host["softlayer_fqdn"], host) for host in hosts.values())
+
+    def test_only_modified_guests_are_fetched(self):
+        guests = guests_by_fqdn(self.simulated)
+        self.simulated.client()['Virtual_Guest'].editObject({"hostname": "renamed"}, id=guests["host0." + DOMAIN]["id"])
+#       a change which does not touch modifyDate is not seen until a full sync
+        guests["host1." + DOMAIN]["maxCpu"] = 8
+        self.simulated.reset_calls()
+        hosts = self.hosts_by_fqdn(self.inventory().hosts())
+        self.assertIn("renamed." + DOMAIN, hosts)
+        self.assertNotIn("host0." + DOMAIN, hosts)
+        self.assertEqual(hosts["host1." + DOMAIN]["softlayer_cpus"], 1)
+        self.assertEqual(self.simulated.calls, [("Account", "getVirtualGuests")] * 2)
+        hosts = self.hosts_by_fqdn(self.inventory().hosts(full_sync=True))
+        self.assertEqual(hosts["host1." + DOMAIN]["softlayer_cpus"], 8)
+
+    def test_canceled_guests_are_dropped(self):
+        del self.simulated.guests[guests_by_fqdn(self.simulated)["host2." + DOMAIN]["id"]]
+        hosts = self.hosts_by_fqdn(self.inventory().hosts())
+        self.assertEqual(len(hosts), 4)
+        self.assertNotIn("host2." + DOMAIN, hosts)
+
+    def test_unmodified_guests_missing_from_the_cache_are_fetched(self):
+        state = self.cache.load()
+        del state["hosts"][str(guests_by_fqdn(self.simulated)["host3." + DOMAIN]["id"])]
+        self.cache.store(state)
+        hosts = self.hosts_by_fqdn(self.inventory().hosts())
+        self.assertIn("host3." + DOMAIN, hosts)
+        self.assertEqual(len(hosts), 5)
+        self.assertEqual(self.simulated.calls, [("Account", "getVirtualGuests")] * 3)
+
+    def test_guests_are_fetched_when_no_modify_date_is_known(self):
+        self.simulated.guests.clear()
+        self.inventory().hosts(full_sync=True)
+        self.assertIsNone(self.cache.load()["last_modify_date"])
+        self.simulated.add_guest("new", DOMAIN)
+        hosts = self.hosts_by_fqdn(self.inventory().hosts())
+        self.assertEqual(list(hosts.keys()), ["new." + DOMAIN])
+
+
+if __name__ == '__main__':
+    unittest.main()
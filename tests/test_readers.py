@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from simulated import *
+from module_utils.softlayer.readers import IpAddressReader, CredentialsReader
+
+
+class IpAddressReaderTest(unittest.TestCase):
+    def reader(self, simulated, fqdn=None):
+        return IpAddressReader(simulated.client(), instance_config(fqdn=fqdn), instance_id_index(simulated))
+
+    def test_addresses_of_many_instances_are_read_with_one_listing(self):
+        simulated = simulator(guests=20)
+        simulated.add_guest("host0", "other.com")
+        fqdns = ["host{}.{}".format(i, DOMAIN) for i in range(10)]
+        ip_addresses = self.reader(simulated).read_ip_addresses(fqdns=fqdns)
+        self.assertEqual(sorted(ip_addresses.keys()), sorted(fqdns))
+        guest = guests_by_fqdn(simulated)["host3." + DOMAIN]
+        self.assertEqual(ip_addresses["host3." + DOMAIN]["primaryBackendIpAddress"], guest["primaryBackendIpAddress"])
+        self.assertEqual(ip_addresses["host3." + DOMAIN]["networkComponents"][0]["vlan"]["vlanNumber"], 900)
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests")])
+
+    def test_hostname_pattern_is_matched_within_the_domain(self):
+        simulated = simulator()
+        for hostname, domain in [("web-1", DOMAIN), ("web-2", DOMAIN), ("db-1", DOMAIN), ("web-3", "other.com")]:
+            simulated.add_guest(hostname, domain)
+        ip_addresses = self.reader(simulated).read_ip_addresses(domain=DOMAIN, hostname="web-?")
+        self.assertEqual(sorted(ip_addresses.keys()), ["web-1." + DOMAIN, "web-2." + DOMAIN])
+        self.assertEqual(simulated.call_count(), 1)
+        self.assertEqual(simulated.requests[0].filter["virtualGuests"]["hostname"], {"operation": "^= web-"})
+
+    def test_pattern_is_narrowed_to_its_literal_prefix(self):
+        self.assertEqual(IpAddressReader.pattern_filter("web-1"), {"operation": "web-1"})
+        self.assertEqual(IpAddressReader.pattern_filter("web-[12]"), {"operation": "^= web-"})
+        self.assertEqual(IpAddressReader.pattern_filter("*-web"), {})
+
+    def test_address_of_a_single_instance(self):
+        simulated = simulator(guests=2)
+        guest = guests_by_fqdn(simulated)["host1." + DOMAIN]
+        sl_instance = self.reader(simulated, "host1." + DOMAIN).read_ip_address()
+        self.assertEqual(sl_instance["primaryBackendIpAddress"], guest["primaryBackendIpAddress"])
+        self.assertRaises(Exception, self.reader(simulated, "lost." + DOMAIN).read_ip_address)
+
+
+class CredentialsReaderTest(unittest.TestCase):
+    def reader(self, simulated, fqdn=None):
+        return CredentialsReader(simulated.client(), instance_config(fqdn=fqdn), instance_id_index(simulated))
+
+    def test_credentials_are_read_with_one_masked_call(self):
+        simulated = simulator(guests=3)
+        guest = guests_by_fqdn(simulated)["host1." + DOMAIN]
+        credentials = self.reader(simulated, "host1." + DOMAIN).read_credentials()
+        self.assertEqual(credentials["username"], "root")
+        self.assertEqual(credentials["password"], "secret{}".format(guest["id"]))
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests"), ("Virtual_Guest", "getObject")])
+        self.assertIn("passwords", simulated.requests[-1].mask)
+
+    def test_credentials_of_many_instances_are_read_with_one_listing(self):
+        simulated = simulator(guests=20)
+        fqdns = ["host{}.{}".format(i, DOMAIN) for i in range(0, 20, 2)]
+        credentials = self.reader(simulated).read_credentials_of(fqdns)
+        guests = guests_by_fqdn(simulated)
+        self.assertEqual(sorted(credentials.keys()), sorted(fqdns))
+        self.assertTrue(all(credentials[fqdn]["password"] == "secret{}".format(guests[fqdn]["id"]) for fqdn in fqdns))
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests")])
+
+    def test_missing_instances_are_reported_together(self):
+        simulated = simulator(guests=2)
+        with self.assertRaises(Exception) as raised:
+            self.reader(simulated).read_credentials_of(["host0." + DOMAIN, "lost0." + DOMAIN, "lost1." + DOMAIN])
+        self.assertIn("lost0.{0}, lost1.{0}".format(DOMAIN), str(raised.exception))
+
+    def test_instance_without_os_component_fails(self):
+        self.assertRaises(Exception, CredentialsReader.os_credentials,
+                          {"softwareComponents": [{"softwareDescription": {"operatingSystem": 0}}]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from simulated import *
+from softlayer_ssh_keys import SshKeys, SshKeysConfig
+
+def key(i, label=None):
+    return {"label": label or "key{}".format(i), "key": SimulatedSoftLayer.ssh_key_text(i)}
+
+
+class SshKeysConfigDiffTest(unittest.TestCase):
+    def test_keys_in_sync(self):
+        config = SshKeysConfig({"ssh_keys": [key(0), key(1)]})
+        self.assertEqual(config.diff([key(0), key(1)]), ([], [], []))
+
+    def test_relabeled_key_is_renamed(self):
+        config = SshKeysConfig({"ssh_keys": [key(0, "renamed"), key(1)]})
+        to_delete, to_rename, to_add = config.diff([key(0), key(1)])
+        self.assertEqual((to_delete, list(to_add)), ([], []))
+        self.assertEqual(to_rename, [(key(0), "renamed")])
+
+    def test_new_and_removed_keys(self):
+        config = SshKeysConfig({"ssh_keys": [key(1), key(2)]})
+        to_delete, to_rename, to_add = config.diff([key(0), key(1)])
+        self.assertEqual(to_delete, [key(0)])
+        self.assertEqual(to_rename, [])
+        self.assertEqual(list(to_add), [key(2)])
+
+    def test_key_comment_does_not_matter(self):
+        config = SshKeysConfig({"ssh_keys": [{"label": "key0", "key": key(0)["key"] + " other comment"}]})
+        self.assertEqual(config.diff([key(0)]), ([], [], []))
+
+    def test_labels_must_be_unique(self):
+        self.assertRaises(ValueError, SshKeysConfig, {"ssh_keys": [key(0), key(1, "key0")]})
+
+
+class SshKeysSyncTest(unittest.TestCase):
+    def test_sync_against_account(self):
+        simulated = simulator(ssh_keys=3)
+        ssh_keys = [key(0, "renamed"), key(1), key(5)]
+        result = SshKeys(simulated.client(), SshKeysConfig({"ssh_keys": ssh_keys})).sync_config()
+        self.assertEqual((result["added"], result["deleted"], result["renamed"]), (1, 1, 1))
+        self.assertEqual(sorted(ssh_key["label"] for ssh_key in simulated.ssh_keys.values()),
+                         ["key1", "key5", "renamed"])
+        result = SshKeys(simulated.client(), SshKeysConfig({"ssh_keys": ssh_keys})).sync_config()
+        self.assertFalse(result["changed"])
+
+
+if __name__ == '__main__':
+    unittest.main()
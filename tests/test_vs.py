@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from simulated import *
+from softlayer_vs import RollingUpdate, RolloutAborted, SoftlayerVirtualServerFleet, OrderVerifier, \
+    SparePool, ProductCatalog, InstanceFacts
+
+
+class RollingUpdateTest(unittest.TestCase):
+    def take_down(self, rollout, datacenters):
+        in_flight_by_datacenter = {}
+        max_in_flight_by_datacenter = {}
+        lock = threading.Lock()
+        def take_down_instance(datacenter):
+            with rollout.slot(datacenter):
+                with lock:
+                    in_flight_by_datacenter[datacenter] = in_flight_by_datacenter.get(datacenter, 0) + 1
+                    max_in_flight_by_datacenter[datacenter] = max(
+                        max_in_flight_by_datacenter.get(datacenter, 0), in_flight_by_datacenter[datacenter])
+                time.sleep(0.01)
+                with lock:
+                    in_flight_by_datacenter[datacenter] -= 1
+        run_concurrently(take_down_instance, datacenters, len(datacenters))
+        return max_in_flight_by_datacenter
+
+    def test_batch_size(self):
+        rollout = RollingUpdate(batch_size=2)
+        self.take_down(rollout, ["ams01"] * 10)
+        self.assertEqual(rollout.max_in_flight, 2)
+
+    def test_max_in_flight_per_datacenter(self):
+        rollout = RollingUpdate(max_in_flight_per_datacenter=1)
+        max_in_flight_by_datacenter = self.take_down(rollout, ["ams01", "dal05"] * 5)
+        self.assertEqual(max_in_flight_by_datacenter, {"ams01": 1, "dal05": 1})
+
+    def test_rollout_stops_after_max_failures(self):
+        rollout = RollingUpdate(max_failures=1)
+        rollout.record_failure()
+        with rollout.slot("ams01"):
+            pass
+        rollout.record_failure()
+        self.assertRaises(RolloutAborted, self.take_down, rollout, ["ams01"])
+        self.assertTrue(rollout.stats()["aborted"])
+
+    def test_limits_require_wait(self):
+        self.assertRaises(ValueError, RollingUpdate.from_params, {"wait": 0, "batch_size": 2})
+        self.assertEqual(RollingUpdate.from_params({"wait": 600, "batch_size": 2}).batch_size, 2)
+
+
+class CheckModeTest(unittest.TestCase):
+    def test_plan_is_made_from_a_single_read(self):
+        simulated = simulator(guests=2, ssh_keys=2)
+        change_log = ChangeLog()
+        result = virtual_server(
+            simulated, instance_config(fqdn="host0." + DOMAIN, datacenter="dal05", CPUs="2", root_ssh_keys=["key0"]),
+            check_mode=True).sync_config(change_log)
+        self.assertEqual((result["changed"], result["action_performed"]), (True, "recreated"))
+        self.assertEqual(change_log.plan(), {"recreated": ["datacenter"], "upgraded": ["CPUs"],
+                                             "os_reloaded": ["root_ssh_keys"]})
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests"), ("Virtual_Guest", "getObject")])
+        self.assertEqual(guests_by_fqdn(simulated)["host0." + DOMAIN]["datacenter"]["name"], "ams01")
+
+    def test_instance_in_sync(self):
+        simulated = simulator(guests=2, ssh_keys=2)
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN), check_mode=True) \
+            .sync_config(ChangeLog())
+        self.assertEqual((result["changed"], result["action_performed"]), (False, "nothing"))
+
+
+    def test_absent_instance_is_not_changed(self):
+        for check_mode in [True, False]:
+            simulated = simulator(guests=2, ssh_keys=2)
+            result = virtual_server(simulated, instance_config(fqdn="gone." + DOMAIN, state="absent"),
+                                    check_mode=check_mode).sync_config(ChangeLog())
+            self.assertEqual((result["changed"], result["action_performed"]), (False, "nothing"))
+
+
+class WaitBeforeReadTest(unittest.TestCase):
+    def test_idle_instance_in_sync_is_not_waited_for(self):
+        simulated = simulator(guests=2, ssh_keys=2)
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN)).sync_config(ChangeLog())
+        self.assertEqual((result["changed"], result["action_performed"]), (False, "nothing"))
+        self.assertEqual(result["wait_stats"]["polls"], 0)
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests"), ("Virtual_Guest", "getObject")])
+
+    def test_instance_is_read_again_once_its_transaction_is_finished(self):
+        simulated = simulator(guests=2, ssh_keys=2)
+        simulated.client()['Virtual_Guest'].powerOn(id=guests_by_fqdn(simulated)["host0." + DOMAIN]["id"])
+        simulated.reset_calls()
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN)).sync_config(ChangeLog())
+        self.assertEqual((result["changed"], result["action_performed"]), (False, "nothing"))
+        self.assertGreater(result["wait_stats"]["polls"], 0)
+#       the config is read again once the transaction is finished
+        self.assertEqual(simulated.calls[-1], ("Virtual_Guest", "getObject"))
+        self.assertIn("maxCpu", simulated.requests[-1].mask)
+        self.assertIsNone(guests_by_fqdn(simulated)["host0." + DOMAIN]["_transaction"])
+
+
+class UpgradeTest(unittest.TestCase):
+    def placed_order(self, simulated):
+        return simulated.requests[simulated.calls.index(("Product_Order", "placeOrder"))].args[0]
+
+    def test_sizes_are_upgraded_with_a_single_order(self):
+        simulated = simulator(guests=2, ssh_keys=2)
+        change_log = ChangeLog()
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, CPUs="4", RAM="8GB",
+                                                           nic_speed="1Gb")).sync_config(change_log)
+        self.assertEqual((result["changed"], result["action_performed"]), (True, "upgraded"))
+        self.assertEqual(change_log.plan(), {"upgraded": ["CPUs", "RAM", "nic_speed"]})
+        self.assertEqual(simulated.call_count("Product_Order", "placeOrder"), 1)
+        self.assertEqual(len(self.placed_order(simulated)["prices"]), 3)
+#       the upgrade is waited for until the instance has its new sizes
+        guest = guests_by_fqdn(simulated)["host0." + DOMAIN]
+        self.assertEqual((guest["maxCpu"], guest["maxMemory"]), (4, 8192))
+        self.assertEqual([network_component["maxSpeed"] for network_component in guest["networkComponents"]], [1000])
+        self.assertGreater(result["wait_stats"]["polls"], 0)
+
+    def test_only_changed_sizes_are_ordered(self):
+        simulated = simulator(guests=1, ssh_keys=2)
+        virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, RAM="2GB")).sync_config(ChangeLog())
+        self.assertEqual([price["id"] for price in self.placed_order(simulated)["prices"]],
+                         [5000 + simulated.upgrade_items.index(item) for item in simulated.upgrade_items
+                          if item[0] == "ram" and item[1] == 2])
+        guest = guests_by_fqdn(simulated)["host0." + DOMAIN]
+        self.assertEqual((guest["maxCpu"], guest["maxMemory"]), (1, 2048))
+
+    def test_unknown_size_fails_without_an_order(self):
+        simulated = simulator(guests=1, ssh_keys=2)
+        vs = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, CPUs="3"))
+        self.assertRaises(VSException, vs.sync_config, ChangeLog())
+        self.assertEqual(simulated.call_count("Product_Order", "placeOrder"), 0)
+
+
+class ImageTest(unittest.TestCase):
+    def test_instance_is_created_from_an_image_name(self):
+        simulated = simulator(ssh_keys=2)
+        image_id = simulated.add_image("debian-web", os_code="DEBIAN_8_64")
+        config = instance_config(fqdn="new." + DOMAIN, os_code=None, image_name="debian-web")
+        result = virtual_server(simulated, config).sync_config(ChangeLog())
+        self.assertEqual((result["changed"], result["action_performed"]), (True, "created"))
+        template = simulated.requests[simulated.calls.index(("Virtual_Guest", "createObject"))].args[0]
+        self.assertEqual(template["blockDeviceTemplateGroup"],
+                         {"globalIdentifier": simulated.images[image_id]["globalIdentifier"]})
+        self.assertNotIn("operatingSystemReferenceCode", template)
+        self.assertEqual(guests_by_fqdn(simulated)["new." + DOMAIN]["blockDeviceTemplateGroup"]["id"], image_id)
+
+    def test_instance_built_from_its_image_is_in_sync(self):
+        simulated = simulator(ssh_keys=2)
+        image_id = simulated.add_image("debian-web")
+        simulated.add_guest("host0", DOMAIN, ssh_key_ids=sorted(simulated.ssh_keys), image_id=image_id)
+        for config in [dict(image_name="debian-web"), dict(image_id=simulated.images[image_id]["globalIdentifier"])]:
+            result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, os_code=None, **config)) \
+                .sync_config(ChangeLog())
+            self.assertEqual((result["changed"], result["action_performed"]), (False, "nothing"))
+
+    def test_os_is_reloaded_from_the_configured_image(self):
+        simulated = simulator(ssh_keys=2)
+        old_image_id = simulated.add_image("debian-web-1")
+        image_id = simulated.add_image("debian-web-2")
+        simulated.add_guest("host0", DOMAIN, ssh_key_ids=sorted(simulated.ssh_keys), image_id=old_image_id)
+        change_log = ChangeLog()
+        config = instance_config(fqdn="host0." + DOMAIN, os_code=None, image_name="debian-web-2")
+        result = virtual_server(simulated, config).sync_config(change_log)
+        self.assertEqual((result["changed"], result["action_performed"]), (True, "os_reloaded"))
+        self.assertEqual(change_log.plan(), {"os_reloaded": ["image_id"]})
+        reload_config = simulated.requests[simulated.calls.index(("Virtual_Guest", "reloadOperatingSystem"))].args[1]
+        self.assertEqual(reload_config["imageTemplateId"], image_id)
+        self.assertEqual(guests_by_fqdn(simulated)["host0." + DOMAIN]["blockDeviceTemplateGroup"]["id"], image_id)
+
+    def test_unknown_image_fails(self):
+        simulated = simulator(ssh_keys=2)
+        vs = virtual_server(simulated, instance_config(fqdn="new." + DOMAIN, os_code=None, image_name="missing"))
+        self.assertRaises(VSException, vs.sync_config, ChangeLog())
+        self.assertEqual(simulated.call_count("Virtual_Guest", "createObject"), 0)
+
+
+class ImageIndexTest(unittest.TestCase):
+    def test_private_images_are_listed_once(self):
+        simulated = simulator()
+        image_ids = [simulated.add_image("image{}".format(i)) for i in range(5)]
+        index = ImageIndex(simulated.client())
+        for image_id in image_ids:
+            image = simulated.images[image_id]
+            self.assertEqual(index.image(image["name"])["id"], image_id)
+            self.assertEqual(index.image(image["globalIdentifier"])["id"], image_id)
+        self.assertEqual(simulated.calls, [("Account", "getPrivateBlockDeviceTemplateGroups")])
+
+    def test_public_images_are_looked_up_by_name(self):
+        simulated = simulator()
+        image_id = simulated.add_image("Debian 8 public", public=True)
+        index = ImageIndex(simulated.client())
+        self.assertEqual(index.image("Debian 8 public")["id"], image_id)
+        self.assertIsNone(index.image("missing"))
+        self.assertEqual(simulated.call_count("Account", "getPrivateBlockDeviceTemplateGroups"), 1)
+
+
+class FactsTest(unittest.TestCase):
+    def test_facts_of_an_instance_in_sync_come_from_its_read(self):
+        simulated = simulator(guests=2, ssh_keys=2)
+        guest = guests_by_fqdn(simulated)["host0." + DOMAIN]
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN), facts=InstanceFacts()) \
+            .sync_config(ChangeLog())
+        self.assertEqual(result["action_performed"], "nothing")
+        facts = result["facts"]
+        self.assertEqual((facts["id"], facts["fqdn"], facts["datacenter"]), (guest["id"], "host0." + DOMAIN, "ams01"))
+        self.assertEqual((facts["CPUs"], facts["RAM"], facts["nic_speed"]), (1, "1GB", "100Mb"))
+        self.assertEqual((facts["power_state"], facts["ready"]), ("RUNNING", True))
+        self.assertEqual(facts["ip_addresses"]["primaryBackendIpAddress"], guest["primaryBackendIpAddress"])
+        self.assertNotIn("credentials", facts)
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests"), ("Virtual_Guest", "getObject")])
+
+    def test_facts_are_read_once_after_an_action(self):
+        simulated = simulator(guests=1, ssh_keys=2)
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, CPUs="2"),
+                                facts=InstanceFacts()).sync_config(ChangeLog())
+        self.assertEqual(result["action_performed"], "upgraded")
+        self.assertEqual(result["facts"]["CPUs"], 2)
+        self.assertEqual(simulated.calls[-1], ("Virtual_Guest", "getObject"))
+        self.assertEqual(simulated.requests[-1].mask, InstanceFacts().mask())
+
+    def test_credentials_are_returned_on_request(self):
+        simulated = simulator(guests=1, ssh_keys=2)
+        guest = guests_by_fqdn(simulated)["host0." + DOMAIN]
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN),
+                                facts=InstanceFacts(with_credentials=True)).sync_config(ChangeLog())
+        credentials = result["facts"]["credentials"]
+        self.assertEqual((credentials["username"], credentials["password"]), ("root", "secret{}".format(guest["id"])))
+        self.assertEqual(simulated.call_count(), 2)
+
+    def test_canceled_instance_has_no_facts(self):
+        simulated = simulator(guests=1, ssh_keys=2)
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, state="absent"),
+                                facts=InstanceFacts()).sync_config(ChangeLog())
+        self.assertEqual(result["action_performed"], "canceled")
+        self.assertNotIn("facts", result)
+
+    def test_facts_are_only_returned_on_request(self):
+        self.assertIsNone(InstanceFacts.from_params({"return_facts": False, "return_credentials": True}))
+        self.assertIsNotNone(InstanceFacts.from_params({"return_facts": True}))
+
+
+class NICSpeedTest(unittest.TestCase):
+    def test_speeds_are_normalized(self):
+        self.assertEqual(instance_config(nic_speed="1000Mb").nic_speed, "1Gb")
+        self.assertEqual(instance_config(nic_speed="100Mb").nic_speed, "100Mb")
+        self.assertEqual(instance_config(nic_speed="fast").nic_speed, "fast")
+
+    def test_equivalent_speed_is_in_sync(self):
+        simulated = simulator(ssh_keys=2)
+        simulated.add_guest("host0", DOMAIN, nic_speed=1000, ssh_key_ids=sorted(simulated.ssh_keys))
+        sl_client = simulated.client()
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, nic_speed="1000Mb"),
+                                catalog=ProductCatalog(sl_client)).sync_config(ChangeLog())
+        self.assertEqual((result["changed"], result["action_performed"]), (False, "nothing"))
+
+
+class UserDataTest(unittest.TestCase):
+    def user_data_server(self, simulated, user_data):
+        return virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, user_data=user_data))
+
+    def read_mask(self, simulated):
+        return [request.mask for request in simulated.requests if request.method == "getObject"][0]
+
+    def test_user_data_is_only_read_when_configured(self):
+        simulated = simulator(ssh_keys=2)
+        simulated.add_guest("host0", DOMAIN, ssh_key_ids=sorted(simulated.ssh_keys), user_data="users: []")
+        result = self.user_data_server(simulated, None).sync_config(ChangeLog())
+        self.assertEqual(result["action_performed"], "nothing")
+        self.assertNotIn("userData", self.read_mask(simulated))
+        simulated.reset_calls()
+        result = self.user_data_server(simulated, "users: []").sync_config(ChangeLog())
+        self.assertEqual(result["action_performed"], "nothing")
+        self.assertNotIn("warnings", result)
+        self.assertIn("userData", self.read_mask(simulated))
+        self.assertEqual(simulated.call_count("Virtual_Guest", "getObject"), 1)
+
+    def test_changed_user_data_is_only_reported(self):
+        simulated = simulator(ssh_keys=2)
+        simulated.add_guest("host0", DOMAIN, ssh_key_ids=sorted(simulated.ssh_keys), user_data="users: []")
+        change_log = ChangeLog()
+        result = self.user_data_server(simulated, "users: [admin]").sync_config(change_log)
+        self.assertEqual((result["changed"], result["action_performed"]), (False, "nothing"))
+        self.assertEqual(change_log.to_dict(), {"user_data": {"old": "users: []", "new": "users: [admin]"}})
+        self.assertEqual(change_log.plan(), {})
+        self.assertEqual(len(result["warnings"]), 1)
+
+
+class NoWaitTest(unittest.TestCase):
+    def test_create_returns_a_job(self):
+        simulated = simulator(ssh_keys=2)
+        result = virtual_server(simulated, instance_config(fqdn="new." + DOMAIN), wait=0).sync_config(ChangeLog())
+        self.assertEqual((result["action_performed"], result["job"]["expected_state"]), ("created", "running"))
+        self.assertEqual(result["job"]["id"], guests_by_fqdn(simulated)["new." + DOMAIN]["id"])
+        self.assertEqual(simulated.call_count("Virtual_Guest", "getObject"), 0)
+
+    def test_present_instance_is_not_created_without_wait(self):
+        for check_mode in [True, False]:
+            simulated = simulator(ssh_keys=2)
+            vs = virtual_server(simulated, instance_config(fqdn="new." + DOMAIN, state="present"), wait=0,
+                                check_mode=check_mode)
+            self.assertRaises(VSException, vs.sync_config, ChangeLog())
+            self.assertEqual(simulated.guests, {})
+
+    def test_existing_instance_is_powered_off_without_wait(self):
+        simulated = simulator(guests=1, ssh_keys=2)
+        result = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, state="present"), wait=0) \
+            .sync_config(ChangeLog())
+        self.assertEqual((result["action_performed"], result["job"]["expected_state"]), ("stopped", "present"))
+
+
+class CatalogTest(unittest.TestCase):
+    def catalog_server(self, simulated, config, **kwargs):
+        return virtual_server(simulated, config, catalog=ProductCatalog(simulated.client()), **kwargs)
+
+    def test_existing_instance_with_retired_option_is_in_sync(self):
+        for check_mode in [True, False]:
+            simulated = simulator(ssh_keys=2)
+            simulated.add_guest("legacy", DOMAIN, os_code="RETIRED_64", ssh_key_ids=sorted(simulated.ssh_keys))
+            result = self.catalog_server(simulated, instance_config(fqdn="legacy." + DOMAIN, os_code="RETIRED_64"),
+                                         check_mode=check_mode).sync_config(ChangeLog())
+            self.assertEqual((result["changed"], result["action_performed"]), (False, "nothing"))
+            self.assertEqual(simulated.call_count("Virtual_Guest", "getCreateObjectOptions"), 0)
+
+    def test_new_instance_is_validated_before_it_is_ordered(self):
+        for check_mode in [True, False]:
+            simulated = simulator(ssh_keys=2)
+            vs = self.catalog_server(simulated, instance_config(fqdn="new." + DOMAIN, os_code="RETIRED_64"),
+                                     check_mode=check_mode)
+            self.assertRaises(VSException, vs.sync_config, ChangeLog())
+            self.assertEqual(simulated.call_count("Virtual_Guest", "createObject"), 0)
+
+    def test_only_changed_sizes_are_validated_for_an_upgrade(self):
+        simulated = simulator(ssh_keys=2)
+        simulated.add_guest("legacy", DOMAIN, os_code="RETIRED_64", ssh_key_ids=sorted(simulated.ssh_keys))
+        result = self.catalog_server(simulated, instance_config(fqdn="legacy." + DOMAIN, os_code="RETIRED_64",
+                                                                RAM="2GB")).sync_config(ChangeLog())
+        self.assertEqual(result["action_performed"], "upgraded")
+        vs = self.catalog_server(simulated, instance_config(fqdn="legacy." + DOMAIN, os_code="RETIRED_64",
+                                                            RAM="128GB"))
+        self.assertRaises(VSException, vs.sync_config, ChangeLog())
+        self.assertEqual(guests_by_fqdn(simulated)["legacy." + DOMAIN]["maxMemory"], 2048)
+
+
+class OrderVerifierTest(unittest.TestCase):
+    def verifying_server(self, simulated, order_verifier, **params):
+        return virtual_server(simulated, instance_config(fqdn="new." + DOMAIN, **params), order_verifier=order_verifier)
+
+    def test_order_faults_are_remembered_for_the_run(self):
+        simulated = simulator(ssh_keys=2)
+        order_verifier = OrderVerifier(simulated.client(), no_cache())
+        for i in range(2):
+            vs = self.verifying_server(simulated, order_verifier, os_code="RETIRED_64")
+            self.assertRaises(VSException, vs.verify_order)
+        self.assertEqual(simulated.call_count("Virtual_Guest", "generateOrderTemplate"), 1)
+
+    def test_transport_errors_are_not_remembered(self):
+        simulated = simulator(ssh_keys=2)
+        generate_order_template = simulated._Virtual_Guest_generateOrderTemplate
+        def unavailable(request):
+            simulated._Virtual_Guest_generateOrderTemplate = generate_order_template
+            raise SoftLayer.TransportError(503, "Service Unavailable")
+        simulated._Virtual_Guest_generateOrderTemplate = unavailable
+        order_verifier = OrderVerifier(simulated.client(), no_cache())
+        self.assertRaises(SoftLayer.TransportError, self.verifying_server(simulated, order_verifier).verify_order)
+        self.verifying_server(simulated, order_verifier).verify_order()
+        self.assertEqual(simulated.call_count("Product_Order", "verifyOrder"), 1)
+
+
+class CreateBeforeDestroyTest(unittest.TestCase):
+    def test_replacement_takes_over_the_hostname(self):
+        simulated = simulator(guests=2, ssh_keys=2)
+        old_id = guests_by_fqdn(simulated)["host0." + DOMAIN]["id"]
+        result = virtual_server(
+            simulated, instance_config(fqdn="host0." + DOMAIN, datacenter="dal05",
+                                       recreate_strategy="create_before_destroy")).sync_config(ChangeLog())
+        self.assertEqual(result["action_performed"], "recreated")
+        new_guest = guests_by_fqdn(simulated)["host0." + DOMAIN]
+        self.assertNotEqual(new_guest["id"], old_id)
+        self.assertEqual(new_guest["datacenter"]["name"], "dal05")
+        self.assertEqual(result["job"]["id"], new_guest["id"])
+        self.assertEqual(simulated.guests[old_id]["_transaction"].name, "RECLAIM_WAIT")
+        self.assertTrue(simulated.guests[old_id]["hostname"].startswith("host0-old-"))
+
+    def test_requires_wait(self):
+        simulated = simulator(guests=2, ssh_keys=2)
+        vs = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, datacenter="dal05",
+                                                       recreate_strategy="create_before_destroy"), wait=0)
+        self.assertRaises(VSException, vs.sync_config, ChangeLog())
+
+
+class SparePoolTest(unittest.TestCase):
+    def pool_server(self, simulated, fqdn, **kwargs):
+        return virtual_server(simulated, instance_config(fqdn=fqdn),
+                              spare_pool=SparePool(simulated.client(), 2, "spares.local"), **kwargs)
+
+    def spares(self, simulated):
+        return [guest for guest in simulated.guests.values() if guest["domain"] == "spares.local"]
+
+    def test_pool_is_filled_with_powered_off_spares(self):
+        simulated = simulator(ssh_keys=2)
+        result = self.pool_server(simulated, "new." + DOMAIN).fill_spare_pool()
+        self.assertEqual((result["changed"], result["spare_pool"]["created"]), (True, 2))
+        self.assertEqual([spare["powerState"]["keyName"] for spare in self.spares(simulated)], ["HALTED"] * 2)
+        result = self.pool_server(simulated, "new." + DOMAIN).fill_spare_pool()
+        self.assertFalse(result["changed"])
+
+    def test_filled_pool_is_claimed(self):
+        simulated = simulator(ssh_keys=2)
+        self.pool_server(simulated, "new." + DOMAIN).fill_spare_pool()
+        started_at = simulated.clock.time()
+        result = self.pool_server(simulated, "new." + DOMAIN).sync_config(ChangeLog())
+        self.assertEqual(result["action_performed"], "created")
+        self.assertLess(simulated.clock.time() - started_at, simulated.provision_time)
+        self.assertEqual(guests_by_fqdn(simulated)["new." + DOMAIN]["powerState"]["keyName"], "RUNNING")
+        self.assertEqual(len(self.spares(simulated)), 2)
+
+    def test_failed_refill_does_not_fail_the_claim(self):
+        simulated = simulator(ssh_keys=2)
+        self.pool_server(simulated, "new." + DOMAIN).fill_spare_pool()
+        def out_of_capacity(request):
+            raise SoftLayer.SoftLayerAPIError("SoftLayer_Exception_Public", "Out of capacity")
+        simulated._Virtual_Guest_createObject = out_of_capacity
+        result = self.pool_server(simulated, "new." + DOMAIN).sync_config(ChangeLog())
+        self.assertEqual((result["changed"], result["action_performed"]), (True, "created"))
+        self.assertEqual(len(result["warnings"]), 1)
+        self.assertIn("Out of capacity", result["warnings"][0])
+        self.assertEqual(result["job"]["id"], guests_by_fqdn(simulated)["new." + DOMAIN]["id"])
+        self.assertEqual(len(self.spares(simulated)), 1)
+
+    def test_check_mode_only_lists_the_spares(self):
+        simulated = simulator(ssh_keys=2)
+        result = self.pool_server(simulated, "new." + DOMAIN, check_mode=True).fill_spare_pool()
+        self.assertEqual(result["spare_pool"]["created"], 2)
+        self.assertEqual(self.spares(simulated), [])
+        self.assertEqual(simulated.calls, [("Account", "getVirtualGuests")])
+
+
+class FleetTest(unittest.TestCase):
+    def fleet(self, simulated, instance_configs):
+        sl_client = simulated.client()
+        return SoftlayerVirtualServerFleet(sl_client, instance_configs, 3600, len(instance_configs),
+                                           instance_id_index(simulated), waiter(simulated),
+                                           SshKeyIndex(sl_client), ImageIndex(sl_client))
+
+    def test_fleet_takes_about_as_long_as_its_slowest_instance(self):
+        simulated = simulator(ssh_keys=2)
+        started_at = simulated.clock.time()
+        virtual_server(simulated, instance_config(fqdn="single." + DOMAIN)).sync_config(ChangeLog())
+        single_time = simulated.clock.time() - started_at
+        started_at = simulated.clock.time()
+        result = self.fleet(simulated, [instance_config(fqdn="new{}.{}".format(i, DOMAIN)) for i in range(20)]) \
+            .sync_config()
+        self.assertFalse(result["failed"])
+        self.assertLess(simulated.clock.time() - started_at, 1.5 * single_time)
+
+    def test_fleet_waits_are_polled_together(self):
+        simulated = simulator(ssh_keys=2)
+        virtual_server(simulated, instance_config(fqdn="single." + DOMAIN)).sync_config(ChangeLog())
+        single_polls = simulated.call_count("Virtual_Guest", "getObject")
+        simulated.reset_calls()
+        result = self.fleet(simulated, [instance_config(fqdn="new{}.{}".format(i, DOMAIN)) for i in range(50)]) \
+            .sync_config()
+        self.assertFalse(result["failed"])
+        self.assertTrue(all(guest["provisionDate"] for guest in simulated.guests.values()))
+        self.assertEqual(simulated.call_count("Virtual_Guest", "getObject"), 0)
+#       a listing for the first poll of every instance, then about one per
+#       poll interval instead of one per instance and interval
+        self.assertLess(simulated.call_count("Account", "getVirtualGuests"), 50 + 2 * single_polls)
+
+    def test_only_instances_to_be_created_are_verified(self):
+        simulated = simulator(ssh_keys=2)
+        simulated.add_guest("legacy", DOMAIN, os_code="RETIRED_64", ssh_key_ids=sorted(simulated.ssh_keys))
+        fleet = self.fleet(simulated, [instance_config(fqdn="legacy." + DOMAIN, os_code="RETIRED_64"),
+                                       instance_config(fqdn="new." + DOMAIN)])
+        fleet.order_verifier = OrderVerifier(simulated.client(), no_cache())
+        result = fleet.sync_config()
+        self.assertFalse(result["failed"])
+        self.assertEqual(result["results"]["legacy." + DOMAIN]["action_performed"], "nothing")
+        self.assertEqual(result["results"]["new." + DOMAIN]["action_performed"], "created")
+        self.assertEqual(simulated.call_count("Virtual_Guest", "generateOrderTemplate"), 1)
+
+    def test_new_instances_are_validated_before_any_change(self):
+        simulated = simulator(ssh_keys=2)
+        simulated.add_guest("legacy", DOMAIN, os_code="RETIRED_64", ssh_key_ids=sorted(simulated.ssh_keys))
+        fleet = self.fleet(simulated, [instance_config(fqdn="legacy." + DOMAIN, os_code="RETIRED_64", CPUs="2"),
+                                       instance_config(fqdn="new." + DOMAIN, os_code="RETIRED_64")])
+        fleet.catalog = ProductCatalog(simulated.client())
+        result = fleet.sync_config()
+        self.assertTrue(result["failed"])
+        self.assertNotIn("failed", result["results"]["legacy." + DOMAIN])
+        self.assertIn("os_code RETIRED_64", result["results"]["new." + DOMAIN]["msg"])
+        self.assertEqual(simulated.call_count("Virtual_Guest", "getCreateObjectOptions"), 1)
+        self.assertEqual(simulated.call_count("Product_Order", "placeOrder"), 0)
+
+    def test_unorderable_new_instance_stops_the_fleet(self):
+        simulated = simulator(guests=1, ssh_keys=2)
+        fleet = self.fleet(simulated, [instance_config(fqdn="host0." + DOMAIN, CPUs="2"),
+                                       instance_config(fqdn="new." + DOMAIN, os_code="RETIRED_64")])
+        fleet.order_verifier = OrderVerifier(simulated.client(), no_cache())
+        result = fleet.sync_config()
+        self.assertTrue(result["failed"])
+        self.assertEqual(result["results"]["host0." + DOMAIN]["change_log"], {})
+        self.assertEqual(simulated.call_count("Virtual_Guest", "createObject"), 0)
+
+    def test_entries_are_checked_against_the_argument_spec(self):
+        params = dict((name, spec.get("default")) for name, spec in VSInstanceConfig.arg_spec().items())
+        params.update(datacenter="ams01", os_code="DEBIAN_7_64")
+        instance_configs = VSInstanceConfig.from_fleet_config(
+            dict(params, instances=[{"fqdn": "host0." + DOMAIN, "private": "yes", "dedicated": "no", "CPUs": 4}]))
+        self.assertEqual((instance_configs[0].private, instance_configs[0].dedicated, instance_configs[0].CPUs),
+                         (True, False, 4))
+        for instance in [{"fqdn": "host0." + DOMAIN, "cpus": 4},
+                         {"fqdn": "host0." + DOMAIN, "private": "maybe"},
+                         {"fqdn": "host0." + DOMAIN, "state": "gone"},
+                         {"fqdn": "host0." + DOMAIN, "wait": 0}]:
+            self.assertRaises(ValueError, VSInstanceConfig.from_fleet_config, dict(params, instances=[instance]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from simulated import *
+from softlayer_vs_wait import VSJobs, VSJobsWaiter
+
+
+def jobs_waiter(simulated, jobs, wait=3600):
+    return VSJobsWaiter(simulated.client(), VSJobs({"jobs": jobs}), wait, waiter(simulated))
+
+
+class VSJobsTest(unittest.TestCase):
+    def test_jobs_are_found_in_registered_results(self):
+        job = {"id": 1, "fqdn": "host0." + DOMAIN, "expected_state": "running", "started_at": None}
+        fleet_result = {"results": {"host0." + DOMAIN: {"job": job}, "host1." + DOMAIN: {"changed": False}}}
+        self.assertEqual(VSJobs({"jobs": [fleet_result]}).jobs, {1: job})
+        self.assertEqual(VSJobs({"jobs": [{"job": job}, job]}).jobs, {1: job})
+
+    def test_job_without_id_is_rejected(self):
+        self.assertRaises(ValueError, VSJobs, {"jobs": [{"fqdn": "host0." + DOMAIN, "expected_state": "running"}]})
+
+
+class VSJobsWaiterTest(unittest.TestCase):
+    def test_jobs_started_without_wait_are_waited_for(self):
+        simulated = simulator(ssh_keys=2)
+        jobs = [virtual_server(simulated, instance_config(fqdn="new{}.{}".format(i, DOMAIN)), wait=0)
+                .sync_config(ChangeLog())["job"] for i in range(10)]
+        self.assertEqual(set(job["expected_state"] for job in jobs), set(["running"]))
+        self.assertEqual(len(set(job["id"] for job in jobs)), 10)
+        simulated.reset_calls()
+        result = jobs_waiter(simulated, jobs).wait()
+        self.assertFalse(result["failed"])
+        self.assertTrue(all(job_result["done"] for job_result in result["results"].values()))
+#       the jobs are polled together, one call per poll
+        self.assertEqual(simulated.call_count(), simulated.call_count("Account", "getVirtualGuests"))
+        self.assertEqual(simulated.call_count(), result["wait_stats"]["polls"])
+
+    def test_canceled_instance_is_done_once_gone(self):
+        simulated = simulator(guests=1, ssh_keys=2)
+        job = virtual_server(simulated, instance_config(fqdn="host0." + DOMAIN, state="absent"), wait=0) \
+            .sync_config(ChangeLog())["job"]
+        self.assertEqual(job["expected_state"], "absent")
+        result = jobs_waiter(simulated, [job]).wait()
+        self.assertTrue(result["results"]["host0." + DOMAIN]["done"])
+        self.assertEqual(simulated.guests, {})
+
+    def test_unfinished_job_fails(self):
+        simulated = simulator(ssh_keys=2)
+        job = virtual_server(simulated, instance_config(fqdn="new." + DOMAIN), wait=0).sync_config(ChangeLog())["job"]
+        result = jobs_waiter(simulated, [job], wait=10).wait()
+        self.assertTrue(result["failed"])
+        self.assertFalse(result["results"]["new." + DOMAIN]["done"])
+
+
+if __name__ == '__main__':
+    unittest.main()